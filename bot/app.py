@@ -6,12 +6,24 @@ Socket Mode接続でngrok/HTTPS不要
 
 import logging
 import os
-import time
 
 from dotenv import load_dotenv
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
+from utils.exporter import AuthorizeExporter
+from utils.maintenance import MaintenanceScheduler
+from utils.metrics import JsonLinesExporter, LoggingExporter
+from utils.radcheck import RadcheckWriter
 from utils.radius import RadiusManager
+from utils.reload import ReloadCoordinator, command_reloader, signal_reloader
+from utils.rest import AuthorizeLookupServer
+from utils.sharded import ShardedRadiusManager
+from utils.store import (
+    FileUserStore,
+    SQLiteUserStore,
+    UserExistsError,
+    UserNotFoundError,
+)
 
 # 環境変数読み込み
 load_dotenv()
@@ -49,13 +61,119 @@ slack_logger.setLevel(logging.DEBUG)
 
 # RADIUS管理インスタンス（安全な初期化）
 radius_manager = None
+user_store = None
+reload_coordinator = None
 try:
-    radius_manager = RadiusManager("/app/radius/authorize")
-    logger.info("✅ RadiusManager initialized successfully")
+    radius_options = dict(
+        # 複数プロセスで共有するロックファイル等の置き場所
+        state_dir=os.environ.get("RADIUS_STATE_DIR") or None,
+        lock_timeout=float(os.environ.get("RADIUS_LOCK_TIMEOUT", "10")),
+        concurrency=os.environ.get("RADIUS_CONCURRENCY", "lock"),
+        durability=os.environ.get("RADIUS_DURABILITY", "file"),
+        # 全体の書換で置き換えた版を保持する世代数と合計サイズ（0で無効）
+        snapshots=int(os.environ.get("RADIUS_SNAPSHOTS", "10")),
+        snapshot_max_bytes=int(
+            os.environ.get("RADIUS_SNAPSHOT_MAX_BYTES", str(64 << 20))
+        ),
+        snapshot_compress=os.environ.get(
+            "RADIUS_SNAPSHOT_COMPRESS", "false"
+        ).lower() in {"1", "true", "yes", "on"},
+    )
+    radius_shards = int(os.environ.get("RADIUS_SHARDS", "0"))
+    if radius_shards > 0:
+        # ユーザーをauthorize.d/shard-*に分け、変更は対象シャードだけを書き換える
+        radius_manager = ShardedRadiusManager(
+            "/app/radius/authorize", shards=radius_shards, **radius_options
+        )
+    else:
+        radius_manager = RadiusManager(
+            "/app/radius/authorize", **radius_options
+        )
+    radius_backend = os.environ.get("RADIUS_BACKEND", "file")
+    if radius_backend == "sqlite":
+        # SQLiteを正とし、authorizeは変更があった分だけ書き出す
+        user_store = SQLiteUserStore(
+            os.environ.get("RADIUS_DB_PATH")
+            or os.path.join(
+                radius_options["state_dir"] or "/app/radius", "users.db"
+            ),
+            durability=radius_options["durability"],
+        )
+        AuthorizeExporter(
+            user_store,
+            radius_manager,
+            interval=float(os.environ.get("RADIUS_EXPORT_INTERVAL", "5")),
+        ).start()
+    else:
+        user_store = FileUserStore(radius_manager)
+    rest_port = int(os.environ.get("RADIUS_REST_PORT", "0"))
+    if rest_port > 0:
+        # rlm_restからのユーザーごとの問い合わせに公開済みのインデックスで応答する
+        AuthorizeLookupServer(
+            radius_manager,
+            host=os.environ.get("RADIUS_REST_HOST", "0.0.0.0"),
+            port=rest_port,
+        ).start()
+    radcheck_db = os.environ.get("RADIUS_RADCHECK_DB")
+    if radcheck_db:
+        # rlm_sql用のradcheck/radreplyにもコミットごとに反映する（再読込不要）
+        RadcheckWriter(
+            radcheck_db, durability=radius_options["durability"]
+        ).attach(radius_manager)
+    # 所要時間が閾値以上の操作はフェーズごとの内訳（ロック待ち・読込・書込等）を記録する
+    radius_manager.metrics.add_exporter(
+        LoggingExporter(
+            min_total_ms=float(os.environ.get("RADIUS_SLOW_OP_MS", "200"))
+        )
+    )
+    if os.environ.get("RADIUS_METRICS_FILE"):
+        radius_manager.metrics.add_exporter(
+            JsonLinesExporter(os.environ["RADIUS_METRICS_FILE"])
+        )
+    logger.info(
+        "✅ RadiusManager initialized successfully | backend=%s",
+        user_store.backend,
+    )
+    radius_watch = os.environ.get("RADIUS_WATCH", "off")
+    if radius_watch in ("inotify", "poll"):
+        # 手作業での編集を検知してインデックスを作り直し、参照時のstatを省く
+        radius_manager.watch(
+            poll_interval=float(os.environ.get("RADIUS_WATCH_INTERVAL", "5")),
+            use_inotify=radius_watch == "inotify",
+        )
+    # authorizeの変更をまとめてFreeRADIUSに再読込させる（HUPまたはradmin）
+    if os.environ.get("RADIUS_RELOAD_COMMAND"):
+        reloader = command_reloader(os.environ["RADIUS_RELOAD_COMMAND"])
+    elif os.environ.get("RADIUS_RELOAD_PID_FILE"):
+        reloader = signal_reloader(
+            pid_file=os.environ["RADIUS_RELOAD_PID_FILE"]
+        )
+    elif os.environ.get("RADIUS_RELOAD_PID"):
+        reloader = signal_reloader(pid=int(os.environ["RADIUS_RELOAD_PID"]))
+    else:
+        reloader = None
+    if reloader is not None:
+        reload_coordinator = ReloadCoordinator(
+            reloader,
+            quiet=float(os.environ.get("RADIUS_RELOAD_QUIET", "1")),
+            max_delay=float(os.environ.get("RADIUS_RELOAD_MAX_DELAY", "10")),
+        ).start()
+        # Slackコマンドの変更もsqliteバックエンドの書き出しも、authorizeへの
+        # コミットとしてここから1回だけ通知される
+        radius_manager.add_commit_listener(reload_coordinator.on_commit)
+    # サニタイズ等の全行走査はバックグラウンドで定期実行する
+    MaintenanceScheduler(
+        radius_manager,
+        interval=float(os.environ.get("RADIUS_MAINTENANCE_INTERVAL", "3600")),
+        dirty_threshold=int(
+            os.environ.get("RADIUS_MAINTENANCE_DIRTY_THRESHOLD", "200")
+        ),
+    ).start()
 except Exception as e:
     logger.error(f"❌ RadiusManager initialization failed: {e}", exc_info=True)
     # 初期化に失敗してもBotは起動する（機能制限あり）
 
+
 # Slack App初期化（Socket Mode）
 app = App(
     token=os.environ.get("SLACK_BOT_TOKEN"),
@@ -97,27 +215,29 @@ def handle_radius_register(ack, respond, command):
         logger.info(f"User ID: {user_id}")
 
         # RADIUS管理インスタンスの確認
-        if radius_manager is None:
+        if user_store is None:
             respond("❌ RADIUS管理システムが利用できません。")
             return
 
-        # 既存ユーザーチェック
+        # 既存ユーザーチェック + アカウント作成（読込1回・書込最大1回）
         username = f"user_{user_id}"
-        existing_user = radius_manager.get_user(username)
-        if existing_user:
+        logger.debug("[App] add_user start | user=%s", username)
+
+        # fileバックエンドでは同時に届いた登録がグループコミットでまとめて書き込まれる
+        # （内訳にはライタースレッドでのロック待ち・書込・fsyncも含まれる）
+        try:
+            with radius_manager.metrics.operation("radius_register") as trace:
+                password, nt_hash = user_store.add_user(username)
+        except UserExistsError:
             respond("❌ 既にRADIUSアカウントが登録されています。")
             return
 
-        # アカウント作成
-        logger.debug("[App] add_user start | user=%s", username)
-        start_ms = time.perf_counter()
-        password, nt_hash = radius_manager.add_user(username)
-        took_ms = int((time.perf_counter() - start_ms) * 1000)
         logger.info(
-            "[App] add_user done | user=%s took_ms=%d "
+            "[App] add_user done | user=%s took_ms=%d %s "
             "pwd_sample=%s hash_sample=%s",
             username,
-            took_ms,
+            int(trace.total_ms),
+            trace.format(),
             _mask_secret(password),
             _mask_secret(nt_hash, keep=6),
         )
@@ -171,18 +291,16 @@ def handle_radius_resetpass(ack, respond, command):
         user_id = command['user_id']
         username = f"user_{user_id}"
 
-        # ユーザー存在確認
-        user_info = radius_manager.get_user(username)
-        if not user_info:
+        # ユーザー存在確認 + パスワードリセット（読込1回・書込最大1回）
+        try:
+            new_password, _ = user_store.update_user_password(username)
+        except UserNotFoundError:
             respond(
                 "❌ RADIUSアカウントが見つかりません。"
                 "`/radius_register` でアカウントを作成してください。"
             )
             return
 
-        # パスワードリセット
-        new_password, _ = radius_manager.update_user_password(username)
-
         # 成功メッセージ
         success_message = f"""
 ✅ **パスワードリセット完了**
@@ -219,7 +337,7 @@ def handle_radius_status(ack, respond, command):
         username = f"user_{user_id}"
 
         # ユーザー存在確認
-        user_info = radius_manager.get_user(username)
+        user_info = user_store.get_user(username)
         if not user_info:
             respond(
                 "❌ RADIUSアカウントが見つかりません。"
@@ -262,7 +380,7 @@ def handle_radius_unregister(ack, respond, command):
         username = f"user_{user_id}"
 
         # ユーザー削除
-        success = radius_manager.delete_user(username)
+        success = user_store.delete_user(username)
         if not success:
             respond("❌ RADIUSアカウントが見つかりません。")
             return
@@ -0,0 +1 @@
+# 開発時の計測用ベンチマーク（Bot本体からは読み込まない）
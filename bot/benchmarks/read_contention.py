@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+書込が続く中での参照レイテンシのベンチマーク
+書込側のロック内で参照する方式と、公開済みのインデックスの版を参照する方式を
+一時ファイルで比較する（python -m benchmarks.read_contention）
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from utils.radius import NT_HASH_LENGTH, RadiusManager
+
+
+def bench_read_contention(
+    users: int = 2000,
+    readers: int = 4,
+    seconds: float = 3.0,
+    serialize: bool = False,
+    durability: str = "full",
+) -> Dict[str, float]:
+    """
+    書込が続く中での参照（get_user）のレイテンシとスループットを計測
+
+    Args:
+        users: authorizeに登録するユーザー数
+        readers: 参照スレッド数
+        seconds: 計測時間（秒）
+        serialize: 参照を書込側のロック内で行う（公開済みの版を使わない
+            以前の方式の再現）
+        durability: 書込の永続性レベル（fullで書込1回あたりの時間が長くなる）
+
+    Returns:
+        {'reads', 'reads_per_sec', 'p50_ms', 'p99_ms', 'max_ms',
+        'slow_reads'（1ms超の参照数）, 'writes'}
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "authorize")
+        with open(path, "w", encoding="utf-8") as wf:
+            for i in range(users):
+                wf.write(
+                    f"\nbench{i:06d}\tNT-Password := \"{'0' * 32}\"\n"
+                    f"\tReply-Message := \"Welcome bench{i:06d}\"\n"
+                )
+        manager = RadiusManager(path, state_dir=workdir, durability=durability)
+        names = [f"bench{i:06d}" for i in range(users)]
+        stop = threading.Event()
+        latencies: List[List[float]] = [[] for _ in range(readers)]
+        writes = [0]
+
+        def _write() -> None:
+            i = 0
+            while not stop.is_set():
+                # 削除と追加を交互に行い、全体の書換を発生させる
+                name = names[i % users]
+                manager.delete_user(name)
+                manager.add_user(name, nt_hash='1' * NT_HASH_LENGTH,
+                                 password="")
+                writes[0] += 2
+                i += 1
+
+        def _read(out: List[float]) -> None:
+            rng = random.Random(len(out))
+            while not stop.is_set():
+                name = names[rng.randrange(users)]
+                start = time.perf_counter()
+                if serialize:
+                    with manager._lock:
+                        manager.get_user(name)
+                else:
+                    manager.get_user(name)
+                out.append((time.perf_counter() - start) * 1000.0)
+
+        threads = [threading.Thread(target=_write)] + [
+            threading.Thread(target=_read, args=(latencies[n],))
+            for n in range(readers)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        manager.close()
+
+    merged = sorted(value for values in latencies for value in values)
+    return {
+        'reads': len(merged),
+        'reads_per_sec': len(merged) / seconds,
+        'p50_ms': merged[len(merged) // 2] if merged else 0.0,
+        'p99_ms': (
+            merged[min(len(merged) - 1, int(len(merged) * 0.99))]
+            if merged else 0.0
+        ),
+        'max_ms': merged[-1] if merged else 0.0,
+        'slow_reads': sum(1 for value in merged if value > 1.0),
+        'writes': writes[0],
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """コマンドラインエントリポイント: 書込中の参照のレイテンシを方式ごとに比較"""
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.read_contention",
+        description="書込が続く中での参照レイテンシを計測（一時ファイルを使用）",
+    )
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument(
+        "--durability",
+        choices=RadiusManager.DURABILITY_LEVELS,
+        default=os.environ.get("RADIUS_DURABILITY", "file"),
+        help="書込の永続性レベル",
+    )
+    args = parser.parse_args(argv)
+
+    for label, serialize in (("locked", True), ("snapshot", False)):
+        stats = bench_read_contention(
+            users=args.users,
+            readers=args.readers,
+            seconds=args.seconds,
+            serialize=serialize,
+            durability=args.durability,
+        )
+        print(
+            f"{label:<8} reads={stats['reads']} "
+            f"reads/s={stats['reads_per_sec']:.0f} "
+            f"p50={stats['p50_ms']:.3f}ms p99={stats['p99_ms']:.3f}ms "
+            f"max={stats['max_ms']:.1f}ms slow(>1ms)={stats['slow_reads']} "
+            f"writes={stats['writes']}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+rlm_rest用authorizeエンドポイントのベンチマーク
+一時ファイルのauthorizeでサーバを起動し、ローカルのKeep-Aliveクライアントから
+レイテンシとスループットを計測する（python -m benchmarks.rest）
+"""
+
+import argparse
+import http.client
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from utils.radius import RadiusManager
+from utils.rest import AUTHORIZE_PATH, AuthorizeLookupServer
+
+
+def _bench_worker(
+    address: tuple,
+    usernames: List[str],
+    count: int,
+    latencies: List[float],
+) -> None:
+    conn = http.client.HTTPConnection(address[0], address[1])
+    try:
+        for i in range(count):
+            username = usernames[i % len(usernames)]
+            start = time.perf_counter()
+            conn.request("GET", f"{AUTHORIZE_PATH}/{username}")
+            response = conn.getresponse()
+            response.read()
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            if response.status != 200:
+                raise RuntimeError(
+                    f"unexpected status {response.status} for {username}"
+                )
+    finally:
+        conn.close()
+
+
+def bench(
+    users: int = 1000, requests: int = 10000, concurrency: int = 4
+) -> Dict[str, float]:
+    """
+    一時ファイルのauthorizeでサーバを起動し、ローカルのクライアントから計測
+
+    Args:
+        users: authorizeに登録するユーザー数
+        requests: 問い合わせの総数
+        concurrency: 同時接続数（接続ごとにKeep-Aliveで連続して問い合わせる）
+
+    Returns:
+        {'requests', 'seconds', 'rps', 'avg_ms', 'p50_ms', 'p99_ms', 'max_ms'}
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "authorize")
+        with open(path, "w", encoding="utf-8") as wf:
+            for i in range(users):
+                wf.write(
+                    f"\nbench{i:06d}\tNT-Password := \"{'0' * 32}\"\n"
+                    f"\tReply-Message := \"Welcome bench{i:06d}\"\n"
+                )
+        manager = RadiusManager(path, state_dir=workdir)
+        server = AuthorizeLookupServer(manager, port=0).start()
+        try:
+            usernames = [f"bench{i:06d}" for i in range(users)]
+            per_worker = max(1, requests // concurrency)
+            results: List[List[float]] = [[] for _ in range(concurrency)]
+            threads = [
+                threading.Thread(
+                    target=_bench_worker,
+                    args=(server.address, usernames, per_worker, results[n]),
+                )
+                for n in range(concurrency)
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - start
+        finally:
+            server.stop()
+            manager.close()
+
+    latencies = sorted(value for values in results for value in values)
+    if not latencies:
+        raise RuntimeError("no request completed")
+    return {
+        'requests': len(latencies),
+        'seconds': seconds,
+        'rps': len(latencies) / seconds,
+        'avg_ms': sum(latencies) / len(latencies),
+        'p50_ms': latencies[len(latencies) // 2],
+        'p99_ms': latencies[
+            min(len(latencies) - 1, int(len(latencies) * 0.99))
+        ],
+        'max_ms': latencies[-1],
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    コマンドラインエントリポイント（python -m benchmarks.rest）
+
+    ローカルのクライアントでレイテンシとスループットを計測する。
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.rest",
+        description="rlm_rest用authorizeエンドポイントのベンチマーク",
+    )
+    parser.add_argument(
+        "--users", type=int, default=1000, help="登録するユーザー数"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=10000, help="問い合わせの総数"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="同時接続数"
+    )
+    args = parser.parse_args(argv)
+
+    stats = bench(args.users, args.requests, args.concurrency)
+    print(
+        f"requests={stats['requests']} seconds={stats['seconds']:.2f} "
+        f"rps={stats['rps']:.0f}"
+    )
+    print(
+        f"latency: avg={stats['avg_ms']:.3f}ms p50={stats['p50_ms']:.3f}ms "
+        f"p99={stats['p99_ms']:.3f}ms max={stats['max_ms']:.3f}ms"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
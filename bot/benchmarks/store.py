@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+ユーザーストアのバックエンド比較ベンチマーク
+file / memory / sqlite の各バックエンドを一時ディレクトリで計測する
+（python -m benchmarks.store）
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from utils.password import PasswordManager
+from utils.radius import RadiusManager
+from utils.store import BACKENDS, UserStore, open_store
+
+
+def _measure(
+    timings: Dict[str, List[float]], name: str, func: Any, *args: Any
+) -> Any:
+    start = time.perf_counter()
+    result = func(*args)
+    timings.setdefault(name, []).append(
+        (time.perf_counter() - start) * 1000.0
+    )
+    return result
+
+
+def bench(store: UserStore, users: int) -> Dict[str, Dict[str, float]]:
+    """
+    1ストアに対して追加・取得・更新・一覧・削除の所要時間を計測
+
+    パスワードのハッシュ計算は事前に済ませ、追加の計測には含めない。
+
+    Args:
+        store: 対象のストア（空であること）
+        users: 投入するユーザー数
+
+    Returns:
+        操作名→{'count', 'avg_ms', 'p95_ms', 'max_ms'} の辞書
+    """
+    names = [f"bench{i:06d}" for i in range(users)]
+    nt_hash = PasswordManager.generate_nt_hash("bench-password")
+    timings: Dict[str, List[float]] = {}
+    for username in names:
+        _measure(timings, "add", store.add_user, username, "", nt_hash)
+    for username in names:
+        _measure(timings, "get", store.get_user, username)
+    for username in names[:: max(1, users // 100)]:
+        _measure(timings, "update", store.update_user_password, username)
+    _measure(timings, "list", store.list_users)
+    for username in names:
+        _measure(timings, "delete", store.delete_user, username)
+
+    result: Dict[str, Dict[str, float]] = {}
+    for name, values in timings.items():
+        ordered = sorted(values)
+        p95 = min(len(ordered) - 1, int(len(ordered) * 0.95))
+        result[name] = {
+            'count': len(ordered),
+            'avg_ms': sum(ordered) / len(ordered),
+            'p95_ms': ordered[p95],
+            'max_ms': ordered[-1],
+        }
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    コマンドラインエントリポイント（python -m benchmarks.store）
+
+    一時ディレクトリ上の各バックエンドでベンチマークを実行する。
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.store",
+        description="ユーザーストアのバックエンド比較ベンチマーク",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        action="append",
+        help="計測するバックエンド（複数指定可、未指定時は全て）",
+    )
+    parser.add_argument(
+        "--users", type=int, default=1000, help="投入するユーザー数"
+    )
+    parser.add_argument(
+        "--durability",
+        choices=RadiusManager.DURABILITY_LEVELS,
+        default="file",
+        help="file / sqliteバックエンドの書込の永続性レベル",
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for backend in args.backend or BACKENDS:
+            if backend == "file":
+                path = os.path.join(workdir, "authorize")
+                Path(path).write_text("# Bench authorize file\n")
+                store = open_store(
+                    backend,
+                    path,
+                    state_dir=os.path.join(workdir, "state"),
+                    durability=args.durability,
+                )
+            else:
+                store = open_store(
+                    backend,
+                    os.path.join(workdir, f"{backend}.db"),
+                    durability=args.durability,
+                )
+            try:
+                result = bench(store, args.users)
+            finally:
+                store.close()
+            for name, stats in result.items():
+                print(
+                    f"{backend:<7} {name:<7} n={stats['count']:<6} "
+                    f"avg={stats['avg_ms']:.3f}ms "
+                    f"p95={stats['p95_ms']:.3f}ms "
+                    f"max={stats['max_ms']:.3f}ms"
+                )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
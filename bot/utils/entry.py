@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+authorizeエントリのデータモデル
+ユーザーごとの辞書を使わない省メモリなエントリ表現
+"""
+
+import sys
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+# 旧来の辞書形式で参照できるキー
+_DICT_KEYS = ('username', 'line_start', 'attributes', 'line_end')
+
+
+class UserEntry:
+    """
+    authorizeファイル内の1ユーザー分のエントリ（不変）
+
+    属性は (名前, 値, 名前, 値, ...) のフラットなタプルで保持し、
+    名前と値はsys.internで共有する。インデックスの再構築時にも
+    同じ文字列オブジェクトが再利用される。
+    """
+
+    __slots__ = (
+        'username', 'line_start', 'line_end', 'hash_offset', '_attrs',
+    )
+
+    def __init__(
+        self,
+        username: str,
+        line_start: int,
+        line_end: int,
+        attributes: Iterable[Tuple[str, str]] = (),
+        hash_offset: int = -1,
+    ):
+        """
+        初期化
+
+        Args:
+            username: ユーザー名
+            line_start: ユーザー行の行番号
+            line_end: ブロック最終行（属性行）の行番号
+            attributes: (属性名, 値) の反復可能オブジェクト
+            hash_offset: NT-Password値（32桁16進）のファイル先頭からのバイト位置
+                （固定長で書き換えられない形式の場合は-1）
+        """
+        self.username = sys.intern(username)
+        self.line_start = line_start
+        self.line_end = line_end
+        self.hash_offset = hash_offset
+        flat = []
+        for name, value in attributes:
+            flat.append(sys.intern(name))
+            flat.append(sys.intern(value))
+        self._attrs = tuple(flat)
+
+    def _iter_attrs(self) -> Iterator[Tuple[str, str]]:
+        attrs = self._attrs
+        for i in range(0, len(attrs), 2):
+            yield attrs[i], attrs[i + 1]
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """
+        属性値を取得
+
+        Args:
+            name: 属性名（例: NT-Password）
+            default: 属性がない場合の値
+
+        Returns:
+            属性値
+        """
+        attrs = self._attrs
+        for i in range(0, len(attrs), 2):
+            if attrs[i] == name:
+                return attrs[i + 1]
+        return default
+
+    @property
+    def attributes(self) -> Dict[str, str]:
+        """属性の辞書（呼び出しごとに新しい辞書を返す）"""
+        return dict(self._iter_attrs())
+
+    @property
+    def nt_hash(self) -> Optional[str]:
+        """NT-Passwordの値"""
+        return self.get('NT-Password')
+
+    def with_attribute(self, name: str, value: str) -> "UserEntry":
+        """
+        指定属性だけを差し替えた新しいエントリを返す（行番号・バイト位置は維持）
+
+        Args:
+            name: 属性名
+            value: 新しい値
+
+        Returns:
+            UserEntry
+        """
+        attrs = dict(self._iter_attrs())
+        attrs[name] = value
+        return UserEntry(
+            self.username,
+            self.line_start,
+            self.line_end,
+            attrs.items(),
+            self.hash_offset,
+        )
+
+    def to_dict(self) -> Dict:
+        """旧来の辞書形式（username, line_start, attributes, line_end）に変換"""
+        return {
+            'username': self.username,
+            'line_start': self.line_start,
+            'attributes': self.attributes,
+            'line_end': self.line_end,
+        }
+
+    def __getitem__(self, key: str):
+        # 辞書形式を前提とした既存コード（entry['username'] 等）との互換用
+        if key not in _DICT_KEYS:
+            raise KeyError(key)
+        if key == 'attributes':
+            return self.attributes
+        return getattr(self, key)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, UserEntry):
+            return NotImplemented
+        return (
+            self.username == other.username and
+            self.line_start == other.line_start and
+            self.line_end == other.line_end and
+            self.hash_offset == other.hash_offset and
+            self._attrs == other._attrs
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.username, self.line_start, self._attrs))
+
+    def __repr__(self) -> str:
+        return (
+            f"UserEntry(username={self.username!r}, "
+            f"line_start={self.line_start}, line_end={self.line_end}, "
+            f"attributes={list(self._iter_attrs())!r})"
+        )
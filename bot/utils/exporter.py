@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+SQLiteユーザーストアからFreeRADIUSのauthorizeファイルへの書き出し
+前回の書き出し以降に変更されたユーザーだけを反映し、変更がなければ何もしない
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from functools import partial
+from typing import Dict, List, Optional, Union
+
+from .radius import RadiusManager, RadiusTransaction
+from .sharded import ShardedRadiusManager
+from .store import SQLiteUserStore
+
+logger = logging.getLogger(__name__)
+
+
+def _sync(
+    username: str, nt_hash: Optional[str], tx: RadiusTransaction
+) -> Optional[str]:
+    return tx.sync_user(username, nt_hash)
+
+
+class AuthorizeExporter:
+    """
+    SQLiteUserStoreの内容をauthorizeファイルに反映するバックグラウンドスレッド
+
+    ストアへのコミット通知、またはinterval秒ごとのポーリング（別プロセスからの
+    変更用）で起動し、反映済みの連番以降の変更だけをRadiusManagerの
+    トランザクションで書き込む。反映は冪等で、書込後に連番を記録するため、
+    途中で停止しても次回に同じ変更を再反映するだけで済む。
+    """
+
+    def __init__(
+        self,
+        store: SQLiteUserStore,
+        manager: Union[RadiusManager, ShardedRadiusManager],
+        interval: float = 5.0,
+    ):
+        """
+        初期化
+
+        ストアが一度も変更されていない場合は、既存のauthorizeのユーザーを
+        ストアに取り込む（ファイル運用からの移行）。
+
+        Args:
+            store: 書き出し元のSQLiteUserStore
+            manager: 書き出し先のRadiusManagerまたはShardedRadiusManager
+            interval: 別プロセスからの変更を確認する間隔（秒）
+        """
+        self._store = store
+        self._manager = manager
+        self.interval = interval
+        self.target = str(manager.authorize_file_path)
+        self._export_guard = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if store.change_seq() == 0:
+            imported = store.import_entries(manager.iter_entries())
+            if imported:
+                logger.info(
+                    "[AuthorizeExporter] imported users from authorize | "
+                    "path=%s users=%d",
+                    self.target,
+                    imported,
+                )
+        store.add_commit_listener(self._on_commit)
+
+    def _on_commit(self, op_count: int) -> None:
+        self._wakeup.set()
+
+    def export(self) -> Optional[Dict[str, int]]:
+        """
+        未反映の変更をauthorizeファイルに書き出す
+
+        Returns:
+            {'seq', 'added', 'updated', 'deleted'} の辞書（変更がなければNone）
+        """
+        with self._export_guard:
+            since = self._store.exported_seq(self.target)
+            if since is not None and since == self._store.change_seq():
+                return None
+
+            start = time.perf_counter()
+            seq, users = self._store.read_changes(since)
+            if since is None:
+                # 初回はストアにないユーザーをファイルから消す（全件の突き合わせ）。
+                # NT-PasswordのないDEFAULT等のエントリは管理対象外なので残す
+                for entry in self._manager.iter_entries():
+                    if entry.nt_hash:
+                        users.setdefault(entry.username, None)
+
+            # ユーザーごとに投入し、グループコミットでまとめて書き込む
+            futures = [
+                self._manager.submit(
+                    partial(_sync, username, nt_hash), key=username
+                )
+                for username, nt_hash in users.items()
+            ]
+            stats = {'seq': seq, 'added': 0, 'updated': 0, 'deleted': 0}
+            for future in futures:
+                result = future.result()
+                if result is not None:
+                    stats[result] += 1
+            self._store.mark_exported(self.target, seq)
+
+        logger.info(
+            "[AuthorizeExporter] exported | path=%s seq=%d users=%d "
+            "added=%d updated=%d deleted=%d took_ms=%.1f",
+            self.target,
+            seq,
+            len(users),
+            stats['added'],
+            stats['updated'],
+            stats['deleted'],
+            (time.perf_counter() - start) * 1000.0,
+        )
+        return stats
+
+    def start(self) -> "AuthorizeExporter":
+        """書き出しスレッドを起動（起動時に未反映分を1回書き出す）"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._wakeup.set()
+            self._thread = threading.Thread(
+                target=self._run,
+                name="radius-exporter",
+                daemon=True,
+            )
+            self._thread.start()
+            logger.info(
+                "[AuthorizeExporter] started | path=%s interval=%.1fs",
+                self.target,
+                self.interval,
+            )
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """書き出しスレッドを停止"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                return
+            try:
+                self.export()
+            except Exception as e:
+                # 反映済みの連番は進めていないので次回に再実行される
+                logger.error(
+                    "[AuthorizeExporter] export failed | error=%s",
+                    e,
+                    exc_info=True,
+                )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    コマンドラインエントリポイント（python -m utils.exporter）
+
+    未反映の変更を1回だけ書き出す。
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m utils.exporter",
+        description="SQLiteユーザーストアからauthorizeファイルを書き出す",
+    )
+    parser.add_argument(
+        "--authorize",
+        default=os.environ.get(
+            "RADIUS_AUTHORIZE_FILE", "/app/radius/authorize"
+        ),
+        help="authorizeファイルのパス",
+    )
+    parser.add_argument(
+        "--state-dir",
+        default=os.environ.get("RADIUS_STATE_DIR") or None,
+        help="ロックファイル等の置き場所（Botと同じ場所を指定すること）",
+    )
+    parser.add_argument(
+        "--db",
+        default=os.environ.get("RADIUS_DB_PATH") or None,
+        help="SQLiteデータベースのパス（未指定時は<state-dir>/users.db）",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=int(os.environ.get("RADIUS_SHARDS", "0")),
+        help="authorizeのシャード数（Botと同じ値を指定すること）",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+    if args.shards > 0:
+        manager = ShardedRadiusManager(
+            args.authorize, shards=args.shards, state_dir=args.state_dir
+        )
+    else:
+        manager = RadiusManager(args.authorize, state_dir=args.state_dir)
+    db_path = args.db or os.path.join(
+        args.state_dir or os.path.dirname(args.authorize), "users.db"
+    )
+    store = SQLiteUserStore(db_path)
+    try:
+        stats = AuthorizeExporter(store, manager).export()
+    finally:
+        manager.close()
+        store.close()
+    if stats is None:
+        print("no changes")
+    else:
+        print(
+            f"seq={stats['seq']} added={stats['added']} "
+            f"updated={stats['updated']} deleted={stats['deleted']}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
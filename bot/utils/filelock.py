@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+プロセス間ファイルロックユーティリティ
+サイドカーのロックファイルに対するfcntl.flockで複数プロセスの書込を直列化
+"""
+
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+from . import metrics
+
+try:
+    import fcntl
+    _HAS_FCNTL = True
+except ImportError:  # pragma: no cover
+    # fcntlがない環境ではプロセス内の排他のみ
+    _HAS_FCNTL = False
+
+logger = logging.getLogger(__name__)
+
+
+class LockTimeoutError(TimeoutError):
+    """ロック取得がタイムアウトした"""
+
+
+class FileLock:
+    """
+    fcntl.flockによるプロセス間の排他ロック
+
+    ロック対象ファイルそのものではなく専用のロックファイルをロックするため、
+    対象ファイルがリネームで置き換えられても排他が維持される。
+    同一インスタンス内では取得回数を数えるので、同じスレッドから入れ子で取得できる。
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        timeout: Optional[float] = 10.0,
+        poll_interval: float = 0.05,
+    ):
+        """
+        初期化
+
+        Args:
+            path: ロックファイルのパス（存在しなければ作成）
+            timeout: 取得待ちの上限秒（Noneで無制限）
+            poll_interval: 取得を再試行する間隔の初期値（秒）
+        """
+        self.path = Path(path)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._fd: Optional[int] = None
+        self._depth = 0
+        self._owner: Optional[int] = None
+        self._guard = threading.Lock()
+        self._stats = {
+            'acquired': 0,
+            'contended': 0,
+            'timeouts': 0,
+            'wait_total_ms': 0.0,
+            'wait_max_ms': 0.0,
+        }
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        """ロック待ちの統計（取得回数・競合回数・タイムアウト回数・待ち時間）"""
+        with self._guard:
+            return dict(self._stats)
+
+    def _record(self, waited_ms: float, contended: bool) -> None:
+        with self._guard:
+            self._stats['acquired'] += 1
+            if contended:
+                self._stats['contended'] += 1
+            self._stats['wait_total_ms'] += waited_ms
+            self._stats['wait_max_ms'] = max(
+                self._stats['wait_max_ms'], waited_ms
+            )
+
+    def acquire(self) -> float:
+        """
+        ロックを取得
+
+        Returns:
+            取得までに待った時間（ミリ秒）
+
+        Raises:
+            LockTimeoutError: timeout秒以内に取得できなかった場合
+        """
+        me = threading.get_ident()
+        if self._owner == me:
+            self._depth += 1
+            return 0.0
+
+        if not _HAS_FCNTL:
+            self._owner, self._depth = me, 1
+            return 0.0
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        start = time.perf_counter()
+        delay = self.poll_interval
+        contended = False
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    contended = True
+                    waited = time.perf_counter() - start
+                    if self.timeout is not None and waited >= self.timeout:
+                        with self._guard:
+                            self._stats['timeouts'] += 1
+                        raise LockTimeoutError(
+                            f"Timed out waiting for lock '{self.path}' "
+                            f"after {waited:.2f}s"
+                        )
+                    time.sleep(delay)
+                    # 競合が続く場合は間隔を伸ばす（最大0.5秒）
+                    delay = min(delay * 2, 0.5)
+        except BaseException:
+            os.close(fd)
+            raise
+
+        waited_ms = (time.perf_counter() - start) * 1000
+        self._fd, self._owner, self._depth = fd, me, 1
+        self._record(waited_ms, contended)
+        metrics.current().add_ms('lock_wait', waited_ms)
+        if contended:
+            logger.info(
+                "[FileLock] acquired after wait | path=%s wait_ms=%.1f",
+                self.path,
+                waited_ms,
+            )
+        return waited_ms
+
+    def release(self) -> None:
+        """ロックを解放（入れ子で取得した場合は最外側で解放）"""
+        if self._owner != threading.get_ident():
+            raise RuntimeError("FileLock released by non-owner thread")
+        self._depth -= 1
+        if self._depth > 0:
+            return
+        fd, self._fd, self._owner = self._fd, None, None
+        if fd is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+authorize変更の先行書込ジャーナル（WAL）
+グループコミットごとの論理操作をJSONLで追記・fsyncし、クラッシュ後に再適用する
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import (
+    Any, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class JournalRecord(NamedTuple):
+    """ジャーナルの1コミット分の記録"""
+
+    ops: List[Dict[str, Any]]
+    # 書込直前の対象ファイルの署名（ファイルが無かった場合はNone）
+    before: Optional[Tuple[int, int, int]]
+
+
+class MutationJournal:
+    """
+    追記専用の変更ジャーナル
+
+    1行が1回のコミット（操作のリスト）に対応する。行単位で書き込むため、
+    書込途中で停止した末尾の行は読込時に破棄され、コミットは全体が残るか
+    全体が消えるかのどちらかになる。
+    呼び出し側でプロセス間ロックを保持した状態で使う前提。
+    """
+
+    def __init__(self, path: Union[str, Path], sync: bool = True):
+        """
+        初期化
+
+        Args:
+            path: ジャーナルファイルのパス（存在しなければ作成）
+            sync: 追記ごとにfsyncするか
+        """
+        self.path = Path(path)
+        self.sync = sync
+
+    @property
+    def size(self) -> int:
+        """ジャーナルのバイト数"""
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def append(
+        self,
+        ops: Sequence[Dict[str, Any]],
+        before: Optional[Tuple[int, int, int]] = None,
+    ) -> int:
+        """
+        1コミット分の操作を追記
+
+        Args:
+            ops: 操作のリスト（{'op': 'add'|'update'|'delete', 'user': ..., ...}）
+            before: 書込直前の対象ファイルの署名（再適用の要否の判定に使う）
+
+        Returns:
+            追記前のサイズ（rollback()に渡す）
+        """
+        record = {
+            'ops': list(ops),
+            'before': list(before) if before is not None else None,
+        }
+        data = (
+            json.dumps(record, ensure_ascii=False) + "\n"
+        ).encode('utf-8')
+        fd = os.open(
+            self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600
+        )
+        try:
+            mark = os.fstat(fd).st_size
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            if self.sync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        return mark
+
+    def rollback(self, mark: int) -> None:
+        """
+        append()した内容を取り消す（反映に失敗したコミット用）
+
+        Args:
+            mark: append()の戻り値
+        """
+        try:
+            os.truncate(self.path, mark)
+        except FileNotFoundError:
+            return
+
+    def read(self) -> List[JournalRecord]:
+        """
+        記録済みのコミットを順に読み込む（末尾の不完全な行は無視）
+
+        Returns:
+            コミットごとのJournalRecordのリスト
+        """
+        batches: List[JournalRecord] = []
+        try:
+            with open(self.path, 'rb') as rf:
+                for raw in rf:
+                    if not raw.endswith(b"\n"):
+                        logger.warning(
+                            "[MutationJournal] discard torn record | path=%s",
+                            self.path,
+                        )
+                        break
+                    try:
+                        record = json.loads(raw)
+                        before = record['before']
+                        batches.append(JournalRecord(
+                            record['ops'],
+                            tuple(before) if before is not None else None,
+                        ))
+                    except (ValueError, KeyError, TypeError,
+                            AttributeError) as e:
+                        logger.warning(
+                            "[MutationJournal] discard broken record | "
+                            "path=%s error=%s",
+                            self.path,
+                            e,
+                        )
+                        break
+        except FileNotFoundError:
+            pass
+        return batches
+
+    def reset(self) -> None:
+        """ジャーナルを空にする（本体の永続化後に呼ぶ）"""
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_TRUNC)
+        except FileNotFoundError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
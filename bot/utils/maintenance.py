@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+authorizeファイルの保守スケジューラ
+サニタイズ等の全行走査を登録・更新の処理経路から外し、バックグラウンドで実行する
+"""
+
+import logging
+import threading
+from typing import Optional
+
+from .radius import RadiusManager
+
+logger = logging.getLogger(__name__)
+
+
+class MaintenanceScheduler:
+    """
+    RadiusManagerの保守処理を定期的に実行するバックグラウンドスレッド
+
+    interval秒ごと、またはコミットされた変更操作数がdirty_thresholdに達した時点で
+    sanitize_file() を実行する。走査はロックを取らずに行うため、
+    実行中も対話コマンドの登録・更新は待たされない。
+    """
+
+    def __init__(
+        self,
+        manager: RadiusManager,
+        interval: float = 3600.0,
+        dirty_threshold: int = 200,
+    ):
+        """
+        初期化
+
+        Args:
+            manager: 対象のRadiusManager
+            interval: 定期実行の間隔（秒）
+            dirty_threshold: 前回の保守以降の変更操作数がこの値に達したら前倒しで実行
+                （0以下で無効）
+        """
+        self._manager = manager
+        self.interval = interval
+        self.dirty_threshold = dirty_threshold
+        self._dirty = 0
+        self._guard = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        manager.add_commit_listener(self._on_commit)
+
+    @property
+    def dirty_count(self) -> int:
+        """前回の保守以降にコミットされた変更操作数"""
+        with self._guard:
+            return self._dirty
+
+    def _on_commit(self, op_count: int) -> None:
+        with self._guard:
+            self._dirty += op_count
+            due = 0 < self.dirty_threshold <= self._dirty
+        if due:
+            self._wakeup.set()
+
+    def start(self) -> "MaintenanceScheduler":
+        """スケジューラスレッドを起動"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name="radius-maintenance",
+                daemon=True,
+            )
+            self._thread.start()
+            logger.info(
+                "[MaintenanceScheduler] started | interval=%.0fs "
+                "dirty_threshold=%d",
+                self.interval,
+                self.dirty_threshold,
+            )
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """スケジューラスレッドを停止"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run_once(self) -> bool:
+        """
+        保守処理を1回実行
+
+        Returns:
+            authorizeファイルを書き換えた場合True
+        """
+        with self._guard:
+            dirty, self._dirty = self._dirty, 0
+        try:
+            changed = self._manager.sanitize_file()
+        except Exception as e:
+            # 失敗した分は次回に持ち越す
+            with self._guard:
+                self._dirty += dirty
+            logger.error(
+                "[MaintenanceScheduler] maintenance failed | error=%s",
+                e,
+                exc_info=True,
+            )
+            return False
+        logger.info(
+            "[MaintenanceScheduler] maintenance done | dirty_ops=%d "
+            "rewritten=%s",
+            dirty,
+            changed,
+        )
+        return changed
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                return
+            self.run_once()
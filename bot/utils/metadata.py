@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+ユーザーメタデータのサイドカーストア
+作成・更新日時などをauthorizeファイルのコメントではなく別ファイルに保持する
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# メタデータの日時書式（authorizeの履歴コメントと同じ）
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class UserMetadataStore:
+    """
+    ユーザーごとのメタデータ（created / updated）を保持する追記型ストア
+
+    変更はJSONLのイベントとして追記し、読込時に畳み込む。
+    rewrite()で畳み込んだ結果だけのファイルに書き直す。
+    呼び出し側でプロセス間ロックを保持した状態で書き込む前提。
+    """
+
+    def __init__(self, path: Union[str, Path], sync: bool = True):
+        """
+        初期化
+
+        Args:
+            path: メタデータファイルのパス（存在しなければ作成）
+            sync: 書込ごとにfsyncするか
+        """
+        self.path = Path(path)
+        self.sync = sync
+
+    def record(self, events: Iterable[Dict[str, Any]]) -> None:
+        """
+        イベントを追記
+
+        Args:
+            events: {'user': 名前, 'created'|'updated': 日時} または
+                {'user': 名前, 'deleted': True} の反復可能オブジェクト
+        """
+        data = "".join(
+            json.dumps(event, ensure_ascii=False) + "\n" for event in events
+        ).encode('utf-8')
+        if not data:
+            return
+        fd = os.open(
+            self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600
+        )
+        try:
+            os.write(fd, data)
+            if self.sync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def load(self) -> Dict[str, Dict[str, str]]:
+        """
+        全ユーザーのメタデータを読み込む
+
+        Returns:
+            ユーザー名→{'created': 日時, 'updated': 日時} の辞書
+        """
+        result: Dict[str, Dict[str, str]] = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as rf:
+                for raw in rf:
+                    try:
+                        event = json.loads(raw)
+                        username = event['user']
+                    except (ValueError, KeyError, TypeError):
+                        # 書込途中で停止した行など
+                        continue
+                    if event.get('deleted'):
+                        result.pop(username, None)
+                        continue
+                    meta = result.setdefault(username, {})
+                    for key in ('created', 'updated'):
+                        if key in event:
+                            meta[key] = event[key]
+        except FileNotFoundError:
+            pass
+        return result
+
+    def get(self, username: str) -> Optional[Dict[str, str]]:
+        """
+        1ユーザーのメタデータを取得
+
+        Args:
+            username: ユーザー名
+
+        Returns:
+            {'created': 日時, 'updated': 日時}（記録がない場合はNone）
+        """
+        return self.load().get(username)
+
+    def rewrite(self, snapshot: Dict[str, Dict[str, str]]) -> None:
+        """
+        畳み込んだ内容だけのファイルに書き直す（アトミック）
+
+        Args:
+            snapshot: ユーザー名→メタデータの辞書
+        """
+        # with_suffixだとauthorize.meta→authorize.tmpとなり、
+        # authorize本体の一時ファイルと衝突するため名前の末尾に付ける
+        temp_file = self.path.with_name(self.path.name + '.tmp')
+        with open(temp_file, 'w', encoding='utf-8') as wf:
+            for username, meta in snapshot.items():
+                wf.write(
+                    json.dumps({'user': username, **meta}, ensure_ascii=False)
+                    + "\n"
+                )
+            wf.flush()
+            if self.sync:
+                os.fsync(wf.fileno())
+        os.chmod(temp_file, 0o600)
+        temp_file.replace(self.path)
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+操作ごとの処理時間・カウンタの計測
+ロック待ち・読込・パース・書込・fsync等のフェーズごとの時間をヒストグラムに集計し、
+登録したエクスポータへ操作1回ごとの内訳を渡す
+"""
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
+
+logger = logging.getLogger(__name__)
+
+# ヒストグラムのバケット上限（ミリ秒）。最後のバケットはそれ以上すべて
+BUCKETS_MS = (
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 25.0, 50.0,
+    100.0, 250.0, 500.0, 1000.0, 2500.0, 5000.0, 10000.0,
+)
+
+# スレッドごとの実行中の操作
+_local = threading.local()
+
+
+class Histogram:
+    """固定バケットのヒストグラム（スレッドセーフ）"""
+
+    def __init__(self, bounds: Sequence[float] = BUCKETS_MS):
+        """
+        初期化
+
+        Args:
+            bounds: バケットの上限値（昇順）
+        """
+        self.bounds = tuple(bounds)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._guard = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """値を1件記録"""
+        slot = bisect.bisect_left(self.bounds, value)
+        with self._guard:
+            self._counts[slot] += 1
+            self._count += 1
+            self._sum += value
+            if value > self._max:
+                self._max = value
+
+    def _quantile(self, counts: List[int], total: int, q: float) -> float:
+        """q分位点が属するバケットの上限（最後のバケットなら最大値）"""
+        rank = q * total
+        seen = 0
+        for slot, count in enumerate(counts):
+            seen += count
+            if seen >= rank and count:
+                if slot < len(self.bounds):
+                    return min(self.bounds[slot], self._max)
+                return self._max
+        return self._max
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        現在の集計値
+
+        Returns:
+            {'count', 'sum', 'avg', 'max', 'p50', 'p90', 'p99',
+             'buckets': [[上限, 件数], ...]} の辞書（分位点はバケット上限での近似）
+        """
+        with self._guard:
+            counts = list(self._counts)
+            total, value_sum, value_max = self._count, self._sum, self._max
+        return {
+            'count': total,
+            'sum': value_sum,
+            'avg': value_sum / total if total else 0.0,
+            'max': value_max,
+            'p50': self._quantile(counts, total, 0.50) if total else 0.0,
+            'p90': self._quantile(counts, total, 0.90) if total else 0.0,
+            'p99': self._quantile(counts, total, 0.99) if total else 0.0,
+            'buckets': [
+                [bound, count]
+                for bound, count in zip(self.bounds + (float('inf'),), counts)
+                if count
+            ],
+        }
+
+
+class OperationTrace:
+    """
+    操作1回分の計測値
+
+    phases はフェーズ名→ミリ秒（同じフェーズは合算）、counters は
+    カウンタ名→値。グループコミットではライタースレッドで計測した内訳を
+    呼び出し元の操作にmerge()で合算する。
+    """
+
+    __slots__ = ('name', 'started', 'total_ms', 'phases', 'counters', 'error')
+
+    def __init__(self, name: str):
+        """
+        初期化
+
+        Args:
+            name: 操作名（add_user等）
+        """
+        self.name = name
+        self.started = time.perf_counter()
+        self.total_ms = 0.0
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.error: Optional[str] = None
+
+    def add_ms(self, phase: str, ms: float) -> None:
+        """フェーズの所要時間を加算"""
+        self.phases[phase] = self.phases.get(phase, 0.0) + ms
+
+    def count(self, name: str, value: int = 1) -> None:
+        """カウンタを加算"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """ブロックの所要時間をフェーズとして加算"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_ms(name, (time.perf_counter() - start) * 1000)
+
+    def merge(self, other: "OperationTrace") -> None:
+        """他の計測値（ライタースレッドでのコミット等）を合算"""
+        for phase, ms in other.phases.items():
+            self.add_ms(phase, ms)
+        for name, value in other.counters.items():
+            self.count(name, value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """エクスポート用の辞書"""
+        return {
+            'op': self.name,
+            'total_ms': self.total_ms,
+            'phases': dict(self.phases),
+            'counters': dict(self.counters),
+            'error': self.error,
+        }
+
+    def format(self) -> str:
+        """ログ用の1行表現（例: lock_wait_ms=0.1 read_bytes=1024）"""
+        parts = [f"{phase}_ms={ms:.1f}" for phase, ms in self.phases.items()]
+        parts.extend(
+            f"{name}={value}" for name, value in self.counters.items()
+        )
+        return " ".join(parts)
+
+
+class _NullTrace:
+    """操作の外で呼ばれた計測を捨てる（計測箇所で分岐しなくて済むように）"""
+
+    __slots__ = ()
+    total_ms = 0.0
+
+    def add_ms(self, phase: str, ms: float) -> None:
+        pass
+
+    def count(self, name: str, value: int = 1) -> None:
+        pass
+
+    def phase(self, name: str) -> ContextManager[None]:
+        return nullcontext()
+
+    def merge(self, other: OperationTrace) -> None:
+        pass
+
+    def format(self) -> str:
+        return ""
+
+
+_NULL_TRACE = _NullTrace()
+
+
+def current() -> Union[OperationTrace, _NullTrace]:
+    """
+    このスレッドで実行中の操作の計測値
+
+    Returns:
+        OperationTrace（操作の外では何も記録しないダミー）
+    """
+    trace = getattr(_local, 'trace', None)
+    return trace if trace is not None else _NULL_TRACE
+
+
+def active() -> Optional[OperationTrace]:
+    """このスレッドで実行中の操作の計測値（操作の外ではNone）"""
+    return getattr(_local, 'trace', None)
+
+
+class Instrumentation:
+    """
+    操作ごとのフェーズ別ヒストグラムとカウンタの集計、エクスポータへの通知
+
+    operation()のブロック内で呼ばれた計測（current()経由）はその操作に記録される。
+    操作が入れ子になった場合は外側の操作に合算し、記録は外側の終了時に1回だけ行う。
+    """
+
+    def __init__(self, enabled: bool = True):
+        """
+        初期化
+
+        Args:
+            enabled: 計測するか（Falseなら operation() は何も記録しない）
+        """
+        self.enabled = enabled
+        self._histograms: Dict[str, Dict[str, Histogram]] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._errors: Dict[str, int] = {}
+        self._exporters: List[Callable[[OperationTrace], None]] = []
+        self._guard = threading.Lock()
+
+    def add_exporter(
+        self, exporter: Callable[[OperationTrace], None]
+    ) -> None:
+        """
+        操作の終了ごとに呼ばれるエクスポータを登録
+
+        Args:
+            exporter: OperationTraceを受け取る関数（操作を実行したスレッドで
+                呼ばれるため、重い処理はしないこと）
+        """
+        self._exporters.append(exporter)
+
+    def operation(
+        self, name: str
+    ) -> ContextManager[Union[OperationTrace, _NullTrace]]:
+        """
+        ブロックを1回の操作として計測するコンテキストマネージャ
+
+        Args:
+            name: 操作名
+
+        Returns:
+            withでOperationTraceを返すコンテキストマネージャ
+            （入れ子の場合は外側の操作のもの、無効時はダミー）
+        """
+        outer = getattr(_local, 'trace', None)
+        if outer is not None:
+            return nullcontext(outer)
+        if not self.enabled:
+            return nullcontext(_NULL_TRACE)
+        return _OperationScope(self, name)
+
+    def record(self, trace: OperationTrace) -> None:
+        """
+        終了した操作の計測値を集計し、エクスポータに渡す
+
+        Args:
+            trace: 計測値（total_msを設定済みのもの）
+        """
+        with self._guard:
+            histograms = self._histograms.get(trace.name)
+            if histograms is None:
+                histograms = self._histograms[trace.name] = {}
+            counters = self._counters.setdefault(trace.name, {})
+            for phase in trace.phases:
+                if phase not in histograms:
+                    histograms[phase] = Histogram()
+            if 'total' not in histograms:
+                histograms['total'] = Histogram()
+            for counter, value in trace.counters.items():
+                counters[counter] = counters.get(counter, 0) + value
+            if trace.error is not None:
+                self._errors[trace.name] = self._errors.get(trace.name, 0) + 1
+        histograms['total'].observe(trace.total_ms)
+        for phase, ms in trace.phases.items():
+            histograms[phase].observe(ms)
+        for exporter in self._exporters:
+            try:
+                exporter(trace)
+            except Exception as e:
+                logger.warning(
+                    "[Instrumentation] exporter failed | op=%s error=%s",
+                    trace.name,
+                    e,
+                )
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        操作ごとの集計値
+
+        Returns:
+            操作名→{'count', 'errors', 'phases': {フェーズ名: Histogram.snapshot()},
+            'counters': {カウンタ名: 合計}} の辞書（フェーズの'total'は操作全体）
+        """
+        with self._guard:
+            items = [
+                (name, dict(histograms), dict(self._counters.get(name, {})),
+                 self._errors.get(name, 0))
+                for name, histograms in self._histograms.items()
+            ]
+        result: Dict[str, Dict[str, Any]] = {}
+        for name, histograms, counters, errors in items:
+            phases = {
+                phase: histogram.snapshot()
+                for phase, histogram in histograms.items()
+            }
+            result[name] = {
+                'count': phases['total']['count'],
+                'errors': errors,
+                'phases': phases,
+                'counters': counters,
+            }
+        return result
+
+    def reset(self) -> None:
+        """集計値を破棄"""
+        with self._guard:
+            self._histograms = {}
+            self._counters = {}
+            self._errors = {}
+
+
+class _OperationScope:
+    """Instrumentation.operation() の本体（ジェネレータより軽い実装にしている）"""
+
+    __slots__ = ('_owner', '_name', '_trace')
+
+    def __init__(self, owner: Instrumentation, name: str):
+        self._owner = owner
+        self._name = name
+        self._trace: Optional[OperationTrace] = None
+
+    def __enter__(self) -> OperationTrace:
+        trace = self._trace = OperationTrace(self._name)
+        _local.trace = trace
+        return trace
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _local.trace = None
+        trace = self._trace
+        trace.total_ms = (time.perf_counter() - trace.started) * 1000
+        if exc_type is not None:
+            trace.error = exc_type.__name__
+        self._owner.record(trace)
+
+
+class LoggingExporter:
+    """所要時間が閾値以上の操作の内訳をログに1行で出力するエクスポータ"""
+
+    def __init__(
+        self,
+        min_total_ms: float = 0.0,
+        level: int = logging.WARNING,
+        target: Optional[logging.Logger] = None,
+    ):
+        """
+        初期化
+
+        Args:
+            min_total_ms: これ未満の操作は出力しない
+            level: ログレベル（遅い操作の調査用のため既定はWARNING）
+            target: 出力先のロガー（未指定時はこのモジュールのロガー）
+        """
+        self.min_total_ms = min_total_ms
+        self.level = level
+        self._logger = target or logger
+
+    def __call__(self, trace: OperationTrace) -> None:
+        if trace.total_ms < self.min_total_ms:
+            return
+        self._logger.log(
+            self.level,
+            "[Instrumentation] %s | total_ms=%.1f %s%s",
+            trace.name,
+            trace.total_ms,
+            trace.format(),
+            f" error={trace.error}" if trace.error else "",
+        )
+
+
+class JsonLinesExporter:
+    """操作ごとの内訳をJSON Linesファイルに追記するエクスポータ"""
+
+    def __init__(self, path: Union[str, Path], min_total_ms: float = 0.0):
+        """
+        初期化
+
+        Args:
+            path: 出力先ファイル（存在しなければ作成）
+            min_total_ms: これ未満の操作は出力しない
+        """
+        self.path = Path(path)
+        self.min_total_ms = min_total_ms
+        self._guard = threading.Lock()
+
+    def __call__(self, trace: OperationTrace) -> None:
+        if trace.total_ms < self.min_total_ms:
+            return
+        record = trace.to_dict()
+        record['time'] = time.time()
+        data = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+        with self._guard:
+            fd = os.open(
+                self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600
+            )
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
@@ -22,6 +22,8 @@ import secrets
 import string
 from typing import Tuple
 
+from . import metrics
+
 logger = logging.getLogger(__name__)
 
 
@@ -154,7 +156,9 @@ class PasswordManager:
             raise
 
         nt_upper = md4_hex.upper()
-        elapsed_ms = int((time.perf_counter() - start_time) * 1000)
+        elapsed = (time.perf_counter() - start_time) * 1000
+        metrics.current().add_ms('hash', elapsed)
+        elapsed_ms = int(elapsed)
         logger.debug(
             "[PasswordManager] NT hash generated | backend=%s "
             "hash_sample=%s took_ms=%d",
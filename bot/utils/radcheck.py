@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+FreeRADIUS rlm_sql 互換の radcheck / radreply 書込
+authorizeファイルの変更をSQLiteの行にも反映し、FreeRADIUSがリクエストごとに参照できるようにする
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from .entry import UserEntry
+from .radius import RadiusManager
+from .sharded import ShardedRadiusManager
+from .store import SQLITE_SYNCHRONOUS
+
+logger = logging.getLogger(__name__)
+
+# rlm_sqlの既定のauthorize_check_query / authorize_reply_queryと同じ列・順序
+CHECK_QUERY = (
+    "SELECT id, username, attribute, value, op FROM radcheck "
+    "WHERE username = ? ORDER BY id"
+)
+REPLY_QUERY = (
+    "SELECT id, username, attribute, value, op FROM radreply "
+    "WHERE username = ? ORDER BY id"
+)
+
+
+class RadcheckWriter:
+    """
+    RadiusManagerのコミットを radcheck / radreply 表へ反映するミラー
+
+    表定義はFreeRADIUS付属のSQLiteスキーマ（mods-config/sql/main/sqlite）と同じで、
+    rlm_sqlはユーザー名のインデックスで1ユーザー分の行だけを読む。
+    追加・パスワード更新は1ユーザー数行の書込で済み、authorizeの再読込を待たずに
+    次の認証リクエストから有効になる。
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS radcheck ("
+        "id INTEGER PRIMARY KEY, "
+        "username VARCHAR(64) NOT NULL DEFAULT '', "
+        "attribute VARCHAR(64) NOT NULL DEFAULT '', "
+        "op CHAR(2) NOT NULL DEFAULT '==', "
+        "value VARCHAR(253) NOT NULL DEFAULT '')",
+        "CREATE INDEX IF NOT EXISTS check_username ON radcheck(username)",
+        "CREATE TABLE IF NOT EXISTS radreply ("
+        "id INTEGER PRIMARY KEY, "
+        "username VARCHAR(64) NOT NULL DEFAULT '', "
+        "attribute VARCHAR(64) NOT NULL DEFAULT '', "
+        "op CHAR(2) NOT NULL DEFAULT '=', "
+        "value VARCHAR(253) NOT NULL DEFAULT '')",
+        "CREATE INDEX IF NOT EXISTS reply_username ON radreply(username)",
+    )
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        timeout: float = 30.0,
+        durability: str = "file",
+    ):
+        """
+        初期化
+
+        Args:
+            path: データベースファイルのパス（存在しなければ作成）
+            timeout: FreeRADIUS等の他の接続のロックを待つ秒数
+            durability: 書込の永続性（"none" / "file" / "full"）
+        """
+        if durability not in SQLITE_SYNCHRONOUS:
+            raise ValueError(f"unknown durability: {durability}")
+        self.path = Path(path)
+        self._guard = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.path), timeout=timeout, check_same_thread=False
+        )
+        # FreeRADIUSの読込と書込が互いを待たないようWALモードで開く
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"PRAGMA synchronous={SQLITE_SYNCHRONOUS[durability]}"
+        )
+        with self._conn:
+            for statement in self.SCHEMA:
+                self._conn.execute(statement)
+
+    def attach(
+        self, manager: Union[RadiusManager, ShardedRadiusManager]
+    ) -> "RadcheckWriter":
+        """
+        authorizeの現在の内容に同期してから、以後のコミットを反映するよう登録
+
+        Args:
+            manager: 対象のRadiusManagerまたはShardedRadiusManager
+
+        Returns:
+            self
+        """
+        self.sync(manager.iter_entries())
+        manager.add_mirror(self.apply)
+        return self
+
+    def _put(self, username: str, nt_hash: str) -> None:
+        cursor = self._conn.execute(
+            "UPDATE radcheck SET value = ?, op = ':=' "
+            "WHERE username = ? AND attribute = 'NT-Password'",
+            (nt_hash, username),
+        )
+        if cursor.rowcount > 0:
+            return
+        self._conn.execute(
+            "INSERT INTO radcheck (username, attribute, op, value) "
+            "VALUES (?, 'NT-Password', ':=', ?)",
+            (username, nt_hash),
+        )
+        self._conn.execute(
+            "DELETE FROM radreply "
+            "WHERE username = ? AND attribute = 'Reply-Message'",
+            (username,),
+        )
+        self._conn.execute(
+            "INSERT INTO radreply (username, attribute, op, value) "
+            "VALUES (?, 'Reply-Message', ':=', ?)",
+            (username, f"Welcome {username}"),
+        )
+
+    def _remove(self, username: str) -> None:
+        self._conn.execute(
+            "DELETE FROM radcheck WHERE username = ?", (username,)
+        )
+        self._conn.execute(
+            "DELETE FROM radreply WHERE username = ?", (username,)
+        )
+
+    def apply(self, users: Dict[str, Optional[str]]) -> None:
+        """
+        ユーザーの状態を1トランザクションで反映（RadiusManager.add_mirror用）
+
+        Args:
+            users: ユーザー名→NTハッシュ（削除済みはNone）の辞書
+        """
+        with self._guard, self._conn:
+            for username, nt_hash in users.items():
+                if nt_hash is None:
+                    self._remove(username)
+                else:
+                    self._put(username, nt_hash)
+        logger.debug("[RadcheckWriter] applied | users=%d", len(users))
+
+    def sync(self, entries: Iterable[UserEntry]) -> Dict[str, int]:
+        """
+        authorizeのエントリ全体と突き合わせて差分だけを書き込む
+
+        NT-Passwordを持たないエントリ（DEFAULT等）は対象外。
+
+        Args:
+            entries: UserEntryの反復可能オブジェクト
+
+        Returns:
+            {'put': 追加・更新した件数, 'removed': 削除した件数} の辞書
+        """
+        desired = {
+            entry.username: entry.nt_hash
+            for entry in entries
+            if entry.nt_hash
+        }
+        stats = {'put': 0, 'removed': 0}
+        with self._guard, self._conn:
+            current = dict(self._conn.execute(
+                "SELECT username, value FROM radcheck "
+                "WHERE attribute = 'NT-Password'"
+            ).fetchall())
+            for username, nt_hash in desired.items():
+                if current.get(username) != nt_hash:
+                    self._put(username, nt_hash)
+                    stats['put'] += 1
+            for username in current.keys() - desired.keys():
+                self._remove(username)
+                stats['removed'] += 1
+        logger.info(
+            "[RadcheckWriter] synced | path=%s users=%d put=%d removed=%d",
+            self.path,
+            len(desired),
+            stats['put'],
+            stats['removed'],
+        )
+        return stats
+
+    def lookup(self, username: str) -> Tuple[List[tuple], List[tuple]]:
+        """
+        rlm_sqlと同じクエリで1ユーザー分の行を読む（動作確認用）
+
+        Args:
+            username: ユーザー名
+
+        Returns:
+            (radcheckの行のリスト, radreplyの行のリスト)
+        """
+        with self._guard:
+            check = self._conn.execute(CHECK_QUERY, (username,)).fetchall()
+            reply = self._conn.execute(REPLY_QUERY, (username,)).fetchall()
+        return check, reply
+
+    def close(self) -> None:
+        """接続を閉じる"""
+        with self._guard:
+            self._conn.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    コマンドラインエントリポイント（python -m utils.radcheck）
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m utils.radcheck",
+        description="rlm_sql用のradcheck/radreplyデータベース管理ツール",
+    )
+    parser.add_argument(
+        "--db",
+        default=os.environ.get("RADIUS_RADCHECK_DB") or None,
+        required=not os.environ.get("RADIUS_RADCHECK_DB"),
+        help="radcheckデータベースのパス",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = subparsers.add_parser(
+        "sync", help="authorizeファイルの内容に同期"
+    )
+    sync_parser.add_argument(
+        "--authorize",
+        default=os.environ.get(
+            "RADIUS_AUTHORIZE_FILE", "/app/radius/authorize"
+        ),
+        help="authorizeファイルのパス",
+    )
+    sync_parser.add_argument(
+        "--state-dir",
+        default=os.environ.get("RADIUS_STATE_DIR") or None,
+        help="ロックファイル等の置き場所（Botと同じ場所を指定すること）",
+    )
+    sync_parser.add_argument(
+        "--shards",
+        type=int,
+        default=int(os.environ.get("RADIUS_SHARDS", "0")),
+        help="authorizeのシャード数（Botと同じ値を指定すること）",
+    )
+
+    lookup_parser = subparsers.add_parser(
+        "lookup", help="rlm_sqlと同じクエリでユーザーの行を表示"
+    )
+    lookup_parser.add_argument("username", help="ユーザー名")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+    writer = RadcheckWriter(args.db)
+    try:
+        if args.command == "sync":
+            if args.shards > 0:
+                manager = ShardedRadiusManager(
+                    args.authorize,
+                    shards=args.shards,
+                    state_dir=args.state_dir,
+                )
+            else:
+                manager = RadiusManager(
+                    args.authorize, state_dir=args.state_dir
+                )
+            try:
+                stats = writer.sync(manager.iter_entries())
+            finally:
+                manager.close()
+            print(f"put={stats['put']} removed={stats['removed']}")
+            return 0
+
+        check, reply = writer.lookup(args.username)
+        if not check:
+            print(f"not found: {args.username}", file=sys.stderr)
+            return 1
+        for table, rows in (("radcheck", check), ("radreply", reply)):
+            for _id, _username, attribute, value, op in rows:
+                print(f"{table}: {attribute} {op} \"{value}\"")
+        return 0
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
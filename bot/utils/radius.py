@@ -4,48 +4,433 @@ FreeRADIUS管理ユーティリティ
 authorizeファイルの安全な読み書き機能
 """
 
+import argparse
+import csv
+import errno
+import itertools
+import json
 import logging
 import os
+import queue
+import random
 import re
+import shutil
+import sys
 import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
-
+from typing import (
+    AbstractSet,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+    Union,
+)
+
+from .entry import UserEntry
+from .filelock import FileLock
+from .journal import MutationJournal
+from . import metrics
+from .metadata import TIMESTAMP_FORMAT, UserMetadataStore
+from .metrics import Instrumentation
 from .password import PasswordManager
+from .snapshots import SnapshotStore
+from .watcher import AuthorizeWatcher
 
 logger = logging.getLogger(__name__)
 
+# 書込時にファイルのバージョン（署名）を検証しないことを表す番兵
+_ANY_VERSION = object()
+
+# NT-Passwordの値は常に32桁の16進（大文字）
+NT_HASH_LENGTH = 32
+_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+
+
+# 旧形式で各ブロックの直前に書いていた履歴コメント
+_HISTORY_COMMENT = re.compile(r"#\s*(User added|Password updated):\s*(.+)")
+
+
+def _is_hex(value: str) -> bool:
+    return all(c in _HEX_DIGITS for c in value)
+
+
+class AuthorizeConflictError(RuntimeError):
+    """読み込んだ後にauthorizeファイルが他から更新されていた（楽観的並行制御の競合）"""
+
+
+class _PartialOperationError(Exception):
+    """グループコミットの操作がトランザクションを途中まで変更して失敗した"""
+
+
+class _IndexVersion(NamedTuple):
+    """
+    公開済みのインデックスの版
+
+    公開後は辞書・リストとも変更しないため、参照側はロックを取らずに読める。
+    """
+
+    signature: Optional[Tuple[int, int, int]]
+    index: Dict[str, UserEntry]
+    entries: List[UserEntry]
+    duplicates: AbstractSet[str]
+    line_count: int
+    tail_ok: bool
+
 
 class RadiusManager:
     """FreeRADIUS管理クラス"""
 
-    def __init__(self, authorize_file_path: str = "/radius/authorize"):
+    # authorizeファイルのストリーミング読み書きに使うバッファサイズ
+    _IO_BUFFER_SIZE = 1 << 16
+    # プロセス間の並行制御方式
+    CONCURRENCY_MODES = ("lock", "optimistic")
+    # 書込の永続性レベル（後ろほど強い）
+    DURABILITY_LEVELS = ("none", "file", "full")
+
+    def __init__(
+        self,
+        authorize_file_path: str = "/radius/authorize",
+        state_dir: Optional[str] = None,
+        lock_timeout: Optional[float] = 10.0,
+        concurrency: str = "lock",
+        max_conflict_retries: int = 5,
+        journal_checkpoint_bytes: int = 1 << 20,
+        durability: str = "file",
+        snapshots: int = 10,
+        snapshot_max_bytes: int = 64 << 20,
+        snapshot_compress: bool = False,
+        instrumentation: Optional[Instrumentation] = None,
+    ):
         """
         初期化
 
         Args:
             authorize_file_path: authorizeファイルのパス
+            state_dir: ロックファイル等のサイドカーを置くディレクトリ
+                （未指定時はauthorizeファイルと同じディレクトリ）
+            lock_timeout: プロセス間ロックの取得待ち上限秒（Noneで無制限）
+            concurrency: プロセス間の並行制御方式
+                "lock": 読込→変更→書込の間プロセス間ロックを保持する
+                "optimistic": 読み込んだ版を記録し、置換直前に一致を確認する
+                    （ロックは確認と置換の間だけ保持。競合時は最新内容で再実行）
+            max_conflict_retries: グループコミットで競合した際の再試行回数
+                （optimistic時、最後の再試行はプロセス間ロックを保持して行う）
+            journal_checkpoint_bytes: 変更ジャーナルがこのサイズを超えたら
+                authorizeファイルを永続化してジャーナルを空にする
+            durability: 書込の永続性レベル
+                "none": fsyncしない（最小レイテンシ。OSクラッシュで変更を失いうる）
+                "file": ファイル内容（一時ファイル・追記・ジャーナル）をfsyncする
+                "full": さらに親ディレクトリとメタデータもfsyncし、
+                    リネームまで永続化する
+            snapshots: 全体の書換で置き換えた版を保持する世代数（0で無効）
+            snapshot_max_bytes: 保持するスナップショットの合計バイト数の上限
+            snapshot_compress: スナップショットをハードリンクではなく
+                gzipで圧縮して保持するか
+            instrumentation: 操作ごとの計測値の集計先（未指定時は専用に作成。
+                ShardedRadiusManagerは全シャードで共有する）
         """
+        if concurrency not in self.CONCURRENCY_MODES:
+            raise ValueError(
+                f"Unknown concurrency mode '{concurrency}' "
+                f"(expected one of {', '.join(self.CONCURRENCY_MODES)})"
+            )
+        if durability not in self.DURABILITY_LEVELS:
+            raise ValueError(
+                f"Unknown durability level '{durability}' "
+                f"(expected one of {', '.join(self.DURABILITY_LEVELS)})"
+            )
+        self.concurrency = concurrency
+        self.durability = durability
+        self.max_conflict_retries = max_conflict_retries
+        self.journal_checkpoint_bytes = journal_checkpoint_bytes
         self.authorize_file_path = Path(authorize_file_path)
+        self.state_dir = (
+            Path(state_dir) if state_dir
+            else self.authorize_file_path.parent
+        )
+        self.state_dir.mkdir(parents=True, exist_ok=True)
         # 再入可能ロックにすることで、ロック内からget_user等を呼んでもデッドロックしない
         self._lock = threading.RLock()
+        # 別プロセス（別レプリカや管理スクリプト）との書込を直列化するロック
+        self._file_lock = FileLock(
+            self._state_path('.lock'), timeout=lock_timeout
+        )
+        # コミットごとの論理操作を先に永続化するジャーナル
+        self._journal = MutationJournal(
+            self._state_path('.journal'), sync=self._durable("file")
+        )
+        # 作成・更新日時などのユーザーメタデータ（補助情報なので、登録の
+        # レイテンシに2回目のfsyncを足さないようfullの場合だけfsyncする）
+        self._metadata = UserMetadataStore(
+            self._state_path('.meta'), sync=self._durable("full")
+        )
+        # 置き換えた版の世代スナップショット（rollback()で巻き戻す）
+        self._snapshots: Optional[SnapshotStore] = None
+        if snapshots > 0:
+            self._snapshots = SnapshotStore(
+                self._state_path('.snapshots'),
+                keep=snapshots,
+                max_bytes=snapshot_max_bytes,
+                compress=snapshot_compress,
+                sync=self._durable("file"),
+                lock_timeout=lock_timeout,
+            )
+        # 操作ごとのフェーズ別の所要時間・カウンタ（ロック待ち・読込・パース等）
+        self.metrics = (
+            instrumentation if instrumentation is not None
+            else Instrumentation()
+        )
+        # 一時ファイル名の連番（プロセス・スレッド・連番で書込ごとに別名にする）
+        self._temp_counter = itertools.count()
+        # 書込レイテンシの統計（書込方式ごと）と、書込中のfsync所要時間
+        self._write_stats: Dict[str, Dict[str, float]] = {}
+        self._write_stats_guard = threading.Lock()
+        self._sync_ms = 0.0
+        # スレッドごとの実行中トランザクション（入れ子呼び出しで共有する）
+        self._local = threading.local()
+        # 変更操作をまとめて書き込むグループコミット用ライター
+        self._writer = _GroupCommitWriter(self)
+        # コミットごとに反映した操作数で呼ばれるコールバック（保守処理の起動用）
+        self._commit_listeners: List[Callable[[int], None]] = []
+        # コミットで変更したユーザーの現在の状態を受け取るミラー（radcheck等への反映用）
+        self._mirrors: List[Callable[[Dict[str, Optional[str]]], None]] = []
+        # ユーザー名→エントリのインデックス（ファイルの署名が変わるまで再利用）
+        self._index: Optional[Dict[str, UserEntry]] = None
+        self._index_entries: List[UserEntry] = []
+        self._index_duplicates: AbstractSet[str] = frozenset()
+        self._index_signature: Optional[Tuple[int, int, int]] = None
+        # インデックス作成時の行数と、末尾が改行で終わっているか（追記の可否判定用）
+        self._index_line_count = 0
+        self._index_tail_ok = True
+        # 参照用に公開したインデックスの版（get_user / list_usersはロックなしで読む）
+        self._published: Optional[_IndexVersion] = None
+        self._publish_guard = threading.Lock()
+        # 参照側での再構築を1スレッドに絞るロック（書込側のロックとは独立）
+        self._rebuild_guard = threading.Lock()
+        # コミット中（ファイルの書込から版の公開まで）は参照側で再構築しない
+        self._committing = False
+        # 外部変更の監視（watch()で起動）。監視中はget_user等でstatしない
+        self._watcher: Optional[AuthorizeWatcher] = None
+        self._index_trusted = False
+        # 監視スレッドが前回ミラーと照合したインデックス（外部変更の差分用）
+        self._mirrored_index: Optional[Dict[str, UserEntry]] = None
+        # 前回プロセスがインプレース更新の途中で停止していれば完了させ、
+        # ジャーナルに残った変更を再適用する
+        self._recover_inplace()
+        self._replay_journal()
         logger.debug(
-            "[RadiusManager] initialized | path=%s exists=%s",
+            "[RadiusManager] initialized | path=%s exists=%s state_dir=%s",
             self.authorize_file_path,
             self.authorize_file_path.exists(),
+            self.state_dir,
+        )
+
+    def _state_path(self, suffix: str) -> Path:
+        """サイドカーファイルのパス（state_dir/<authorizeファイル名><suffix>）"""
+        return self.state_dir / (self.authorize_file_path.name + suffix)
+
+    def _temp_path(self) -> Path:
+        """
+        置換用の一時ファイルのパス（authorizeと同じディレクトリ）
+
+        optimistic時は一時ファイルの書込をプロセス間ロックの外で行うため、
+        書込ごとに別名にして他の書込の一時ファイルと衝突しないようにする。
+        """
+        return self.authorize_file_path.with_name(
+            f"{self.authorize_file_path.name}.{os.getpid()}."
+            f"{threading.get_ident()}.{next(self._temp_counter)}.tmp"
         )
 
-    def _read_authorize_file(self) -> List[str]:
+    @property
+    def lock_stats(self) -> Dict[str, float]:
+        """プロセス間ロックの待ち時間統計"""
+        return self._file_lock.stats
+
+    @property
+    def write_stats(self) -> Dict[str, Any]:
+        """
+        書込レイテンシの統計
+
+        Returns:
+            {'durability': レベル, 書込方式: {'count', 'total_ms', 'max_ms',
+             'sync_ms'}} の辞書。書込方式は rewrite / direct / inplace / append
+             （checkpointはチェックポイントでのfsync）
+        """
+        with self._write_stats_guard:
+            stats: Dict[str, Any] = {
+                kind: dict(values)
+                for kind, values in self._write_stats.items()
+            }
+        stats['durability'] = self.durability
+        return stats
+
+    def _durable(self, level: str) -> bool:
+        """設定された永続性レベルが指定レベル以上か"""
+        levels = self.DURABILITY_LEVELS
+        return levels.index(self.durability) >= levels.index(level)
+
+    def _sync_fd(self, fd: int, level: str = "file") -> None:
+        """永続性レベルが指定以上ならfsyncし、所要時間を書込の統計に加える"""
+        if not self._durable(level):
+            return
+        start = time.perf_counter()
+        os.fsync(fd)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._sync_ms += elapsed_ms
+        metrics.current().add_ms('fsync', elapsed_ms)
+
+    def _sync_path(self, path: Path, level: str = "file") -> None:
+        """ファイルまたはディレクトリを開いて _sync_fd する"""
+        if not self._durable(level):
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            self._sync_fd(fd, level)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _trace_write(
+        elapsed_ms: float, sync_ms: float, bytes_written: int
+    ) -> None:
+        """書込1回分を実行中の操作に記録（fsyncは別フェーズとして記録済み）"""
+        trace = metrics.current()
+        trace.add_ms('write', elapsed_ms - sync_ms)
+        trace.count('bytes_written', bytes_written)
+
+    def _begin_write(self) -> float:
+        """書込レイテンシの計測を開始"""
+        self._sync_ms = 0.0
+        return time.perf_counter()
+
+    def _record_write(self, kind: str, start: float) -> Tuple[float, float]:
+        """
+        書込1回分のレイテンシを記録
+
+        Args:
+            kind: 書込方式
+            start: _begin_write() の戻り値
+
+        Returns:
+            (全体の所要ミリ秒, うちfsyncのミリ秒)
+        """
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        sync_ms = self._sync_ms
+        with self._write_stats_guard:
+            stats = self._write_stats.setdefault(kind, {
+                'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'sync_ms': 0.0,
+            })
+            stats['count'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            stats['sync_ms'] += sync_ms
+        return elapsed_ms, sync_ms
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """
+        読込→変更→書込の間、スレッド間・プロセス間の両方で排他する
+
+        Raises:
+            LockTimeoutError: プロセス間ロックを取得できなかった場合
+        """
+        start = time.perf_counter()
+        with self._lock:
+            metrics.current().add_ms(
+                'lock_wait', (time.perf_counter() - start) * 1000
+            )
+            if self.concurrency == "optimistic":
+                # 楽観的並行制御では書込直前の版確認時にのみロックする
+                yield
+                return
+            waited_ms = self._file_lock.acquire()
+            try:
+                logger.debug(
+                    "[RadiusManager] exclusive lock acquired | wait_ms=%.1f",
+                    waited_ms,
+                )
+                yield
+            finally:
+                self._file_lock.release()
+
+    def _check_version(
+        self, expected_signature: Any, temp_file: Optional[Path] = None
+    ) -> None:
+        """
+        置換直前にファイルの版が読込時から変わっていないことを確認
+
+        Args:
+            expected_signature: 読込時の署名（_ANY_VERSIONなら確認しない）
+            temp_file: 競合時に削除する一時ファイル
+
+        Raises:
+            AuthorizeConflictError: 読込後に他から更新されていた場合
+        """
+        if expected_signature is _ANY_VERSION:
+            return
+        current = self._stat_signature()
+        if current != expected_signature:
+            if temp_file is not None:
+                temp_file.unlink(missing_ok=True)
+            logger.warning(
+                "[RadiusManager] authorize changed since read | "
+                "expected=%s current=%s",
+                expected_signature,
+                current,
+            )
+            raise AuthorizeConflictError(
+                f"'{self.authorize_file_path}' was modified concurrently"
+            )
+
+    @staticmethod
+    def _signature_of(st: os.stat_result) -> Tuple[int, int, int]:
+        """stat結果からファイル署名 (st_ino, st_mtime_ns, st_size) を作る"""
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _stat_signature(self) -> Optional[Tuple[int, int, int]]:
+        """
+        authorizeファイルの現在の署名を取得
+
+        Returns:
+            (st_ino, st_mtime_ns, st_size) のタプル（存在しない場合はNone）
+        """
+        try:
+            return self._signature_of(os.stat(self.authorize_file_path))
+        except FileNotFoundError:
+            return None
+
+    def _read_authorize_snapshot(
+        self,
+    ) -> Tuple[List[str], Optional[Tuple[int, int, int]]]:
         """
-        authorizeファイルを読み込み
+        authorizeファイルを読み込み、読み込んだ内容の署名と一緒に返す
+
+        署名は開いたファイルディスクリプタからfstatで取得するため、
+        読み込み中に置き換えられても内容と署名が食い違わない。
 
         Returns:
-            ファイルの行リスト
+            (ファイルの行リスト, 署名) のタプル
         """
+        trace = metrics.current()
         try:
-            with open(self.authorize_file_path, 'r', encoding='utf-8') as rf:
+            with trace.phase('read'), open(
+                self.authorize_file_path, 'r', encoding='utf-8'
+            ) as rf:
+                signature = self._signature_of(os.fstat(rf.fileno()))
                 lines = rf.readlines()
+                trace.count('read_bytes', signature[2])
                 logger.debug(
                     "[RadiusManager] read authorize | path=%s lines=%d "
                     "bytes≈%d",
@@ -53,89 +438,593 @@ class RadiusManager:
                     len(lines),
                     sum(len(x) for x in lines),
                 )
-                return lines
+                return lines, signature
         except FileNotFoundError:
             logger.warning(
                 "[RadiusManager] authorize not found, treating as empty | "
                 "path=%s",
                 self.authorize_file_path,
             )
-            return []
-
-    def _write_authorize_file(self, lines: List[str]) -> None:
+            return [], None
+
+    def _write_authorize_file(
+        self,
+        lines: Iterable[str],
+        expected_signature: Any = _ANY_VERSION,
+        journal_ops: Sequence[Dict[str, Any]] = (),
+    ) -> Optional[Tuple[int, int, int]]:
         """
         authorizeファイルに書き込み（アトミック操作）
 
+        永続性レベルに応じて、一時ファイルのfsync（file以上）と
+        置換後の親ディレクトリのfsync（full）を行う。
+        expected_signatureを指定した場合、置換の直前（プロセス間ロック内）で
+        ファイルの署名が一致することを確認する（compare-and-swap）。
+        journal_opsは置換と同じロック内で先にジャーナルへ記録する。
+
         Args:
-            lines: 書き込む行のリスト
+            lines: 書き込む行（リストまたは1回だけ反復できるジェネレータ）
+            expected_signature: 読込時のファイル署名
+            journal_ops: ジャーナルに記録する論理操作
+
+        Returns:
+            書き込んだファイルの署名
+
+        Raises:
+            AuthorizeConflictError: 読込後に他から更新されていた場合
         """
         # 一時ファイルに書き込み後、アトミックに置き換え
-        temp_file = self.authorize_file_path.with_suffix('.tmp')
+        temp_file = self._temp_path()
+        start = self._begin_write()
 
         try:
             with open(temp_file, 'w', encoding='utf-8') as tmpf:
-                tmpf.writelines(lines)
-            logger.debug(
-                "[RadiusManager] wrote temp authorize | temp=%s lines=%d",
-                temp_file,
-                len(lines),
-            )
+                line_count = 0
+                size_bytes = 0
+                for line in lines:
+                    tmpf.write(line)
+                    line_count += 1
+                    size_bytes += len(line)
+                tmpf.flush()
+                self._sync_fd(tmpf.fileno())
+                logger.debug(
+                    "[RadiusManager] wrote temp authorize | temp=%s lines=%d",
+                    temp_file,
+                    line_count,
+                )
 
-            # アトミックに置き換え
-            temp_file.replace(self.authorize_file_path)
+                # アトミックに置き換え（置換後もfdは同じinodeを指す）
+                with self._file_lock:
+                    self._check_version(expected_signature, temp_file)
+                    staged = self._stage_snapshot()
+                    mark = self._journal_begin(journal_ops)
+                    try:
+                        temp_file.replace(self.authorize_file_path)
+                    except BaseException:
+                        self._journal_abort(mark)
+                        self._discard_snapshot(staged)
+                        raise
+                    self._sync_path(self.authorize_file_path.parent, "full")
+                signature = self._signature_of(os.fstat(tmpf.fileno()))
+            elapsed_ms, sync_ms = self._record_write('rewrite', start)
+            self._trace_write(elapsed_ms, sync_ms, size_bytes)
+            self._record_snapshot(staged, 'rewrite')
             logger.info(
                 "[RadiusManager] authorize updated atomically | path=%s "
-                "size_bytes=%d",
+                "size_bytes=%d durability=%s elapsed_ms=%.1f sync_ms=%.1f",
                 self.authorize_file_path,
-                sum(len(x) for x in lines),
+                size_bytes,
+                self.durability,
+                elapsed_ms,
+                sync_ms,
             )
+            return signature
         except OSError as e:
             # EBUSYなどでリネームできない環境向けフォールバック
-            import errno
             if getattr(e, 'errno', None) == errno.EBUSY:
                 logger.warning(
                     "[RadiusManager] atomic replace failed with EBUSY. "
                     "Falling back to direct write | path=%s",
                     self.authorize_file_path,
                 )
-                try:
-                    with open(
-                        self.authorize_file_path, 'w', encoding='utf-8'
-                    ) as wf:
-                        wf.writelines(lines)
-                    logger.info(
-                        "[RadiusManager] authorize updated by direct write | "
-                        "path=%s size_bytes=%d",
-                        self.authorize_file_path,
-                        sum(len(x) for x in lines),
-                    )
-                finally:
-                    if temp_file.exists():
-                        temp_file.unlink(missing_ok=True)
-            else:
-                if temp_file.exists():
-                    temp_file.unlink()
-                logger.error(
-                    "[RadiusManager] failed to write authorize | path=%s "
-                    "error=%s",
+                signature = self._copy_into_place(
+                    temp_file, expected_signature, journal_ops
+                )
+                elapsed_ms, sync_ms = self._record_write('direct', start)
+                self._trace_write(elapsed_ms, sync_ms, signature[2])
+                logger.info(
+                    "[RadiusManager] authorize updated by direct write | "
+                    "path=%s size_bytes=%d durability=%s elapsed_ms=%.1f "
+                    "sync_ms=%.1f",
                     self.authorize_file_path,
-                    e,
-                    exc_info=True,
+                    signature[2],
+                    self.durability,
+                    elapsed_ms,
+                    sync_ms,
                 )
+                return signature
+            if temp_file.exists():
+                temp_file.unlink()
+            logger.error(
+                "[RadiusManager] failed to write authorize | path=%s "
+                "error=%s",
+                self.authorize_file_path,
+                e,
+                exc_info=True,
+            )
+            raise
+
+    def _copy_into_place(
+        self,
+        temp_file: Path,
+        expected_signature: Any,
+        journal_ops: Sequence[Dict[str, Any]],
+        reason: str = 'direct',
+    ) -> Optional[Tuple[int, int, int]]:
+        """
+        書込済みの一時ファイルの内容をauthorizeファイルへ直接書き込む
+
+        一時ファイルをstate_dirへ移してから意図ファイルに記録するため、
+        コピーの途中で停止して本体が切り詰められていても次回起動時に復旧できる。
+
+        Args:
+            temp_file: 書込済みの一時ファイル
+            expected_signature: 読込時のファイル署名
+            journal_ops: ジャーナルに記録する論理操作
+            reason: 上書きする前の版をスナップショットに登録する際の理由
+
+        Returns:
+            書き込んだファイルの署名
+        """
+        staged = self._state_path('.staged')
+        with self._file_lock:
+            self._check_version(expected_signature, temp_file)
+            shutil.move(str(temp_file), str(staged))
+            self._sync_path(staged)
+            # 同じinodeを上書きするため、スナップショットはコピーで退避する
+            previous = self._stage_snapshot(copy=True)
+            mark = self._journal_begin(journal_ops)
+            try:
+                intent = self._write_inplace_intent({}, copy_from=staged)
+            except BaseException:
+                self._journal_abort(mark)
+                self._discard_snapshot(previous)
                 raise
+            signature = self._copy_staged(staged)
+            intent.unlink()
+            staged.unlink(missing_ok=True)
+        self._record_snapshot(previous, reason)
+        return signature
+
+    def _stage_snapshot(self, copy: bool = False) -> Optional[Path]:
+        """置き換える直前のauthorizeを退避（プロセス間ロック内で呼ぶ）"""
+        if self._snapshots is None:
+            return None
+        try:
+            return self._snapshots.stage(self.authorize_file_path, copy=copy)
+        except OSError as e:
+            # スナップショットは補助情報なので、退避できなくても書込は続ける
+            logger.warning(
+                "[RadiusManager] failed to stage snapshot | error=%s", e
+            )
+            return None
 
-    def _sanitize_lines(self, lines: List[str]) -> List[str]:
+    def _discard_snapshot(self, staged: Optional[Path]) -> None:
+        """置き換えなかった場合に退避したauthorizeを削除"""
+        if self._snapshots is not None:
+            self._snapshots.discard(staged)
+
+    def _record_snapshot(self, staged: Optional[Path], reason: str) -> None:
+        """退避したauthorizeを世代として登録"""
+        if self._snapshots is None or staged is None:
+            return
+        try:
+            with metrics.current().phase('snapshot'):
+                self._snapshots.record(staged, reason)
+        except Exception as e:
+            logger.warning(
+                "[RadiusManager] failed to record snapshot | error=%s", e
+            )
+
+    def _copy_staged(self, staged: Path) -> Tuple[int, int, int]:
+        """退避した内容でauthorizeファイルを上書きしてfsyncする（inodeは維持）"""
+        if self._snapshots is not None:
+            # 巻き戻しでスナップショットとinodeを共有している場合、
+            # その場で上書きすると保存済みの世代まで書き換わってしまう
+            self._snapshots.unshare(self.authorize_file_path)
+        with open(staged, 'rb') as src, open(
+            self.authorize_file_path, 'wb'
+        ) as wf:
+            shutil.copyfileobj(src, wf, self._IO_BUFFER_SIZE)
+            wf.flush()
+            self._sync_fd(wf.fileno())
+            return self._signature_of(os.fstat(wf.fileno()))
+
+    def _write_inplace_intent(
+        self,
+        patches: Dict[int, Tuple[str, str]],
+        append: Optional[Tuple[int, str]] = None,
+        copy_from: Optional[Path] = None,
+    ) -> Path:
+        """
+        インプレース更新の意図（位置・旧値・新値、追記位置・追記内容、
+        直接書込の元ファイル）を先に永続化
+
+        Args:
+            patches: バイト位置→(旧NTハッシュ, 新NTハッシュ)
+            append: (追記前のファイルサイズ, 追記するテキスト)
+            copy_from: 直接書込する内容を退避したファイル
+
+        Returns:
+            意図ファイルのパス
+        """
+        intent = self._state_path('.inplace')
+        record: Dict[str, Any] = {
+            'path': str(self.authorize_file_path),
+            'patches': [
+                [offset, old, new] for offset, (old, new) in patches.items()
+            ],
+        }
+        if append is not None:
+            record['append'] = {'offset': append[0], 'text': append[1]}
+        if copy_from is not None:
+            record['copy'] = str(copy_from)
+        fd = os.open(intent, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.write(fd, json.dumps(record).encode('utf-8'))
+            self._sync_fd(fd)
+        finally:
+            os.close(fd)
+        self._sync_path(self.state_dir, "full")
+        return intent
+
+    def _recover_inplace(self) -> None:
+        """
+        中断したインプレース更新・追記・直接書込を意図ファイルから完了させる（冪等）
+
+        直接書込は退避した内容で書き直す。
+        各位置の現在値が旧値、または書込途中で新旧が混ざった値なら新値を書き、
+        新値なら何もしない。
+        追記は内容が揃っていれば何もせず、途中まで書かれていれば追記前の
+        サイズに切り詰めて書き直す。想定外の内容の場合は
+        その後ファイルが書き換えられたとみなして触らない。
+        """
+        intent = self._state_path('.inplace')
+        if not intent.exists():
+            return
+        with self._lock, self._file_lock:
+            try:
+                record = json.loads(intent.read_text(encoding='utf-8'))
+                patches = record['patches']
+                append = record.get('append')
+                copy_from = record.get('copy')
+            except FileNotFoundError:
+                # ロック待ちの間に他プロセスが完了させた
+                return
+            except (OSError, ValueError, KeyError) as e:
+                # 意図の書込途中で停止した場合。本体は未変更
+                logger.warning(
+                    "[RadiusManager] discard incomplete in-place intent | "
+                    "intent=%s error=%s",
+                    intent,
+                    e,
+                )
+                intent.unlink(missing_ok=True)
+                return
+
+            if copy_from is not None:
+                staged = Path(copy_from)
+                if staged.exists():
+                    self._copy_staged(staged)
+                    staged.unlink()
+                    logger.info(
+                        "[RadiusManager] direct write recovered | path=%s",
+                        self.authorize_file_path,
+                    )
+                intent.unlink(missing_ok=True)
+                return
+
+            try:
+                fd = os.open(self.authorize_file_path, os.O_RDWR)
+            except FileNotFoundError:
+                intent.unlink(missing_ok=True)
+                return
+            try:
+                redone = 0
+                for offset, old, new in patches:
+                    current = os.pread(fd, NT_HASH_LENGTH, offset)
+                    if current == new.encode('ascii'):
+                        continue
+                    if self._is_torn_slot(current, old, new):
+                        os.pwrite(fd, new.encode('ascii'), offset)
+                        redone += 1
+                    else:
+                        logger.warning(
+                            "[RadiusManager] in-place recovery skipped "
+                            "changed slot | offset=%d",
+                            offset,
+                        )
+                if append is not None:
+                    redone += self._recover_append(
+                        fd, append['offset'], append['text']
+                    )
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            intent.unlink(missing_ok=True)
+            logger.info(
+                "[RadiusManager] in-place update recovered | patches=%d "
+                "append=%s redone=%d",
+                len(patches),
+                append is not None,
+                redone,
+            )
+
+    @staticmethod
+    def _is_torn_slot(current: bytes, old: str, new: str) -> bool:
+        """
+        スロットの現在値が旧値、または旧値と新値が混ざった値か
+
+        pwriteの途中で停止すると、先頭側だけが新値になることがある。
+        各桁が旧値か新値の同じ桁と一致すれば、この更新の途中の状態とみなす。
+        """
+        if len(current) != NT_HASH_LENGTH:
+            return False
+        return all(
+            byte in (o, n)
+            for byte, o, n in zip(
+                current, old.encode('ascii'), new.encode('ascii')
+            )
+        )
+
+    @staticmethod
+    def _recover_append(fd: int, offset: int, text: str) -> int:
+        """
+        中断した追記を完了させる
+
+        Returns:
+            書き直した場合1、不要または書き直せない場合0
+        """
+        data = text.encode('utf-8')
+        size = os.fstat(fd).st_size
+        if size >= offset + len(data) and \
+                os.pread(fd, len(data), offset) == data:
+            return 0
+        written = size - offset
+        if 0 <= written < len(data) and \
+                os.pread(fd, written, offset) == data[:written]:
+            os.ftruncate(fd, offset)
+            os.pwrite(fd, data, offset)
+            return 1
+        logger.warning(
+            "[RadiusManager] append recovery skipped changed tail | "
+            "offset=%d size=%d",
+            offset,
+            size,
+        )
+        return 0
+
+    def _apply_inplace(
+        self,
+        patches: Dict[int, Tuple[str, str]],
+        append_text: str,
+        expected_signature: Any,
+        journal_ops: Sequence[Dict[str, Any]] = (),
+    ) -> Optional[Tuple[int, int, int]]:
+        """
+        固定長のNTハッシュのpwriteによる書換と、末尾へのO_APPEND追記だけで更新する
+        （既存部分を読み書きしないため、処理時間がファイルサイズに依存しない）
+
+        書換前に意図ファイルをfsyncし、各位置に旧値があること、
+        追記する場合はファイルが改行で終わっていることを確認してから書く。
+        確認できない（行末やエンコーディングが想定と異なる）場合は何も書かない。
+
+        Args:
+            patches: バイト位置→(旧NTハッシュ, 新NTハッシュ)
+            append_text: 末尾に追記するテキスト（空文字なら追記しない）
+            expected_signature: 読込時のファイル署名
+            journal_ops: 書込前にジャーナルへ記録する論理操作
+
+        Returns:
+            更新後のファイル署名。インプレース更新できなかった場合はNone
+
+        Raises:
+            AuthorizeConflictError: 読込後に他から更新されていた場合
+        """
+        start = self._begin_write()
+        try:
+            fd = os.open(self.authorize_file_path, os.O_RDWR)
+        except FileNotFoundError:
+            return None
+        try:
+            with self._file_lock:
+                self._check_version(expected_signature)
+                if os.fstat(fd).st_nlink > 1:
+                    # スナップショット等とinodeを共有しているため、
+                    # その場で書き換えると共有先も変わってしまう
+                    logger.info(
+                        "[RadiusManager] authorize is hard-linked; "
+                        "falling back to rewrite"
+                    )
+                    return None
+                for offset, (old, _) in patches.items():
+                    if os.pread(fd, NT_HASH_LENGTH, offset) != \
+                            old.encode('ascii'):
+                        logger.info(
+                            "[RadiusManager] in-place layout mismatch; "
+                            "falling back to rewrite | offset=%d",
+                            offset,
+                        )
+                        return None
+
+                before = os.fstat(fd)
+                data = append_text.encode('utf-8')
+                if data and before.st_size > 0 and \
+                        os.pread(fd, 1, before.st_size - 1) != b"\n":
+                    logger.info(
+                        "[RadiusManager] authorize tail is not newline; "
+                        "falling back to rewrite"
+                    )
+                    return None
+
+                mark = self._journal_begin(journal_ops)
+                try:
+                    intent = self._write_inplace_intent(
+                        patches,
+                        (before.st_size, append_text) if data else None,
+                    )
+                except BaseException:
+                    self._journal_abort(mark)
+                    raise
+                for offset, (_, new) in patches.items():
+                    os.pwrite(fd, new.encode('ascii'), offset)
+                if data:
+                    self._append_bytes(data)
+                after = os.fstat(fd)
+                if after.st_mtime_ns <= before.st_mtime_ns and \
+                        after.st_size == before.st_size:
+                    # inodeとサイズが変わらないため、タイムスタンプの粒度内でも
+                    # 他プロセスのキャッシュが変更を検知できるよう mtime を進める
+                    os.utime(
+                        fd,
+                        ns=(after.st_atime_ns, before.st_mtime_ns + 1),
+                    )
+                    after = os.fstat(fd)
+                if patches:
+                    self._sync_fd(fd)
+                signature = self._signature_of(after)
+                intent.unlink()
+        finally:
+            os.close(fd)
+
+        elapsed_ms, sync_ms = self._record_write(
+            'inplace' if patches else 'append', start
+        )
+        self._trace_write(
+            elapsed_ms, sync_ms, NT_HASH_LENGTH * len(patches) + len(data)
+        )
+        logger.info(
+            "[RadiusManager] authorize updated in place | path=%s patches=%d "
+            "appended_bytes=%d durability=%s elapsed_ms=%.1f sync_ms=%.1f",
+            self.authorize_file_path,
+            len(patches),
+            len(data),
+            self.durability,
+            elapsed_ms,
+            sync_ms,
+        )
+        return signature
+
+    def _append_bytes(self, data: bytes) -> None:
+        """authorizeファイル末尾にO_APPENDで追記する（file以上ではfsyncも行う）"""
+        fd = os.open(self.authorize_file_path, os.O_WRONLY | os.O_APPEND)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            self._sync_fd(fd)
+        finally:
+            os.close(fd)
+
+    def _journal_begin(self, ops: Sequence[Dict[str, Any]]) -> Optional[int]:
+        """反映の直前に操作をジャーナルへ記録（プロセス間ロック内で呼ぶ）"""
+        if not ops:
+            return None
+        start = time.perf_counter()
+        mark = self._journal.append(ops, self._stat_signature())
+        if self._journal.sync:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._sync_ms += elapsed_ms
+            metrics.current().add_ms('fsync', elapsed_ms)
+        return mark
+
+    def _journal_abort(self, mark: Optional[int]) -> None:
+        """反映に失敗した操作をジャーナルから取り消す"""
+        if mark is not None:
+            self._journal.rollback(mark)
+
+    def _maybe_checkpoint(self) -> None:
+        """ジャーナルが閾値を超えていればチェックポイントを取る"""
+        if self._journal.size >= self.journal_checkpoint_bytes:
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        """
+        authorizeファイルとディレクトリを永続化し、ジャーナルを空にする
+
+        以後のクラッシュではジャーナルの再適用が不要になる。
+        """
+        with self._lock, self._file_lock:
+            size = self._journal.size
+            if size == 0:
+                return
+            # ジャーナルを捨てる前提なので、永続性レベルに関わらずfsyncする
+            start = self._begin_write()
+            try:
+                self._sync_path(self.authorize_file_path, "none")
+            except FileNotFoundError:
+                pass
+            self._sync_path(self.authorize_file_path.parent, "none")
+            self._record_write('checkpoint', start)
+            self._journal.reset()
+            logger.info(
+                "[RadiusManager] journal checkpointed | journal_bytes=%d",
+                size,
+            )
+
+    def _replay_journal(self) -> None:
+        """
+        書込が反映されなかったコミットをジャーナルから再適用（冪等）
+
+        各記録には書込直前のファイル署名がある。現在の署名と一致する最後の
+        記録から後が、書込前に停止した（またはOSクラッシュで書込が失われた）
+        コミット。一致しない記録は反映済みのため再適用しない（その後の
+        手作業での編集や他プロセスの変更を巻き戻さないように）。
+
+        追加・更新はユーザーがそのNTハッシュで存在する状態に、
+        削除はユーザーが存在しない状態にそろえる。既に反映済みなら何もしない。
+        """
+        with self._lock, self._file_lock:
+            records = self._journal.read()
+            current = self._stat_signature()
+            start = next(
+                (i for i in range(len(records) - 1, -1, -1)
+                 if records[i].before == current),
+                len(records),
+            )
+            pending = records[start:]
+            if not pending:
+                if self._journal.size:
+                    self.checkpoint()
+                return
+            applied = 0
+            with self.transaction() as tx:
+                for record in pending:
+                    for op in record.ops:
+                        applied += tx._replay(op)
+            self.checkpoint()
+            logger.info(
+                "[RadiusManager] journal replayed | commits=%d pending=%d "
+                "applied=%d",
+                len(records),
+                len(pending),
+                applied,
+            )
+
+    @staticmethod
+    def _iter_sanitized(lines: Iterable[str]) -> Iterator[str]:
         """
         孤立したインデント行（ユーザーやDEFAULTヘッダに紐づかない属性行）を除去。
         ついでに連続する空行を1つに圧縮。
 
+        入力を1行ずつ処理するジェネレータなので、ファイルを直接渡してもよい。
+
         Args:
             lines: 現在のauthorize行群
 
-        Returns:
-            サニタイズ後の行群
+        Yields:
+            サニタイズ後の行
         """
-        sanitized: List[str] = []
         inside_header = False
         prev_blank = False
 
@@ -144,7 +1033,7 @@ class RadiusManager:
                 if not inside_header:
                     # 孤立した属性行はスキップ
                     continue
-                sanitized.append(raw)
+                yield raw
                 prev_blank = False
                 continue
 
@@ -154,228 +1043,1174 @@ class RadiusManager:
                 if prev_blank:
                     # 空行を圧縮
                     continue
-                sanitized.append(raw)
+                yield raw
                 prev_blank = True
                 inside_header = False
                 continue
 
-            sanitized.append(raw)
+            yield raw
             prev_blank = False
             # コメント行はヘッダ開始扱いにしない
             inside_header = not stripped.startswith('#')
 
-        return sanitized
-
-    def sanitize_file(self) -> bool:
-        """authorizeファイルをサニタイズして更新（変更があった場合のみ書込）。"""
-        lines = self._read_authorize_file()
-        sanitized = self._sanitize_lines(lines)
-        if sanitized != lines:
-            logger.info(
-                "[RadiusManager] sanitize_file detected junk; rewriting file"
-            )
-            self._write_authorize_file(sanitized)
-            return True
-        return False
-
-    def _find_user_blocks(
-        self, lines: List[str], username: str
-    ) -> List[Tuple[int, int]]:
-        """
-        指定ユーザーの全ブロック(start,end)を返す。endは排他的インデックス。
-        ヘッダ行(ユーザー行)と、直後のインデント行(属性行)を含める。
-        """
-        pattern = re.compile(rf"^{re.escape(username)}\s")
-        blocks: List[Tuple[int, int]] = []
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            if pattern.match(line):
-                start = i
-                j = i + 1
-                while j < len(lines):
-                    if lines[j].startswith('\t') or lines[j].startswith(' '):
-                        j += 1
-                        continue
-                    break
-                blocks.append((start, j))
-                i = j
-                continue
-            i += 1
-        return blocks
-
-    def _parse_user_entry(
-        self, lines: List[str], start_idx: int
-    ) -> Tuple[Dict, int]:
+    def _sanitize_lines(self, lines: List[str]) -> List[str]:
         """
-        ユーザーエントリをパース
+        行リストをサニタイズ（_iter_sanitized のリスト版）
 
         Args:
-            lines: ファイルの行リスト
-            start_idx: ユーザーエントリの開始行
+            lines: 現在のauthorize行群
 
         Returns:
-            (ユーザー情報辞書, 次の行のインデックス) のタプル
+            サニタイズ後の行群
         """
-        if start_idx >= len(lines):
-            return {}, start_idx
+        trace = metrics.current()
+        trace.count('sanitize_passes')
+        with trace.phase('sanitize'):
+            return list(self._iter_sanitized(lines))
+
+    def _open_authorize(self) -> TextIO:
+        """authorizeファイルを大きめのバッファで読込用に開く"""
+        return open(
+            self.authorize_file_path,
+            'r',
+            encoding='utf-8',
+            buffering=self._IO_BUFFER_SIZE,
+        )
 
-        raw_line = lines[start_idx]
-        # インデントされた属性行はスキップ（ユーザー行ではない）
-        if raw_line.startswith('\t') or raw_line.startswith(' '):
-            return {}, start_idx + 1
+    def _needs_sanitize(self) -> bool:
+        """サニタイズで除去される行があるかをストリーミングで判定"""
+        total = 0
 
-        line = raw_line.strip()
-        if not line or line.startswith('#'):
-            return {}, start_idx + 1
+        def _counted(rf: TextIO) -> Iterator[str]:
+            nonlocal total
+            for raw in rf:
+                total += 1
+                yield raw
 
-        # ユーザー行をパース
-        parts = line.split()
-        if len(parts) < 3:
-            return {}, start_idx + 1
+        trace = metrics.current()
+        trace.count('sanitize_passes')
+        try:
+            with trace.phase('sanitize'), self._open_authorize() as rf:
+                kept = sum(1 for _ in self._iter_sanitized(_counted(rf)))
+                trace.count('read_bytes', os.fstat(rf.fileno()).st_size)
+        except FileNotFoundError:
+            return False
+        return kept != total
 
-        username = parts[0]
-        user_info = {
-            'username': username,
-            'line_start': start_idx,
-            'attributes': {}
-        }
+    def sanitize_file(self) -> bool:
+        """
+        authorizeファイルをサニタイズして更新（変更があった場合のみ書込）
 
-        # 属性をパース
-        if 'NT-Password' in line:
-            nt_hash = line.split('"')[1] if '"' in line else ""
-            user_info['attributes']['NT-Password'] = nt_hash
-        elif 'Cleartext-Password' in line:
-            password = line.split('"')[1] if '"' in line else ""
-            user_info['attributes']['Cleartext-Password'] = password
-
-        # 次の行を確認（Reply-Message等）
-        next_idx = start_idx + 1
-        while next_idx < len(lines):
-            next_line = lines[next_idx].strip()
-            if (not next_line.startswith('\t') and
-                    not next_line.startswith(' ')):
-                break
-            if 'Reply-Message' in next_line:
-                reply_msg = next_line.split('"')[1] if '"' in next_line else ""
-                user_info['attributes']['Reply-Message'] = reply_msg
-            next_idx += 1
+        除去対象の有無はロックを取らずにストリーミングで調べ、見つかった場合だけ
+        グループコミット経由で書き換える。走査中も他の変更操作を妨げない。
 
-        user_info['line_end'] = next_idx - 1
-        logger.debug(
-            "[RadiusManager] parsed entry | user=%s attrs=%s "
-            "range=[%d,%d]",
-            user_info.get('username'),
-            list(user_info.get('attributes', {}).keys()),
-            user_info.get('line_start'),
-            user_info.get('line_end'),
-        )
-        return user_info, next_idx
+        Returns:
+            書き換えた場合True
+        """
+        with self.metrics.operation("sanitize_file"):
+            if not self._needs_sanitize():
+                return False
+            logger.info(
+                "[RadiusManager] sanitize_file detected junk; rewriting file"
+            )
+            return self.execute(lambda tx: tx.sanitize()) > 0
 
-    def get_user(self, username: str) -> Optional[Dict]:
+    @staticmethod
+    def _iter_compacted(
+        lines: Iterable[str], history: Dict[str, Dict[str, str]]
+    ) -> Iterator[str]:
         """
-        ユーザー情報を取得
+        行を正規形に変換するジェネレータ
+
+        履歴コメント（# User added / # Password updated）を除去してその日時を
+        historyに集め、孤立した属性行を除去し、ブロック間の空行を1行にそろえる。
+        それ以外のコメントは直後のブロックと一緒に残す。
 
         Args:
-            username: ユーザー名
+            lines: 現在のauthorize行群
+            history: ユーザー名→{'created': 日時, 'updated': 日時} を受け取る辞書
 
-        Returns:
-            ユーザー情報辞書（存在しない場合はNone）
+        Yields:
+            正規形の行
         """
-        with self._lock:
-            logger.debug(
-                "[RadiusManager] get_user called | user=%s",
-                username,
-            )
-            lines = self._read_authorize_file()
+        group: List[str] = []
+        pending: Dict[str, str] = {}
+        in_block = False
+        first = True
+
+        def _flush() -> Iterator[str]:
+            nonlocal first
+            if group:
+                if not first:
+                    yield "\n"
+                yield from group
+                group.clear()
+                first = False
+
+        for raw in lines:
+            if not raw.endswith("\n"):
+                raw += "\n"
+            if raw.startswith('\t') or raw.startswith(' '):
+                if in_block:
+                    group.append(raw)
+                continue
 
-            i = 0
-            while i < len(lines):
-                user_info, next_i = self._parse_user_entry(lines, i)
-                if user_info and user_info['username'] == username:
-                    logger.debug(
-                        "[RadiusManager] user found | user=%s",
-                        username,
+            stripped = raw.strip()
+            if not stripped:
+                yield from _flush()
+                in_block = False
+                continue
+
+            if stripped.startswith('#'):
+                match = _HISTORY_COMMENT.fullmatch(stripped)
+                if match:
+                    key = (
+                        'created' if match.group(1) == 'User added'
+                        else 'updated'
                     )
-                    return user_info
-                i = next_i
+                    pending[key] = match.group(2).strip()
+                    continue
+                if in_block:
+                    yield from _flush()
+                    in_block = False
+                group.append(raw)
+                continue
 
-            logger.debug(
-                "[RadiusManager] user not found | user=%s",
-                username,
-            )
-            return None
+            # ユーザー行（DEFAULT等を含む）
+            if in_block:
+                yield from _flush()
+            if pending:
+                meta = history.setdefault(stripped.split(None, 1)[0], {})
+                if 'created' in pending:
+                    meta['created'] = min(
+                        meta.get('created', pending['created']),
+                        pending['created'],
+                    )
+                if 'updated' in pending:
+                    meta['updated'] = max(
+                        meta.get('updated', pending['updated']),
+                        pending['updated'],
+                    )
+                pending = {}
+            group.append(raw)
+            in_block = True
+
+        yield from _flush()
 
-    def list_users(self) -> List[Dict]:
+    def compact(self) -> Dict[str, Any]:
         """
-        全ユーザー一覧を取得
+        authorizeファイルを正規形に書き直す
+
+        履歴コメントの日時はメタデータストアに移し、コメント・孤立行・余分な空行を
+        取り除く。FreeRADIUSがリロードのたびに読む量を減らす。
 
         Returns:
-            ユーザー情報辞書のリスト
+            bytes_before / bytes_after / bytes_saved、lines_before / lines_after、
+            parse_ms_before / parse_ms_after / parse_ms_saved（本ツールのパーサでの
+            パース時間）、history_users（日時を移したユーザー数）の辞書
         """
-        with self._lock:
-            logger.info("[RadiusManager] list_users")
-            lines = self._read_authorize_file()
-            entries = []
+        with self.metrics.operation("compact"):
+            history: Dict[str, Dict[str, str]] = {}
+
+            def _compact(tx: RadiusTransaction) -> Dict[str, Any]:
+                history.clear()
+                return tx.compact(history)
+
+            stats = self.execute(_compact)
+
+            with self._lock, self._file_lock:
+                users = {entry.username for entry in self.list_users()}
+                merged = self._metadata.load()
+                for username, meta in history.items():
+                    current = merged.setdefault(username, {})
+                    if 'created' in meta:
+                        current['created'] = min(
+                            current.get('created', meta['created']),
+                            meta['created'],
+                        )
+                    if 'updated' in meta:
+                        current['updated'] = max(
+                            current.get('updated', meta['updated']),
+                            meta['updated'],
+                        )
+                self._metadata.rewrite({
+                    username: meta for username, meta in merged.items()
+                    if username in users and meta
+                })
+            stats['history_users'] = len(history)
+            logger.info(
+                "[RadiusManager] compacted | bytes_saved=%d lines_before=%d "
+                "lines_after=%d parse_ms_before=%.1f parse_ms_after=%.1f "
+                "history_users=%d",
+                stats['bytes_saved'],
+                stats['lines_before'],
+                stats['lines_after'],
+                stats['parse_ms_before'],
+                stats['parse_ms_after'],
+                stats['history_users'],
+            )
+            return stats
 
-            i = 0
-            while i < len(lines):
-                user_info, next_i = self._parse_user_entry(lines, i)
-                if user_info:
-                    entries.append(user_info)
-                i = next_i
+    def snapshots(self) -> List[Dict[str, Any]]:
+        """
+        保持しているauthorizeの世代スナップショットの一覧
 
-            return entries
+        Returns:
+            新しい順の {'generation', 'digest', 'size', 'stored', 'created',
+            'reason'} のリスト（スナップショット無効時は空）
+        """
+        if self._snapshots is None:
+            return []
+        return self._snapshots.generations()
 
-    def add_user(
-        self, username: str, password: str = None, nt_hash: str = None
-    ) -> Tuple[str, str]:
+    def rollback(self, generation: int) -> Dict[str, Any]:
         """
-        ユーザーを追加
+        authorizeファイルを指定世代のスナップショットに巻き戻す
+
+        スナップショットを一時ファイルとしてリンクし、リネーム1回で置き換える
+        （リネームできない場合は_write_authorize_fileと同様に直接書き込む）。
+        巻き戻す前の内容も新しい世代として残るため、巻き戻し自体も取り消せる。
+        巻き戻した変更が再起動時に再適用されないよう、先にジャーナルを空にする。
 
         Args:
-            username: ユーザー名
-            password: 平文パスワード（指定時はNTハッシュ生成）
-            nt_hash: NTハッシュ（直接指定）
+            generation: snapshots()の世代番号
 
         Returns:
-            (生成されたパスワード, NTハッシュ) のタプル
+            {'generation', 'users_before', 'users_after', 'changed'} の辞書
+
+        Raises:
+            RuntimeError: スナップショットが無効な場合
+            ValueError: 世代が存在しない場合
         """
-        with self._lock:
-            # 既存ユーザーチェック
-            if self.get_user(username):
-                raise ValueError(f"User '{username}' already exists")
-
-            # パスワード生成またはハッシュ化
-            if password is None:
-                password, nt_hash = PasswordManager.generate_user_credentials()
-            elif nt_hash is None:
-                nt_hash = PasswordManager.generate_nt_hash(password)
+        with self.metrics.operation("rollback"):
+            if self._snapshots is None:
+                raise RuntimeError("snapshots are disabled")
+            start = time.perf_counter()
+            with self._lock, self._file_lock:
+                before = {
+                    username: entry.nt_hash
+                    for username, entry in self._load_index().items()
+                    if entry.nt_hash
+                }
+                self.checkpoint()
+                temp, info = self._snapshots.prepare(
+                    generation, self.authorize_file_path
+                )
+                staged = self._stage_snapshot()
+                try:
+                    temp.replace(self.authorize_file_path)
+                except OSError as e:
+                    self._discard_snapshot(staged)
+                    staged = None
+                    if e.errno != errno.EBUSY:
+                        temp.unlink(missing_ok=True)
+                        raise
+                    # authorizeを単独でバインドマウントしている場合など
+                    logger.warning(
+                        "[RadiusManager] atomic replace failed with EBUSY. "
+                        "Falling back to direct write | path=%s",
+                        self.authorize_file_path,
+                    )
+                    self._copy_into_place(
+                        temp, _ANY_VERSION, (), reason='rollback'
+                    )
+                except BaseException:
+                    temp.unlink(missing_ok=True)
+                    self._discard_snapshot(staged)
+                    raise
+                self._sync_path(self.authorize_file_path.parent, "full")
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                after = {
+                    username: entry.nt_hash
+                    for username, entry in self._load_index().items()
+                    if entry.nt_hash
+                }
+                changed = [
+                    username for username in before.keys() | after.keys()
+                    if before.get(username) != after.get(username)
+                ]
+                if changed and self._mirrors:
+                    self._run_mirrors([{'user': name} for name in changed])
+            self._record_snapshot(staged, 'rollback')
+            self._notify_commit(len(changed))
+            logger.info(
+                "[RadiusManager] rolled back | generation=%d users_before=%d "
+                "users_after=%d changed=%d elapsed_ms=%.1f",
+                generation,
+                len(before),
+                len(after),
+                len(changed),
+                elapsed_ms,
+            )
+            return {
+                'generation': info['generation'],
+                'users_before': len(before),
+                'users_after': len(after),
+                'changed': len(changed),
+            }
+
+    @staticmethod
+    def _locate_nt_hash(raw: str) -> Tuple[str, int]:
+        """
+        ユーザー行からNT-Passwordの値と、行頭からの値のバイト位置を取得
 
-            # ファイル読み込み + サニタイズ
-            lines = self._read_authorize_file()
-            lines = self._sanitize_lines(lines)
+        Returns:
+            (値, バイト位置) のタプル。値が32桁の16進でなければ位置は-1
+        """
+        quote = raw.find('"', raw.find('NT-Password'))
+        if quote < 0:
+            return "", -1
+        end = raw.find('"', quote + 1)
+        value = raw[quote + 1:end] if end >= 0 else raw[quote + 1:].strip()
+        if end < 0 or len(value) != NT_HASH_LENGTH or not _is_hex(value):
+            return value, -1
+        prefix = raw[:quote + 1]
+        if not prefix.isascii():
+            return value, len(prefix.encode('utf-8'))
+        return value, len(prefix)
+
+    def _iter_parse(
+        self,
+        lines: Iterable[str],
+        stats: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[UserEntry]:
+        """
+        行を1行ずつ読みながらユーザーエントリをパースするジェネレータ
 
-            # ユーザーエントリを追加
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            new_entry = [
-                f"\n# User added: {timestamp}\n",
-                f"{username}\tNT-Password := \"{nt_hash}\"\n",
-                f"\tReply-Message := \"Welcome {username}\"\n\n",
-            ]
+        ユーザー行(3トークン以上の非インデント行)と直後のインデント行を1エントリとし、
+        エントリが閉じた時点で順にyieldする。NT-Passwordの値のバイト位置も記録する。
 
-            # ファイル末尾に追加
-            lines.extend(new_entry)
+        Args:
+            lines: ファイルの行（ファイルオブジェクトでもよい）
+            stats: 指定時、読み終えた時点で行数(lines)と
+                末尾が改行で終わっているか(tail_ok)を設定する
 
-            # ファイル書き込み
-            self._write_authorize_file(lines)
-            logger.info(
-                "[RadiusManager] user added | user=%s nt_hash_sample=%s",
+        Yields:
+            UserEntry
+        """
+        username: Optional[str] = None
+        line_start = line_end = 0
+        hash_offset = -1
+        attrs: List[Tuple[str, str]] = []
+        pos = 0
+        idx = -1
+        raw = "\n"
+
+        for idx, raw in enumerate(lines):
+            line_pos = pos
+            pos += len(raw) if raw.isascii() else len(raw.encode('utf-8'))
+
+            if raw.startswith('\t') or raw.startswith(' '):
+                # 属性行（Reply-Message等）。エントリ外の孤立行は無視
+                if username is not None:
+                    line = raw.strip()
+                    if 'Reply-Message' in line:
+                        reply_msg = line.split('"')[1] if '"' in line else ""
+                        attrs.append(('Reply-Message', reply_msg))
+                    line_end = idx
+                continue
+
+            if username is not None:
+                yield UserEntry(
+                    username, line_start, line_end, attrs, hash_offset
+                )
+                username = None
+
+            line = raw.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            # ユーザー行をパース
+            parts = line.split()
+            if len(parts) < 3:
+                continue
+
+            username = parts[0]
+            line_start = line_end = idx
+            hash_offset = -1
+            attrs = []
+            if 'NT-Password' in line:
+                nt_hash, rel = self._locate_nt_hash(raw)
+                attrs.append(('NT-Password', nt_hash))
+                if rel >= 0:
+                    hash_offset = line_pos + rel
+            elif 'Cleartext-Password' in line:
+                password = line.split('"')[1] if '"' in line else ""
+                attrs.append(('Cleartext-Password', password))
+
+        if username is not None:
+            yield UserEntry(username, line_start, line_end, attrs, hash_offset)
+        if stats is not None:
+            stats['lines'] = idx + 1
+            stats['tail_ok'] = raw.endswith('\n')
+
+    def iter_entries(self) -> Iterator[UserEntry]:
+        """
+        authorizeファイルをストリーミングでパースし、エントリを順に返す
+
+        ファイル全体をメモリに載せないため、巨大なファイルでもメモリ使用量は一定。
+
+        Yields:
+            UserEntry
+        """
+        try:
+            with self._open_authorize() as rf:
+                yield from self._iter_parse(rf)
+        except FileNotFoundError:
+            return
+
+    def _build_index(
+        self,
+        lines: Iterable[str],
+        stats: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[Dict[str, UserEntry], List[UserEntry], AbstractSet[str]]:
+        """
+        行からユーザー名→エントリのインデックスを構築
+
+        同名ユーザーが複数ある場合、インデックスには先頭のブロックを登録する。
+
+        Args:
+            lines: ファイルの行（ファイルオブジェクトでもよい）
+            stats: _iter_parse と同じ（行数と末尾の状態を受け取る辞書）
+
+        Returns:
+            (ユーザー名→エントリ辞書, ファイル順のエントリリスト,
+             複数ブロックを持つユーザー名の集合) のタプル
+        """
+        index: Dict[str, UserEntry] = {}
+        entries: List[UserEntry] = []
+        duplicates = set()
+        if stats is None:
+            stats = {}
+        trace = metrics.current()
+        with trace.phase('parse'):
+            for user_info in self._iter_parse(lines, stats):
+                entries.append(user_info)
+                if user_info.username in index:
+                    duplicates.add(user_info.username)
+                else:
+                    index[user_info.username] = user_info
+        trace.count('lines_parsed', stats['lines'])
+        return index, entries, duplicates
+
+    def _set_index(
+        self,
+        lines: Iterable[str],
+        signature: Optional[Tuple[int, int, int]],
+    ) -> None:
+        """
+        指定内容でインデックスを更新（署名はその内容のファイルのもの）
+
+        Args:
+            lines: ファイルの行
+            signature: 内容に対応するファイル署名
+        """
+        self._adopt(self._parse_version(lines, signature))
+        logger.debug(
+            "[RadiusManager] index rebuilt | users=%d signature=%s",
+            len(self._index),
+            signature,
+        )
+
+    def _parse_version(
+        self,
+        lines: Iterable[str],
+        signature: Optional[Tuple[int, int, int]],
+    ) -> _IndexVersion:
+        """行からインデックスの版を作成"""
+        stats: Dict[str, Any] = {}
+        index, entries, duplicates = self._build_index(lines, stats)
+        return _IndexVersion(
+            signature,
+            index,
+            entries,
+            duplicates,
+            stats['lines'],
+            stats['tail_ok'],
+        )
+
+    def _adopt(self, version: _IndexVersion) -> None:
+        """版を書込側のインデックスとして採用し、参照用にも公開"""
+        self._index = version.index
+        self._index_entries = version.entries
+        self._index_duplicates = version.duplicates
+        self._index_signature = version.signature
+        self._index_line_count = version.line_count
+        self._index_tail_ok = version.tail_ok
+        with self._publish_guard:
+            self._published = version
+
+    def _apply_inplace_entries(
+        self,
+        patched: Iterable[UserEntry],
+        appended: List[UserEntry],
+        appended_lines: int,
+        expected_signature: Any,
+        signature: Optional[Tuple[int, int, int]],
+    ) -> None:
+        """
+        インプレース更新・追記したエントリをインデックスに反映（再パースしない）
+
+        Args:
+            patched: ハッシュを書き換えた既存ユーザーの更新後エントリ
+            appended: 末尾に追記したエントリ（ファイル順）
+            appended_lines: 追記した行数
+            expected_signature: 更新前のファイル署名
+            signature: 更新後のファイル署名
+        """
+        if self._index is None or self._index_signature != expected_signature:
+            self._index = None
+            with self._publish_guard:
+                self._published = None
+            return
+        # 公開済みの版は変更せず、複製に反映して新しい版として公開する
+        index = dict(self._index)
+        replaced = {}
+        for entry in patched:
+            old = index.get(entry.username)
+            if old is not None:
+                replaced[id(old)] = entry
+            index[entry.username] = entry
+        if replaced:
+            entries = [replaced.get(id(e), e) for e in self._index_entries]
+        else:
+            entries = list(self._index_entries)
+        for entry in appended:
+            index[entry.username] = entry
+        entries.extend(appended)
+        line_count, tail_ok = self._index_line_count, self._index_tail_ok
+        if appended_lines:
+            line_count += appended_lines
+            tail_ok = True
+        self._adopt(_IndexVersion(
+            signature,
+            index,
+            entries,
+            self._index_duplicates,
+            line_count,
+            tail_ok,
+        ))
+
+    def _load_index(self) -> Dict[str, UserEntry]:
+        """
+        インデックスを取得（ファイル署名が変わっていなければ再読込しない）
+
+        再構築時はファイルをストリーミングでパースする。
+
+        Returns:
+            ユーザー名→エントリ辞書
+        """
+        signature = self._stat_signature()
+        if self._index is not None and signature == self._index_signature:
+            return self._index
+        published = self._published
+        if (
+            published is not None
+            and signature is not None
+            and published.signature == signature
+        ):
+            # 参照側で再構築済みの版をそのまま使う
+            self._adopt(published)
+            return self._index
+        try:
+            with self._open_authorize() as rf:
+                signature = self._signature_of(os.fstat(rf.fileno()))
+                metrics.current().count('read_bytes', signature[2])
+                self._set_index(rf, signature)
+        except FileNotFoundError:
+            self._set_index([], None)
+        return self._index
+
+    def watch(
+        self, poll_interval: float = 5.0, use_inotify: bool = True
+    ) -> AuthorizeWatcher:
+        """
+        authorizeファイルの外部変更の監視を開始
+
+        監視中は、変更を検知した監視スレッドがインデックスを作り直し、
+        get_user / list_users はファイルを確認せずにメモリ上のインデックスを返す。
+
+        Args:
+            poll_interval: ポーリングの間隔（秒、inotify使用時も取りこぼし対策に使う）
+            use_inotify: inotifyを使うか（使えない環境ではポーリングのみ）
+
+        Returns:
+            AuthorizeWatcher
+        """
+        if self._watcher is None or not self._watcher.alive:
+            self._watcher = AuthorizeWatcher(
+                self.authorize_file_path,
+                self._refresh_index,
+                poll_interval=poll_interval,
+                use_inotify=use_inotify,
+            )
+            self._refresh_index()
+            self._watcher.start()
+        return self._watcher
+
+    def _refresh_index(self) -> None:
+        """
+        ファイル署名が変わっていればインデックスを作り直す（監視スレッドから呼ばれる）
+
+        ミラーがあれば、外部の変更（CLI・他のレプリカ・手作業での編集）で
+        変わったユーザーもミラーに反映する。
+        """
+        self._index_trusted = False
+        self._read_version()
+        self._index_trusted = True
+        if self._mirrors:
+            self._reconcile_mirrors()
+
+    def _reconcile_mirrors(self) -> None:
+        """
+        前回の照合時からファイル上で変わったユーザーをミラーに反映
+
+        公開済みの版はコミット等でも進むため、版の差分ではなく前回照合した
+        インデックスと比べる。このプロセスのコミットで反映済みのユーザーも
+        対象になりうるが、ミラーには現在の状態を渡すため結果は変わらない。
+        """
+        try:
+            with self._lock, self._file_lock:
+                index = self._load_index()
+                previous, self._mirrored_index = self._mirrored_index, index
+                if previous is None or previous is index:
+                    return
+                changed = [
+                    username for username in previous.keys() | index.keys()
+                    if previous.get(username) is not index.get(username)
+                    and getattr(previous.get(username), 'nt_hash', None)
+                    != getattr(index.get(username), 'nt_hash', None)
+                ]
+                if changed:
+                    logger.info(
+                        "[RadiusManager] external change mirrored | "
+                        "users=%d",
+                        len(changed),
+                    )
+                    self._run_mirrors([{'user': name} for name in changed])
+        except Exception as e:
+            logger.error(
+                "[RadiusManager] mirror reconcile failed | error=%s",
+                e,
+                exc_info=True,
+            )
+
+    def _read_version(self) -> _IndexVersion:
+        """
+        参照用のインデックスの版を取得（書込側のロックを取らない）
+
+        監視中はstatせずに公開済みの版を返す。ファイル署名が変わっていれば
+        このスレッドで再構築し、その間に新しい版が公開されていなければ公開する。
+        書込中のトランザクションを待たないため、コミット前の変更は見えない。
+        """
+        version = self._published
+        if version is not None:
+            if self._committing or (
+                self._index_trusted
+                and self._watcher is not None
+                and self._watcher.alive
+            ):
+                return version
+            if version.signature == self._stat_signature():
+                return version
+        with self._rebuild_guard:
+            current = self._published
+            signature = self._stat_signature()
+            if current is not None and current.signature == signature:
+                return current
+            try:
+                with self._open_authorize() as rf:
+                    signature = self._signature_of(os.fstat(rf.fileno()))
+                    metrics.current().count('read_bytes', signature[2])
+                    rebuilt = self._parse_version(rf, signature)
+            except FileNotFoundError:
+                rebuilt = self._parse_version([], None)
+            with self._publish_guard:
+                if self._published is current:
+                    self._published = rebuilt
+            logger.debug(
+                "[RadiusManager] index rebuilt for readers | users=%d "
+                "signature=%s",
+                len(rebuilt.index),
+                signature,
+            )
+            return rebuilt
+
+    def get_user(self, username: str) -> Optional[UserEntry]:
+        """
+        ユーザー情報を取得
+
+        Args:
+            username: ユーザー名
+
+        Returns:
+            UserEntry（存在しない場合はNone）。to_dict()で旧来の辞書形式に変換できる
+        """
+        with self.metrics.operation("get_user"):
+            logger.debug(
+                "[RadiusManager] get_user called | user=%s",
                 username,
-                (nt_hash[:6] + "…") if nt_hash else "***",
+            )
+            tx = getattr(self._local, 'transaction', None)
+            if tx is not None:
+                return tx.get_user(username)
+            # 書込中のトランザクションを待たず、公開済みの版を読む
+            user_info = self._read_version().index.get(username)
+            if user_info is None:
+                logger.debug(
+                    "[RadiusManager] user not found | user=%s",
+                    username,
+                )
+                return None
+
+            logger.debug(
+                "[RadiusManager] user found | user=%s",
+                username,
+            )
+            return user_info
+
+    def list_users(self) -> List[UserEntry]:
+        """
+        全ユーザー一覧を取得
+
+        Returns:
+            UserEntryのリスト
+        """
+        with self.metrics.operation("list_users"):
+            logger.info("[RadiusManager] list_users")
+            return list(self._read_version().entries)
+
+    def _remove_user_blocks(
+        self, lines: List[str], usernames: AbstractSet[str]
+    ) -> Tuple[List[str], Dict[str, int]]:
+        """
+        指定ユーザー群の全ブロックを、直前の履歴コメント/空行ごと1パスで除去
+
+        ブロックはヘッダ行(ユーザー行)と直後のインデント行(属性行)からなる。
+        コメント/空行は次の非コメント行が確定するまで保留し、
+        それが削除対象のヘッダなら保留分ごと捨てる。
+
+        Args:
+            lines: 現在のauthorize行群
+            usernames: 削除対象のユーザー名集合
+
+        Returns:
+            (除去後の行群, ユーザー名→削除したブロック数) のタプル
+        """
+        kept: List[str] = []
+        pending: List[str] = []
+        removed: Dict[str, int] = {}
+        skipping = False
+
+        for raw in lines:
+            indented = raw.startswith('\t') or raw.startswith(' ')
+            if skipping and indented:
+                # 削除対象ブロックの属性行
+                continue
+            skipping = False
+
+            stripped = raw.strip()
+            if stripped == '' or stripped.startswith('#'):
+                pending.append(raw)
+                continue
+
+            if not indented:
+                name = stripped.split(None, 1)[0]
+                if name in usernames:
+                    removed[name] = removed.get(name, 0) + 1
+                    pending.clear()
+                    skipping = True
+                    continue
+
+            kept.extend(pending)
+            pending.clear()
+            kept.append(raw)
+
+        kept.extend(pending)
+        return kept, removed
+
+    @contextmanager
+    def transaction(
+        self, key: Optional[str] = None
+    ) -> Iterator["RadiusTransaction"]:
+        """
+        読込・パース1回、書込1回で複数の操作をまとめるトランザクション
+
+        ブロック内で例外が発生した場合は何も書き込まない。
+        同一スレッドで入れ子になった場合は外側のトランザクションを共有する。
+
+        使用例::
+
+            with manager.transaction() as tx:
+                if tx.get_user(username) is None:
+                    password, nt_hash = tx.add_user(username)
+
+        Args:
+            key: 操作対象のユーザー名（単一ファイルでは使わない。
+                ShardedRadiusManagerと同じ呼び出し方をするためのもの）
+
+        Yields:
+            RadiusTransaction
+
+        Raises:
+            LockTimeoutError: プロセス間ロックを取得できなかった場合
+            AuthorizeConflictError: 読込後に他から更新されていた場合
+                （optimistic時。lock時もロック外の編集を検出した場合）
+        """
+        current = getattr(self._local, 'transaction', None)
+        if current is not None:
+            yield current
+            return
+
+        with self._exclusive():
+            tx = RadiusTransaction(self)
+            self._local.transaction = tx
+            try:
+                yield tx
+                if tx.dirty:
+                    tx.commit()
+            finally:
+                self._local.transaction = None
+
+    def submit(
+        self,
+        op: Callable[["RadiusTransaction"], Any],
+        key: Optional[str] = None,
+    ) -> "Future[Any]":
+        """
+        変更操作をグループコミットのキューに積む
+
+        opはライタースレッド上で、同時に積まれた他の操作と同じ
+        トランザクションの中で呼ばれる。バッチ全体で書込は1回。
+
+        Args:
+            op: RadiusTransactionを受け取り結果を返す関数
+            key: 操作対象のユーザー名（単一ファイルでは使わない。
+                ShardedRadiusManagerと同じ呼び出し方をするためのもの）
+
+        Returns:
+            opの戻り値（または例外）が設定されるFuture
+        """
+        return self._writer.submit(op, metrics.active())
+
+    def execute(
+        self,
+        op: Callable[["RadiusTransaction"], Any],
+        key: Optional[str] = None,
+    ) -> Any:
+        """
+        変更操作をグループコミットで実行し、自分の結果を待つ
+
+        既にトランザクション内にいる場合は、そのトランザクション上で直接実行する。
+
+        Args:
+            op: RadiusTransactionを受け取り結果を返す関数
+            key: 操作対象のユーザー名（submit()と同じ）
+
+        Returns:
+            opの戻り値
+        """
+        tx = getattr(self._local, 'transaction', None)
+        if tx is not None:
+            return op(tx)
+        future = self.submit(op)
+        # 待ち時間の内訳（ライタースレッドでのコミット）はFuture完了前に合算される
+        with metrics.current().phase('commit_wait'):
+            return future.result()
+
+    def _apply_batch(
+        self,
+        batch: List[Tuple[
+            Callable[["RadiusTransaction"], Any],
+            Future,
+            Optional[metrics.OperationTrace],
+        ]],
+    ) -> None:
+        """
+        キューから取り出した操作群を1トランザクション・1回の書込で適用
+
+        個々の操作の例外はその操作のFutureにのみ設定する。
+        他プロセスとの競合(AuthorizeConflictError)時は最新の内容で全操作を再実行し、
+        書込自体が失敗した場合はバッチ内の全Futureに例外を設定する。
+        コミットの計測値（ロック待ち・書込等）は、結果を設定する前に
+        各呼び出し元の操作の計測値へ合算する。
+
+        Args:
+            batch: (操作, Future, 呼び出し元の計測値) のリスト
+        """
+        pending = []
+        callers = []
+        for op, future, caller in batch:
+            if future.set_running_or_notify_cancel():
+                pending.append((op, future))
+                if caller is not None:
+                    callers.append(caller)
+        if not pending:
+            return
+
+        with self.metrics.operation("commit") as trace:
+            trace.count('batch_size', len(pending))
+            outcomes = self._run_batch(pending)
+        if isinstance(trace, metrics.OperationTrace):
+            for caller in callers:
+                caller.merge(trace)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _run_batch(
+        self,
+        pending: List[Tuple[Callable[["RadiusTransaction"], Any], Future]],
+    ) -> List[Tuple[Future, Any, Optional[BaseException]]]:
+        """
+        操作群を1トランザクションで実行（競合時は再実行）
+
+        トランザクションを途中まで変更してから例外を送出した操作があれば、
+        その変更がコミットされないよう、トランザクションを破棄して
+        その操作を除いた残りをやり直す。
+
+        Returns:
+            (Future, 結果, 例外) のリスト。書込自体が失敗した場合は全操作にその例外
+        """
+        # 途中まで変更して失敗した操作（pending内の位置→例外）
+        failed: Dict[int, BaseException] = {}
+        attempt = 0
+        while True:
+            outcomes: List[Tuple[Future, Any, Optional[BaseException]]] = []
+            try:
+                with self._conflict_guard(attempt), \
+                        self.transaction() as tx:
+                    for i, (op, future) in enumerate(pending):
+                        if i in failed:
+                            outcomes.append((future, None, failed[i]))
+                            continue
+                        mark = tx._change_mark()
+                        try:
+                            outcomes.append((future, op(tx), None))
+                        except AuthorizeConflictError:
+                            raise
+                        except Exception as e:
+                            if tx._change_mark() != mark:
+                                failed[i] = e
+                                raise _PartialOperationError() from e
+                            outcomes.append((future, None, e))
+                break
+            except _PartialOperationError as e:
+                # 再試行回数には数えない（失敗した操作が毎回1つ減るため有限）
+                logger.warning(
+                    "[RadiusManager] operation failed after partial changes; "
+                    "rerunning the rest | batch=%d failed=%d error=%s",
+                    len(pending),
+                    len(failed),
+                    e.__cause__,
+                )
+                continue
+            except AuthorizeConflictError as e:
+                if attempt < self.max_conflict_retries:
+                    # 最新の内容に対して全操作をやり直す
+                    logger.info(
+                        "[RadiusManager] group commit conflict; retrying | "
+                        "batch=%d attempt=%d",
+                        len(pending),
+                        attempt + 1,
+                    )
+                    time.sleep(random.uniform(0, 0.01 * (attempt + 1)))
+                    attempt += 1
+                    continue
+                error: BaseException = e
+            except Exception as e:
+                error = e
+            logger.error(
+                "[RadiusManager] group commit failed | batch=%d error=%s",
+                len(pending),
+                error,
+                exc_info=error,
+            )
+            return [(future, None, error) for _, future in pending]
+
+        logger.debug(
+            "[RadiusManager] group commit done | batch=%d",
+            len(pending),
+        )
+        return outcomes
+
+    @contextmanager
+    def _conflict_guard(self, attempt: int) -> Iterator[None]:
+        """
+        最後の再試行だけは読込→書込の間プロセス間ロックを保持する
+
+        optimistic時、他プロセスが書き続けていると再試行のたびに競合しうるため、
+        最後の1回はlock時と同じ方式にして必ず反映できるようにする。
+        """
+        if self.concurrency != "optimistic" or \
+                attempt < self.max_conflict_retries:
+            yield
+            return
+        logger.info(
+            "[RadiusManager] retrying under exclusive lock | attempt=%d",
+            attempt + 1,
+        )
+        with self._lock, self._file_lock:
+            yield
+
+    def _finish_commit(self, ops: List[Dict[str, Any]]) -> None:
+        """
+        コミット後処理（メタデータの記録、チェックポイント、コールバック通知）
+
+        Args:
+            ops: コミットで反映した論理操作
+        """
+        if ops:
+            timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+            events = []
+            for op in ops:
+                if op['op'] == 'delete':
+                    events.append({'user': op['user'], 'deleted': True})
+                elif op['op'] == 'add':
+                    events.append({'user': op['user'], 'created': timestamp})
+                else:
+                    events.append({'user': op['user'], 'updated': timestamp})
+            try:
+                with metrics.current().phase('metadata'), self._file_lock:
+                    self._metadata.record(events)
+            except OSError as e:
+                # メタデータは補助情報なので、記録できなくても変更自体は成功扱い
+                logger.warning(
+                    "[RadiusManager] failed to record metadata | error=%s",
+                    e,
+                )
+        if ops and self._mirrors:
+            with metrics.current().phase('mirror'):
+                self._run_mirrors(ops)
+        self._maybe_checkpoint()
+        self._notify_commit(len(ops))
+
+    def _run_mirrors(self, ops: List[Dict[str, Any]]) -> None:
+        """
+        変更したユーザーの現在の状態をミラーに渡す
+
+        操作の値ではなくロック下で読み直したファイルの状態を渡すため、
+        複数プロセスのコミットの後処理が前後してもミラーは最新の状態になる。
+        """
+        try:
+            with self._lock, self._file_lock:
+                index = self._load_index()
+                users: Dict[str, Optional[str]] = {}
+                for op in ops:
+                    entry = index.get(op['user'])
+                    users[op['user']] = entry.nt_hash if entry else None
+                for mirror in self._mirrors:
+                    mirror(users)
+        except Exception as e:
+            # ファイルへの反映は完了しているので、変更自体は成功扱い
+            logger.error(
+                "[RadiusManager] mirror failed | users=%d error=%s",
+                len(ops),
+                e,
+                exc_info=True,
+            )
+
+    def get_user_metadata(self, username: str) -> Optional[Dict[str, str]]:
+        """
+        ユーザーの作成・更新日時を取得
+
+        Args:
+            username: ユーザー名
+
+        Returns:
+            {'created': 日時, 'updated': 日時}（記録がない場合はNone）
+        """
+        return self._metadata.get(username)
+
+    def add_commit_listener(self, listener: Callable[[int], None]) -> None:
+        """
+        コミット後に呼ばれるコールバックを登録
+
+        Args:
+            listener: コミットで反映した操作数を受け取る関数
+                （ライタースレッド上で呼ばれるため、重い処理はしないこと）
+        """
+        self._commit_listeners.append(listener)
+
+    def add_mirror(
+        self, mirror: Callable[[Dict[str, Optional[str]]], None]
+    ) -> None:
+        """
+        コミットごとに変更したユーザーの状態を受け取るミラーを登録
+
+        watch()で監視中は、外部の変更で変わったユーザーについても呼ばれる。
+
+        Args:
+            mirror: ユーザー名→NTハッシュ（削除済みはNone）の辞書を受け取る関数
+                （プロセス間ロックを保持した状態で呼ばれる）
+        """
+        self._mirrors.append(mirror)
+
+    def _notify_commit(self, op_count: int) -> None:
+        """登録されたコールバックにコミットを通知"""
+        for listener in self._commit_listeners:
+            try:
+                listener(op_count)
+            except Exception as e:
+                logger.warning(
+                    "[RadiusManager] commit listener failed | error=%s",
+                    e,
+                )
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        グループコミットのライタースレッドを停止し（積まれた操作は処理してから終了）、
+        チェックポイントを取る
+
+        Args:
+            timeout: 停止待ちのタイムアウト秒
+        """
+        if self._watcher is not None:
+            self._watcher.stop(timeout)
+        self._writer.close(timeout)
+        self.checkpoint()
+
+    def add_user(
+        self, username: str, password: str = None, nt_hash: str = None
+    ) -> Tuple[str, str]:
+        """
+        ユーザーを追加
+
+        Args:
+            username: ユーザー名
+            password: 平文パスワード（指定時はNTハッシュ生成）
+            nt_hash: NTハッシュ（直接指定）
+
+        Returns:
+            (生成されたパスワード, NTハッシュ) のタプル
+        """
+        with self.metrics.operation("add_user"):
+            return self.execute(
+                lambda tx: tx.add_user(username, password, nt_hash)
             )
 
-            return password, nt_hash
+    def add_users(
+        self,
+        users: Iterable[Union[str, Tuple[str, Optional[str]]]],
+        on_added: Optional[Callable[[str, str, str], None]] = None,
+    ) -> Dict[str, List[str]]:
+        """
+        複数ユーザーを一括追加（読込1回・書込1回）
+
+        大量投入で他の操作のバッチを巻き込まないよう、単独のトランザクションで実行する。
+
+        Args:
+            users: ユーザー名、または (ユーザー名, 平文パスワード) の反復可能オブジェクト
+            on_added: 追加ごとに (ユーザー名, パスワード, NTハッシュ) で呼ばれるコールバック
+
+        Returns:
+            {'added': 追加したユーザー名, 'skipped': スキップしたユーザー名} の辞書
+        """
+        with self.metrics.operation("add_users"):
+            with self.transaction() as tx:
+                return tx.add_users(users, on_added)
 
     def update_user_password(
         self, username: str, new_password: str = None
@@ -390,65 +2225,508 @@ class RadiusManager:
         Returns:
             (新しいパスワード, NTハッシュ) のタプル
         """
-        with self._lock:
-            # ユーザー存在確認
-            logger.info(
-                "[RadiusManager] update_user_password | user=%s",
-                username,
+        with self.metrics.operation("update_user_password"):
+            return self.execute(
+                lambda tx: tx.update_user_password(username, new_password)
             )
-            user_info = self.get_user(username)
-            if not user_info:
-                raise ValueError(f"User '{username}' not found")
 
-            # パスワード生成
-            if new_password is None:
-                new_password, new_nt_hash = (
-                    PasswordManager.generate_user_credentials()
+    def delete_user(self, username: str) -> bool:
+        """
+        ユーザーを削除
+
+        Args:
+            username: ユーザー名
+
+        Returns:
+            削除成功時True、ユーザーが存在しない場合False
+        """
+        with self.metrics.operation("delete_user"):
+            return self.execute(lambda tx: tx.delete_user(username))
+
+    def delete_users(self, usernames: Iterable[str]) -> Dict[str, bool]:
+        """
+        複数ユーザーを一括削除（1パス・書込1回）
+
+        Args:
+            usernames: ユーザー名の反復可能オブジェクト
+
+        Returns:
+            ユーザー名→削除成功時True（存在しない場合False）の辞書
+        """
+        with self.metrics.operation("delete_users"):
+            targets = list(usernames)
+            return self.execute(lambda tx: tx.delete_users(targets))
+
+
+class _GroupCommitWriter:
+    """
+    authorize変更のグループコミット用ライター
+
+    キューに積まれた変更操作を専用スレッドがまとめて取り出し、
+    1つのトランザクション（一時ファイル書込+リネーム1回）で適用する。
+    """
+
+    def __init__(self, manager: RadiusManager, max_batch: int = 256):
+        """
+        初期化
+
+        Args:
+            manager: 対象のRadiusManager
+            max_batch: 1バッチにまとめる最大操作数
+        """
+        self._manager = manager
+        self._max_batch = max_batch
+        self._queue: "queue.Queue[Optional[Tuple[Callable, Future, Any]]]" = (
+            queue.Queue()
+        )
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(
+        self,
+        op: Callable[["RadiusTransaction"], Any],
+        trace: Optional[metrics.OperationTrace] = None,
+    ) -> Future:
+        """
+        操作をキューに積み、結果用のFutureを返す
+
+        Args:
+            op: RadiusTransactionを受け取り結果を返す関数
+            trace: コミットの計測値を合算する呼び出し元の操作
+        """
+        future: Future = Future()
+        self._queue.put((op, future, trace))
+        self._ensure_started()
+        return future
+
+    def _ensure_started(self) -> None:
+        """ライタースレッドを必要に応じて起動"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name="radius-group-commit",
+                    daemon=True,
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        """キューから取れるだけ取り出してバッチ単位でコミットする"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self._max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._manager._apply_batch(batch)
+            if stop:
+                return
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """積まれた操作を処理した後にスレッドを停止"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+
+
+class RadiusTransaction:
+    """
+    authorizeファイルに対するトランザクション
+
+    ファイルの読込は必要になった時点で高々1回だけ行い、
+    変更はメモリ上の行リストに適用してcommit()で1回だけ書き込む。
+    ユーザー追加とNTハッシュ更新だけのトランザクションは行リストを読み込まず、
+    末尾への追記とその場の書換で反映する。
+    RadiusManager.transaction() 経由で利用する。
+    """
+
+    def __init__(self, manager: RadiusManager):
+        """
+        初期化
+
+        Args:
+            manager: 対象のRadiusManager
+        """
+        self._manager = manager
+        self._lines: Optional[List[str]] = None
+        self._index: Optional[Dict[str, UserEntry]] = None
+        self._duplicates: AbstractSet[str] = frozenset()
+        # 判断の根拠にしたファイルの版（コミット時の競合検出に使う）
+        self._base_signature: Any = _ANY_VERSION
+        # インプレース更新: バイト位置→(旧ハッシュ, 新ハッシュ) と更新後エントリ
+        self._hash_patches: Dict[int, Tuple[str, str]] = {}
+        self._patched: Dict[str, UserEntry] = {}
+        # 末尾追記: 追記する行、追加したエントリ、ユーザー名→ユーザー行の位置
+        self._appends: List[str] = []
+        self._appended: Dict[str, UserEntry] = {}
+        self._appended_header: Dict[str, int] = {}
+        self._appended_size = 0
+        # 追記の基準になるファイルの行数・バイト数・末尾の状態
+        self._base_line_count = 0
+        self._base_size = 0
+        self._base_tail_ok = False
+        # ジャーナルに記録する論理操作
+        self._ops: List[Dict[str, Any]] = []
+        # 行リストの全体書換が必要な変更があるか
+        self._needs_rewrite = False
+        self.dirty = False
+        # 変更の回数（グループコミットで途中まで変更して失敗した操作の検出用）
+        self._changes = 0
+
+    def _observe(self, signature: Optional[Tuple[int, int, int]]) -> None:
+        """参照したファイルの版を記録（途中で版が変わっていれば競合）"""
+        if self._base_signature is _ANY_VERSION:
+            self._base_signature = signature
+        elif self._base_signature != signature:
+            raise AuthorizeConflictError(
+                f"'{self._manager.authorize_file_path}' was modified "
+                "during the transaction"
+            )
+
+    def _ensure_lines(self) -> List[str]:
+        """行リストを取得（未読込ならここで1回だけ読み込む）"""
+        if self._lines is None:
+            lines, signature = self._manager._read_authorize_snapshot()
+            self._observe(signature)
+            # 読み込んだ内容でマネージャのインデックスも更新しておく
+            self._manager._set_index(lines, signature)
+            self._lines = lines
+            self._index = self._manager._index
+            self._duplicates = self._manager._index_duplicates
+            if self._patched or self._appends:
+                # 未反映のインプレース更新・追記を行リストにも適用
+                for entry in self._patched.values():
+                    old_hash = self._index[entry.username].nt_hash
+                    lines[entry.line_start] = lines[entry.line_start].replace(
+                        f'"{old_hash}"', f'"{entry.nt_hash}"', 1
+                    )
+                lines.extend(self._appends)
+                self._hash_patches = {}
+                self._patched = {}
+                self._appends = []
+                self._appended = {}
+                self._appended_header = {}
+                self._appended_size = 0
+                self._index = None
+                self._needs_rewrite = True
+        return self._lines
+
+    def _ensure_index(self) -> Dict[str, UserEntry]:
+        """トランザクション内の状態に対応するインデックスを取得"""
+        if self._index is None:
+            if self._lines is None:
+                # 行リストは保持せず、キャッシュ（ファイル変更時はストリーミング
+                # で再構築したもの）を使う
+                manager = self._manager
+                manager._load_index()
+                signature = manager._index_signature
+                self._observe(signature)
+                self._index = manager._index
+                self._duplicates = manager._index_duplicates
+                self._base_line_count = manager._index_line_count
+                self._base_size = signature[2] if signature else 0
+                self._base_tail_ok = (
+                    signature is not None and manager._index_tail_ok
+                )
+            if self._index is None:
+                self._index, _, self._duplicates = (
+                    self._manager._build_index(self._lines)
+                )
+        return self._index
+
+    def _lookup(self, username: str) -> Optional[UserEntry]:
+        """トランザクション内の状態でユーザーを検索"""
+        entry = self._patched.get(username) or self._appended.get(username)
+        if entry is not None:
+            return entry
+        return self._ensure_index().get(username)
+
+    def _mark_dirty(self) -> None:
+        """行リストを変更したとしてインデックスを無効化"""
+        self._index = None
+        self._needs_rewrite = True
+        self.dirty = True
+        self._changes += 1
+
+    def _change_mark(self) -> Tuple[int, int]:
+        """変更の有無を判定するための値（操作の前後で比べる）"""
+        return len(self._ops), self._changes
+
+    def get_user(self, username: str) -> Optional[UserEntry]:
+        """
+        ユーザー情報を取得（トランザクション内の未コミット変更を反映）
+
+        Args:
+            username: ユーザー名
+
+        Returns:
+            UserEntry（存在しない場合はNone）。to_dict()で旧来の辞書形式に変換できる
+        """
+        return self._lookup(username)
+
+    def add_user(
+        self, username: str, password: str = None, nt_hash: str = None
+    ) -> Tuple[str, str]:
+        """
+        ユーザーを追加
+
+        Args:
+            username: ユーザー名
+            password: 平文パスワード（指定時はNTハッシュ生成）
+            nt_hash: NTハッシュ（直接指定）
+
+        Returns:
+            (生成されたパスワード, NTハッシュ) のタプル
+        """
+        # 既存ユーザーチェック
+        if self._lookup(username) is not None:
+            raise ValueError(f"User '{username}' already exists")
+
+        # パスワード生成またはハッシュ化
+        if password is None:
+            password, nt_hash = PasswordManager.generate_user_credentials()
+        elif nt_hash is None:
+            nt_hash = PasswordManager.generate_nt_hash(password)
+
+        # ユーザーエントリをファイル末尾に追加
+        self._add_entry(username, nt_hash)
+        logger.info(
+            "[RadiusManager] user added | user=%s nt_hash_sample=%s",
+            username,
+            (nt_hash[:6] + "…") if nt_hash else "***",
+        )
+
+        return password, nt_hash
+
+    # _new_user_lines() の中のユーザー行の位置
+    _HEADER_INDEX = 1
+
+    @staticmethod
+    def _new_user_lines(username: str, nt_hash: str) -> List[str]:
+        """
+        ユーザーのエントリ行（直前のブロックとの区切りの空行から始まる）
+
+        作成・更新日時はコメントではなくメタデータストアに記録する。
+        """
+        return [
+            "\n",
+            f"{username}\tNT-Password := \"{nt_hash}\"\n",
+            f"\tReply-Message := \"Welcome {username}\"\n",
+        ]
+
+    def _add_entry(self, username: str, nt_hash: str) -> None:
+        """
+        新規ユーザーのエントリを末尾に追加
+
+        行リストを読み込んでいなければ追記予定として保持し（commit時にO_APPEND）、
+        読み込み済みなら行リストに追加する。
+        """
+        self._ops.append({'op': 'add', 'user': username, 'nt_hash': nt_hash})
+        block = self._new_user_lines(username, nt_hash)
+        if self._lines is not None or not self._base_tail_ok:
+            self._ensure_lines().extend(block)
+            self._mark_dirty()
+            return
+
+        header = len(self._appends) + self._HEADER_INDEX
+        offset = self._base_size + self._appended_size + sum(
+            len(line.encode('utf-8'))
+            for line in block[:self._HEADER_INDEX]
+        )
+        _, rel = self._manager._locate_nt_hash(block[self._HEADER_INDEX])
+        line_no = self._base_line_count + header
+        self._appended[username] = UserEntry(
+            username,
+            line_no,
+            line_no + 1,
+            (('NT-Password', nt_hash),
+             ('Reply-Message', f"Welcome {username}")),
+            offset + rel if rel >= 0 else -1,
+        )
+        self._appended_header[username] = header
+        self._appends.extend(block)
+        self._appended_size += sum(len(line.encode('utf-8')) for line in block)
+        self.dirty = True
+        self._changes += 1
+
+    def add_users(
+        self,
+        users: Iterable[Union[str, Tuple[str, Optional[str]]]],
+        on_added: Optional[Callable[[str, str, str], None]] = None,
+    ) -> Dict[str, List[str]]:
+        """
+        複数ユーザーを一括追加
+
+        入力は1件ずつ処理し、既存ユーザーおよび入力内の重複はスキップする。
+
+        Args:
+            users: ユーザー名、または (ユーザー名, 平文パスワード) の反復可能オブジェクト。
+                パスワードが空/Noneの場合は自動生成
+            on_added: 追加ごとに (ユーザー名, パスワード, NTハッシュ) で呼ばれるコールバック
+
+        Returns:
+            {'added': 追加したユーザー名, 'skipped': スキップしたユーザー名} の辞書
+        """
+        seen = set()
+        result: Dict[str, List[str]] = {'added': [], 'skipped': []}
+
+        for item in users:
+            if isinstance(item, str):
+                username, password = item, None
+            else:
+                username = item[0]
+                password = item[1] if len(item) > 1 else None
+            username = username.strip()
+            if not username:
+                continue
+            if username in seen or self._lookup(username) is not None:
+                logger.warning(
+                    "[RadiusManager] add_users: skip existing user | user=%s",
+                    username,
                 )
+                result['skipped'].append(username)
+                continue
+
+            if password:
+                nt_hash = PasswordManager.generate_nt_hash(password)
             else:
-                new_nt_hash = PasswordManager.generate_nt_hash(new_password)
-
-            # ファイル読み込み + サニタイズ
-            lines = self._read_authorize_file()
-            lines = self._sanitize_lines(lines)
-
-            # 既存の同一ユーザーの全ブロックを削除
-            blocks = self._find_user_blocks(lines, username)
-            if blocks:
-                adjusted: List[Tuple[int, int]] = []
-                for (start, end) in blocks:
-                    s = start
-                    while s > 0:
-                        prev = lines[s - 1].strip()
-                        if prev == '' or prev.startswith('#'):
-                            s -= 1
-                            continue
-                        break
-                    adjusted.append((s, end))
-                for s, e in sorted(adjusted, key=lambda x: x[0], reverse=True):
-                    del lines[s:e]
-
-            # 新しいエントリを末尾に1ブロック追加
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            new_entry = [
-                f"# Password updated: {timestamp}\n",
-                f"{username}\tNT-Password := \"{new_nt_hash}\"\n",
-                f"\tReply-Message := \"Welcome {username}\"\n",
-                "\n",
-            ]
-            lines.extend(new_entry)
-
-            # サニタイズ（空行圧縮など）
-            lines = self._sanitize_lines(lines)
-
-            # ファイル書き込み
-            self._write_authorize_file(lines)
+                password, nt_hash = (
+                    PasswordManager.generate_user_credentials()
+                )
+            self._add_entry(username, nt_hash)
+            seen.add(username)
+            result['added'].append(username)
+            if on_added is not None:
+                on_added(username, password, nt_hash)
+
+        logger.info(
+            "[RadiusManager] users added in bulk | added=%d skipped=%d",
+            len(result['added']),
+            len(result['skipped']),
+        )
+        return result
+
+    def update_user_password(
+        self, username: str, new_password: str = None
+    ) -> Tuple[str, str]:
+        """
+        ユーザーパスワードを更新
+
+        Args:
+            username: ユーザー名
+            new_password: 新しいパスワード（未指定時は自動生成）
+
+        Returns:
+            (新しいパスワード, NTハッシュ) のタプル
+        """
+        # ユーザー存在確認
+        logger.info(
+            "[RadiusManager] update_user_password | user=%s",
+            username,
+        )
+        entry = self._lookup(username)
+        if entry is None:
+            raise ValueError(f"User '{username}' not found")
+
+        # パスワード生成
+        if new_password is None:
+            new_password, new_nt_hash = (
+                PasswordManager.generate_user_credentials()
+            )
+        else:
+            new_nt_hash = PasswordManager.generate_nt_hash(new_password)
+
+        self._set_nt_hash(entry, new_nt_hash)
+        return new_password, new_nt_hash
+
+    def set_nt_hash(self, username: str, nt_hash: str) -> bool:
+        """
+        既存ユーザーのNTハッシュを直接差し替える（外部ストアからの書き出し用）
+
+        Args:
+            username: ユーザー名
+            nt_hash: 新しいNTハッシュ
+
+        Returns:
+            差し替えた場合True、ユーザーが存在しない場合False
+            （既に同じNTハッシュの場合は何も書かずにTrue）
+        """
+        entry = self._lookup(username)
+        if entry is None:
+            return False
+        if entry.nt_hash != nt_hash:
+            self._set_nt_hash(entry, nt_hash)
+        return True
+
+    def _set_nt_hash(self, entry: UserEntry, new_nt_hash: str) -> None:
+        """
+        既存ユーザーのNTハッシュを差し替える
+
+        Args:
+            entry: トランザクション内の現在のエントリ
+            new_nt_hash: 新しいNTハッシュ
+        """
+        username = entry.username
+        self._ops.append(
+            {'op': 'update', 'user': username, 'nt_hash': new_nt_hash}
+        )
+
+        # 同じトランザクションで追加したユーザーなら追記予定の行を書き換える
+        if self._lines is None and username in self._appended:
+            header = self._appended_header[username]
+            self._appends[header] = self._appends[header].replace(
+                f'"{entry.nt_hash}"', f'"{new_nt_hash}"', 1
+            )
+            self._appended[username] = entry.with_attribute(
+                'NT-Password', new_nt_hash
+            )
             logger.info(
-                "[RadiusManager] password updated | user=%s",
+                "[RadiusManager] password updated (pending append) | user=%s",
                 username,
             )
+            return
+
+        # 単一ブロックで固定長のハッシュ位置が分かっていれば、その場で書き換える
+        if (self._lines is None and entry.hash_offset >= 0 and
+                username not in self._duplicates):
+            original = self._hash_patches.get(entry.hash_offset)
+            old_nt_hash = original[0] if original else entry.nt_hash
+            self._hash_patches[entry.hash_offset] = (old_nt_hash, new_nt_hash)
+            self._patched[username] = entry.with_attribute(
+                'NT-Password', new_nt_hash
+            )
+            self.dirty = True
+            self._changes += 1
+            logger.info(
+                "[RadiusManager] password updated (in place) | user=%s",
+                username,
+            )
+            return
 
-            return new_password, new_nt_hash
+        # 既存の同一ユーザーの全ブロックを削除し、末尾に1ブロック追加
+        lines, _ = self._manager._remove_user_blocks(
+            self._ensure_lines(), {username}
+        )
+        self._lines = lines
+        lines.extend(self._new_user_lines(username, new_nt_hash))
+        self._mark_dirty()
+        logger.info(
+            "[RadiusManager] password updated | user=%s",
+            username,
+        )
 
     def delete_user(self, username: str) -> bool:
         """
@@ -460,57 +2738,455 @@ class RadiusManager:
         Returns:
             削除成功時True、ユーザーが存在しない場合False
         """
-        with self._lock:
-            # ユーザー存在確認
-            logger.info("[RadiusManager] delete_user | user=%s", username)
-            user_info = self.get_user(username)
-            if not user_info:
-                return False
+        logger.info("[RadiusManager] delete_user | user=%s", username)
+        return self.delete_users([username])[username]
 
-            # ファイル読み込み + サニタイズ
-            lines = self._read_authorize_file()
-            lines = self._sanitize_lines(lines)
+    def delete_users(self, usernames: Iterable[str]) -> Dict[str, bool]:
+        """
+        複数ユーザーを1パスで削除
 
-            # 指定ユーザーの全ブロックを検出
-            blocks = self._find_user_blocks(lines, username)
-            if not blocks:
+        Args:
+            usernames: ユーザー名の反復可能オブジェクト
+
+        Returns:
+            ユーザー名→削除成功時True（存在しない場合False）の辞書
+        """
+        # ユーザー存在確認
+        result = {
+            username: self._lookup(username) is not None
+            for username in usernames
+        }
+        targets = {username for username, found in result.items() if found}
+        if not targets:
+            return result
+
+        # 直前の履歴コメント/空行も含めて全ブロックを削除
+        self._lines, removed = self._manager._remove_user_blocks(
+            self._ensure_lines(), targets
+        )
+        for username in targets:
+            if not removed.get(username):
                 logger.warning(
-                    "[RadiusManager] delete_user: no blocks found | user=%s",
+                    "[RadiusManager] delete_users: no blocks found | user=%s",
                     username,
                 )
-                return False
+                result[username] = False
 
-            # 直前の履歴コメント/空行も削除対象に含めて全て削除（後ろから）
-            adjusted: List[Tuple[int, int]] = []
-            for (start, end) in blocks:
-                s = start
-                while s > 0:
-                    prev = lines[s - 1].strip()
-                    if prev == '' or prev.startswith('#'):
-                        s -= 1
-                        continue
-                    break
-                adjusted.append((s, end))
+        if removed:
+            self._ops.extend(
+                {'op': 'delete', 'user': username} for username in removed
+            )
+            self._mark_dirty()
+        logger.info(
+            "[RadiusManager] users deleted | deleted=%d not_found=%d",
+            len(removed),
+            len(result) - len(removed),
+        )
+        return result
 
-            for s, e in sorted(adjusted, key=lambda x: x[0], reverse=True):
-                del lines[s:e]
+    def sync_user(
+        self, username: str, nt_hash: Optional[str]
+    ) -> Optional[str]:
+        """
+        ユーザーを指定の状態に合わせる（冪等、外部ストアからの書き出し用）
 
-            # サニタイズで空行圧縮
-            lines = self._sanitize_lines(lines)
+        Args:
+            username: ユーザー名
+            nt_hash: NTハッシュ（Noneはユーザーが存在しない状態）
 
-            # ファイル書き込み
-            self._write_authorize_file(lines)
-            logger.info(
-                "[RadiusManager] user deleted | user=%s",
-                username,
+        Returns:
+            'added' / 'updated' / 'deleted'（既に一致していた場合はNone）
+        """
+        entry = self._lookup(username)
+        if nt_hash is None:
+            if entry is None:
+                return None
+            self.delete_users([username])
+            return 'deleted'
+        if entry is None:
+            self._add_entry(username, nt_hash)
+            return 'added'
+        if entry.nt_hash == nt_hash:
+            return None
+        self.set_nt_hash(username, nt_hash)
+        return 'updated'
+
+    def append_blocks(
+        self, blocks: Iterable[Tuple[str, List[str]]]
+    ) -> List[str]:
+        """
+        他のファイルから移すユーザーブロックを原文のまま末尾に追加
+
+        既に存在するユーザーのブロックはスキップする（移動の再実行に備える）。
+
+        Args:
+            blocks: (ユーザー名, ブロックの行) の反復可能オブジェクト
+
+        Returns:
+            追加したユーザー名のリスト
+        """
+        added: List[str] = []
+        seen = set()
+        lines = self._ensure_lines()
+        for username, block in blocks:
+            if username in seen or self._lookup(username) is not None:
+                continue
+            seen.add(username)
+            if lines and not lines[-1].endswith("\n"):
+                lines[-1] += "\n"
+            lines.append("\n")
+            lines.extend(
+                raw if raw.endswith("\n") else raw + "\n" for raw in block
             )
+            added.append(username)
+        if added:
+            self._mark_dirty()
+        return added
 
-            return True
+    def sanitize(self) -> int:
+        """
+        孤立した属性行の除去と連続空行の圧縮を行う
 
+        Returns:
+            除去した行数
+        """
+        lines = self._ensure_lines()
+        sanitized = self._manager._sanitize_lines(lines)
+        removed = len(lines) - len(sanitized)
+        if removed:
+            self._lines = sanitized
+            self._mark_dirty()
+        logger.info(
+            "[RadiusManager] sanitized | removed_lines=%d",
+            removed,
+        )
+        return removed
 
-# テスト用関数
-if __name__ == "__main__":
-    # テスト用の一時ファイル
+    def compact(self, history: Dict[str, Dict[str, str]]) -> Dict[str, Any]:
+        """
+        行リストを正規形に変換（RadiusManager.compact() から使う）
+
+        Args:
+            history: 除去した履歴コメントの日時を受け取る辞書
+
+        Returns:
+            変換前後のバイト数・行数・パース時間の辞書
+        """
+        manager = self._manager
+        lines = self._ensure_lines()
+        compacted = list(manager._iter_compacted(lines, history))
+
+        def _measure(target: List[str]) -> Tuple[int, float]:
+            start = time.perf_counter()
+            manager._build_index(target)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            return sum(len(x.encode('utf-8')) for x in target), elapsed_ms
+
+        bytes_before, parse_before = _measure(lines)
+        bytes_after, parse_after = _measure(compacted)
+        if compacted != lines:
+            self._lines = compacted
+            self._mark_dirty()
+        return {
+            'bytes_before': bytes_before,
+            'bytes_after': bytes_after,
+            'bytes_saved': bytes_before - bytes_after,
+            'lines_before': len(lines),
+            'lines_after': len(compacted),
+            'parse_ms_before': parse_before,
+            'parse_ms_after': parse_after,
+            'parse_ms_saved': parse_before - parse_after,
+        }
+
+    def _replay(self, op: Dict[str, Any]) -> int:
+        """
+        ジャーナルの操作を1件再適用（冪等）
+
+        Args:
+            op: ジャーナルに記録された操作
+
+        Returns:
+            変更した場合1、反映済みだった場合0
+        """
+        username = op.get('user')
+        entry = self._lookup(username)
+        if op.get('op') == 'delete':
+            if entry is None:
+                return 0
+            self.delete_users([username])
+            return 1
+
+        nt_hash = op.get('nt_hash')
+        if entry is None:
+            if op.get('op') != 'add':
+                logger.warning(
+                    "[RadiusManager] journal replay skipped missing user | "
+                    "op=%s user=%s",
+                    op.get('op'),
+                    username,
+                )
+                return 0
+            self._add_entry(username, nt_hash)
+            return 1
+        if entry.nt_hash == nt_hash:
+            return 0
+        self._set_nt_hash(entry, nt_hash)
+        return 1
+
+    def commit(self) -> None:
+        """
+        変更を反映
+
+        NTハッシュのインプレース更新とユーザー追加だけなら、pwriteでの該当箇所の
+        書換とO_APPENDでの追記のみ行い、それ以外は行リストを1回のアトミック書込で
+        置き換える。孤立行などの掃除はここでは行わず、sanitize_file の保守処理に任せる。
+        """
+        if not self.dirty:
+            return
+        manager = self._manager
+        ops = self._ops
+        manager._committing = True
+        try:
+            self._write()
+        finally:
+            manager._committing = False
+        self._reset()
+        manager._finish_commit(ops)
+
+    def _write(self) -> None:
+        """ファイルへ書き込み、インデックスの新しい版を公開する"""
+        manager = self._manager
+        if not self._needs_rewrite and (self._hash_patches or self._appends):
+            signature = manager._apply_inplace(
+                self._hash_patches,
+                "".join(self._appends),
+                self._base_signature,
+                self._ops,
+            )
+            if signature is not None:
+                manager._apply_inplace_entries(
+                    self._patched.values(),
+                    list(self._appended.values()),
+                    len(self._appends),
+                    self._base_signature,
+                    signature,
+                )
+                return
+            # 配置が想定と異なるため、全体の書換にフォールバック
+            self._ensure_lines()
+            self._needs_rewrite = True
+
+        lines = self._ensure_lines()
+        signature = manager._write_authorize_file(
+            lines, self._base_signature, self._ops
+        )
+        manager._set_index(lines, signature)
+
+    def _reset(self) -> None:
+        """コミット後の状態に戻す（同じトランザクションは以後使わない想定）"""
+        self._lines = None
+        self._index = None
+        self._hash_patches = {}
+        self._patched = {}
+        self._appends = []
+        self._appended = {}
+        self._appended_header = {}
+        self._appended_size = 0
+        self._ops = []
+        self._needs_rewrite = False
+        self._base_signature = _ANY_VERSION
+        self.dirty = False
+
+
+def _iter_import_rows(path: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    インポート用CSV（username[,password]）を1行ずつ読み出す
+
+    空行・#で始まる行・先頭のヘッダ行（username）は読み飛ばす。
+    """
+    with open(path, 'r', encoding='utf-8', newline='') as rf:
+        for lineno, row in enumerate(csv.reader(rf), start=1):
+            if not row or not row[0].strip():
+                continue
+            if row[0].lstrip().startswith('#'):
+                continue
+            if lineno == 1 and row[0].strip().lower() == 'username':
+                continue
+            password = row[1].strip() if len(row) > 1 else None
+            yield row[0].strip(), password or None
+
+
+def _manager_from_args(args: argparse.Namespace) -> Any:
+    """
+    コマンドライン引数からRadiusManager（シャード指定時は
+    ShardedRadiusManager）を作成
+
+    radcheckのデータベースが指定されていれば、Botと同じくコミットごとに反映する
+    （CLIでの削除等がrlm_sql側に残らないように）。
+    """
+    options: Dict[str, Any] = dict(
+        state_dir=args.state_dir,
+        durability=args.durability,
+        snapshots=args.snapshots,
+        snapshot_max_bytes=args.snapshot_max_bytes,
+        snapshot_compress=args.snapshot_compress,
+    )
+    if args.shards > 0:
+        # shardedはこのモジュールをimportするため、ここで読み込む
+        from .sharded import ShardedRadiusManager
+        manager = ShardedRadiusManager(
+            args.authorize, shards=args.shards, **options
+        )
+    else:
+        manager = RadiusManager(args.authorize, **options)
+    if args.radcheck_db:
+        # radcheckはこのモジュールをimportするため、ここで読み込む
+        from .radcheck import RadcheckWriter
+        RadcheckWriter(
+            args.radcheck_db, durability=args.durability
+        ).attach(manager)
+    return manager
+
+
+def _cmd_import(args: argparse.Namespace) -> int:
+    """importサブコマンド: CSVからユーザーを一括登録し、パスワードを出力"""
+    manager = _manager_from_args(args)
+    try:
+        # パスワードを含むため所有者のみ読み書き可能で作成
+        fd = os.open(
+            args.output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+        )
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as wf:
+            writer = csv.writer(wf)
+            writer.writerow(['username', 'password'])
+
+            def _on_added(
+                username: str, password: str, nt_hash: str
+            ) -> None:
+                writer.writerow([username, password])
+                wf.flush()
+
+            result = manager.add_users(
+                _iter_import_rows(args.csv), _on_added
+            )
+    finally:
+        # ライタースレッドを止め、チェックポイントでジャーナルを空にする
+        manager.close()
+
+    print(
+        f"added={len(result['added'])} skipped={len(result['skipped'])} "
+        f"output={args.output}"
+    )
+    for username in result['skipped']:
+        print(f"skipped: {username}", file=sys.stderr)
+    return 0
+
+
+def _cmd_delete(args: argparse.Namespace) -> int:
+    """deleteサブコマンド: 指定ユーザーを一括削除"""
+    usernames = list(args.usernames)
+    if args.file:
+        with open(args.file, 'r', encoding='utf-8') as rf:
+            usernames.extend(
+                line.strip() for line in rf
+                if line.strip() and not line.lstrip().startswith('#')
+            )
+
+    manager = _manager_from_args(args)
+    try:
+        result = manager.delete_users(usernames)
+    finally:
+        manager.close()
+    for username, deleted in result.items():
+        print(f"{'deleted' if deleted else 'not found'}: {username}")
+    return 0 if all(result.values()) else 1
+
+
+def _cmd_compact(args: argparse.Namespace) -> int:
+    """compactサブコマンド: authorizeファイルを正規形に書き直す"""
+    manager = _manager_from_args(args)
+    try:
+        stats = manager.compact()
+    finally:
+        manager.close()
+    print(
+        f"bytes: {stats['bytes_before']} -> {stats['bytes_after']} "
+        f"(saved {stats['bytes_saved']})"
+    )
+    print(f"lines: {stats['lines_before']} -> {stats['lines_after']}")
+    print(
+        f"parse: {stats['parse_ms_before']:.1f}ms -> "
+        f"{stats['parse_ms_after']:.1f}ms "
+        f"(saved {stats['parse_ms_saved']:.1f}ms)"
+    )
+    print(f"history moved to metadata: {stats['history_users']} users")
+    return 0
+
+
+def _shard_key(args: argparse.Namespace) -> Optional[Tuple[str, ...]]:
+    """
+    snapshots / rollback の対象シャードを選ぶ引数
+
+    スナップショットはシャードごとにあるため、シャード指定時は
+    --userで対象ユーザーのシャードを選ぶ必要がある。
+
+    Returns:
+        manager.snapshots() 等に渡す追加の引数（--userがない場合はNone）
+    """
+    if args.shards <= 0:
+        return ()
+    if not args.user:
+        print(
+            "--user is required with --shards: snapshots are kept per "
+            "shard, so pick the shard by a username it holds",
+            file=sys.stderr,
+        )
+        return None
+    return (args.user,)
+
+
+def _cmd_snapshots(args: argparse.Namespace) -> int:
+    """snapshotsサブコマンド: 保持している世代を新しい順に表示"""
+    key = _shard_key(args)
+    if key is None:
+        return 2
+    manager = _manager_from_args(args)
+    try:
+        generations = manager.snapshots(*key)
+    finally:
+        manager.close()
+    for entry in generations:
+        print(
+            f"{entry['generation']:>6} {entry['created']} "
+            f"{entry['reason']:<8} size={entry['size']} "
+            f"stored={entry['stored']} sha256={entry['digest'][:12]}"
+        )
+    return 0
+
+
+def _cmd_rollback(args: argparse.Namespace) -> int:
+    """rollbackサブコマンド: authorizeを指定世代に巻き戻す"""
+    key = _shard_key(args)
+    if key is None:
+        return 2
+    manager = _manager_from_args(args)
+    try:
+        result = manager.rollback(args.generation, *key)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    finally:
+        manager.close()
+    print(
+        f"rolled back to generation {result['generation']}: "
+        f"users {result['users_before']} -> {result['users_after']} "
+        f"(changed {result['changed']})"
+    )
+    return 0
+
+
+def _demo() -> None:
+    """一時ファイルで追加・取得・一覧を試す動作確認"""
     import tempfile
 
     with tempfile.NamedTemporaryFile(
@@ -539,3 +3215,128 @@ if __name__ == "__main__":
     finally:
         # テストファイル削除
         os.unlink(test_file)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    コマンドラインエントリポイント（python -m utils.radius）
+
+    サブコマンド未指定時は一時ファイルでの動作確認を実行する。
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m utils.radius",
+        description="FreeRADIUS authorizeファイル管理ツール",
+    )
+    parser.add_argument(
+        "--authorize",
+        default=os.environ.get(
+            "RADIUS_AUTHORIZE_FILE", "/app/radius/authorize"
+        ),
+        help="authorizeファイルのパス",
+    )
+    parser.add_argument(
+        "--state-dir",
+        default=os.environ.get("RADIUS_STATE_DIR") or None,
+        help="ロックファイル等の置き場所（Botと同じ場所を指定すること）",
+    )
+    parser.add_argument(
+        "--durability",
+        choices=RadiusManager.DURABILITY_LEVELS,
+        default=os.environ.get("RADIUS_DURABILITY", "file"),
+        help="書込の永続性レベル",
+    )
+    parser.add_argument(
+        "--snapshots",
+        type=int,
+        default=int(os.environ.get("RADIUS_SNAPSHOTS", "10")),
+        help="保持するスナップショットの世代数（Botと同じ値を指定すること）",
+    )
+    parser.add_argument(
+        "--snapshot-max-bytes",
+        type=int,
+        default=int(os.environ.get("RADIUS_SNAPSHOT_MAX_BYTES", 64 << 20)),
+        help="保持するスナップショットの合計バイト数の上限",
+    )
+    parser.add_argument(
+        "--snapshot-compress",
+        action="store_true",
+        default=os.environ.get(
+            "RADIUS_SNAPSHOT_COMPRESS", "false"
+        ).lower() in {"1", "true", "yes", "on"},
+        help="スナップショットをgzipで圧縮して保持する",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=int(os.environ.get("RADIUS_SHARDS", "0")),
+        help="authorizeのシャード数（Botと同じ値を指定すること）",
+    )
+    parser.add_argument(
+        "--radcheck-db",
+        default=os.environ.get("RADIUS_RADCHECK_DB") or None,
+        help="変更を反映するrlm_sql互換のradcheckデータベース",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    import_parser = subparsers.add_parser(
+        "import", help="CSV(username[,password])からユーザーを一括登録"
+    )
+    import_parser.add_argument("csv", help="入力CSVファイル")
+    import_parser.add_argument(
+        "-o",
+        "--output",
+        required=True,
+        help="生成したパスワードの出力先CSV（0600で作成）",
+    )
+    import_parser.set_defaults(func=_cmd_import)
+
+    delete_parser = subparsers.add_parser(
+        "delete", help="ユーザーを一括削除"
+    )
+    delete_parser.add_argument("usernames", nargs="*", help="ユーザー名")
+    delete_parser.add_argument(
+        "-f", "--file", help="削除するユーザー名の一覧（1行1件）"
+    )
+    delete_parser.set_defaults(func=_cmd_delete)
+
+    compact_parser = subparsers.add_parser(
+        "compact",
+        help="履歴コメント等を除去してauthorizeを正規形に書き直す",
+    )
+    compact_parser.set_defaults(func=_cmd_compact)
+
+    snapshots_parser = subparsers.add_parser(
+        "snapshots", help="authorizeの世代スナップショットを一覧表示"
+    )
+    snapshots_parser.add_argument(
+        "--user", help="シャード指定時に対象シャードを選ぶユーザー名"
+    )
+    snapshots_parser.set_defaults(func=_cmd_snapshots)
+
+    rollback_parser = subparsers.add_parser(
+        "rollback", help="authorizeを指定世代のスナップショットに巻き戻す"
+    )
+    rollback_parser.add_argument(
+        "generation", type=int, help="snapshotsで表示される世代番号"
+    )
+    rollback_parser.add_argument(
+        "--user",
+        help="シャード指定時に巻き戻すシャードを選ぶユーザー名"
+        "（そのシャードだけを巻き戻す）",
+    )
+    rollback_parser.set_defaults(func=_cmd_rollback)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        _demo()
+        return 0
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+authorize変更後のFreeRADIUS再読込の通知
+連続した変更をまとめ、静かになった時点で1回だけHUP / radminを送る
+"""
+
+import argparse
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def signal_reloader(
+    pid: Optional[int] = None,
+    pid_file: Optional[str] = None,
+    sig: int = signal.SIGHUP,
+) -> Callable[[], None]:
+    """
+    プロセスにシグナルを送る再読込関数を作成
+
+    Args:
+        pid: 送信先のPID（pid_file未指定時）
+        pid_file: 送信先のPIDを記録したファイル（送信ごとに読み直す）
+        sig: 送るシグナル
+
+    Returns:
+        引数なしの再読込関数
+    """
+    if pid is None and pid_file is None:
+        raise ValueError("pid or pid_file is required")
+
+    def _reload() -> None:
+        target = pid
+        if pid_file is not None:
+            with open(pid_file, 'r', encoding='utf-8') as rf:
+                target = int(rf.read().strip())
+        os.kill(target, sig)
+
+    return _reload
+
+
+def command_reloader(
+    command: str, timeout: float = 30.0
+) -> Callable[[], None]:
+    """
+    コマンド（radmin等）を実行する再読込関数を作成
+
+    Args:
+        command: 実行するコマンド（例: radmin -e "hup files"）
+        timeout: コマンドのタイムアウト秒
+
+    Returns:
+        引数なしの再読込関数（終了コードが0以外なら例外）
+    """
+    argv = shlex.split(command)
+
+    def _reload() -> None:
+        subprocess.run(
+            argv,
+            check=True,
+            timeout=timeout,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+
+    return _reload
+
+
+class ReloadCoordinator:
+    """
+    変更の通知をまとめてFreeRADIUSの再読込を1回だけ行うバックグラウンドスレッド
+
+    最後の通知からquiet秒間新しい通知がなければ再読込する。通知が途切れない
+    場合も、最初の未反映の通知からmax_delay秒で再読込する。
+    通知ごとの起点時刻（既定では通知した時刻）から再読込の完了までを
+    「反映までの時間」として記録する。
+    """
+
+    def __init__(
+        self,
+        reloader: Callable[[], None],
+        quiet: float = 1.0,
+        max_delay: float = 10.0,
+    ):
+        """
+        初期化
+
+        Args:
+            reloader: 再読込を実行する関数（signal_reloader / command_reloader）
+            quiet: 最後の通知から再読込までに待つ秒数
+            max_delay: 最初の未反映の通知から再読込までの上限秒数
+        """
+        self._reloader = reloader
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self._cond = threading.Condition()
+        # 未反映の通知の起点時刻（perf_counter基準）
+        self._pending: List[float] = []
+        self._last_request = 0.0
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self._stats: Dict[str, float] = {
+            'requests': 0,
+            'reloads': 0,
+            'failures': 0,
+            'last_effective_ms': 0.0,
+            'max_effective_ms': 0.0,
+            'total_effective_ms': 0.0,
+            'last_reload_ms': 0.0,
+        }
+
+    def request(self, started_at: Optional[float] = None) -> None:
+        """
+        再読込を要求
+
+        Args:
+            started_at: 反映までの時間の起点（time.perf_counter()の値、
+                未指定時は現在時刻）
+        """
+        now = time.perf_counter()
+        with self._cond:
+            self._pending.append(now if started_at is None else started_at)
+            self._last_request = now
+            self._stats['requests'] += 1
+            self._cond.notify()
+
+    def on_commit(self, op_count: int) -> None:
+        """
+        RadiusManager.add_commit_listener用（ユーザーの変更を伴うコミットのみ通知）
+        """
+        if op_count > 0:
+            self.request()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        再読込の統計
+
+        Returns:
+            requests / reloads / failures と、反映までの時間
+            （last / max / avg_effective_ms）、再読込自体の所要時間（last_reload_ms）
+        """
+        with self._cond:
+            result = dict(self._stats)
+        total = result.pop('total_effective_ms')
+        reloads = result['reloads']
+        result['avg_effective_ms'] = total / reloads if reloads else 0.0
+        return result
+
+    def start(self) -> "ReloadCoordinator":
+        """再読込スレッドを起動"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(
+                target=self._run,
+                name="radius-reload",
+                daemon=True,
+            )
+            self._thread.start()
+            logger.info(
+                "[ReloadCoordinator] started | quiet=%.1fs max_delay=%.1fs",
+                self.quiet,
+                self.max_delay,
+            )
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """再読込スレッドを停止（未反映の通知があれば再読込してから終了）"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _next_batch(self) -> Optional[List[float]]:
+        """静かな時間が続くまで待ち、まとめて反映する通知を取り出す"""
+        with self._cond:
+            while True:
+                if self._pending:
+                    now = time.perf_counter()
+                    due = min(
+                        self._last_request + self.quiet,
+                        min(self._pending) + self.max_delay,
+                    )
+                    if self._stopped or now >= due:
+                        batch, self._pending = self._pending, []
+                        return batch
+                    self._cond.wait(due - now)
+                elif self._stopped:
+                    return None
+                else:
+                    self._cond.wait()
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            start = time.perf_counter()
+            try:
+                self._reloader()
+            except Exception as e:
+                with self._cond:
+                    self._stats['failures'] += 1
+                    # 失敗した分は次の通知と合わせて再試行する
+                    self._pending.extend(batch)
+                    self._last_request = time.perf_counter()
+                logger.error(
+                    "[ReloadCoordinator] reload failed | requests=%d error=%s",
+                    len(batch),
+                    e,
+                )
+                continue
+            done = time.perf_counter()
+            effective_ms = (done - min(batch)) * 1000.0
+            reload_ms = (done - start) * 1000.0
+            with self._cond:
+                self._stats['reloads'] += 1
+                self._stats['last_effective_ms'] = effective_ms
+                self._stats['max_effective_ms'] = max(
+                    self._stats['max_effective_ms'], effective_ms
+                )
+                self._stats['total_effective_ms'] += effective_ms
+                self._stats['last_reload_ms'] = reload_ms
+            logger.info(
+                "[ReloadCoordinator] reloaded | requests=%d "
+                "effective_ms=%.0f reload_ms=%.1f",
+                len(batch),
+                effective_ms,
+                reload_ms,
+            )
+
+
+# 動作確認用のスタブ: SIGHUPを受けるたびに1行出力する
+_STUB_SOURCE = (
+    "import signal, sys, time\n"
+    "signal.signal(signal.SIGHUP, "
+    "lambda *_: (sys.stdout.write('hup\\n'), sys.stdout.flush()))\n"
+    "sys.stdout.write('ready\\n'); sys.stdout.flush()\n"
+    "while True: time.sleep(1)\n"
+)
+
+
+def _cmd_stub_test(args: argparse.Namespace) -> int:
+    """ローカルのスタブプロセスに対して連続した変更の通知をまとめられるか確認"""
+    stub = subprocess.Popen(
+        [sys.executable, "-c", _STUB_SOURCE],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        stub.stdout.readline()  # ready
+        coordinator = ReloadCoordinator(
+            signal_reloader(pid=stub.pid),
+            quiet=args.quiet,
+            max_delay=args.max_delay,
+        ).start()
+        for _ in range(args.burst):
+            coordinator.request()
+            time.sleep(args.interval)
+        coordinator.stop()
+        hups = 0
+        while hups < coordinator.stats()['reloads']:
+            if stub.stdout.readline().strip() == "hup":
+                hups += 1
+    finally:
+        stub.kill()
+        stub.wait()
+    stats = coordinator.stats()
+    print(
+        f"requests={stats['requests']:.0f} reloads={stats['reloads']:.0f} "
+        f"hup_received={hups} failures={stats['failures']:.0f}"
+    )
+    print(
+        f"effective: last={stats['last_effective_ms']:.0f}ms "
+        f"max={stats['max_effective_ms']:.0f}ms "
+        f"avg={stats['avg_effective_ms']:.0f}ms"
+    )
+    return 0 if hups == stats['reloads'] and stats['reloads'] > 0 else 1
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    コマンドラインエントリポイント（python -m utils.reload）
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m utils.reload",
+        description="FreeRADIUS再読込の通知ツール",
+    )
+    parser.add_argument("--quiet", type=float, default=1.0)
+    parser.add_argument("--max-delay", type=float, default=10.0)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    stub_parser = subparsers.add_parser(
+        "stub-test",
+        help="SIGHUPを数えるスタブプロセスに連続した通知を送り、まとめて1回になるか確認",
+    )
+    stub_parser.add_argument(
+        "--burst", type=int, default=20, help="通知の回数"
+    )
+    stub_parser.add_argument(
+        "--interval", type=float, default=0.05, help="通知の間隔（秒）"
+    )
+    stub_parser.set_defaults(func=_cmd_stub_test)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
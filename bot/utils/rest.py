@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+FreeRADIUS rlm_rest 用のauthorize問い合わせエンドポイント
+RadiusManagerの公開済みインデックスからユーザーごとのNT-PasswordをJSONで返す
+"""
+
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Union
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from .radius import RadiusManager
+from .sharded import ShardedRadiusManager
+
+logger = logging.getLogger(__name__)
+
+# GET /authorize/<ユーザー名> または /authorize?username=<ユーザー名>
+AUTHORIZE_PATH = "/authorize"
+
+
+class AuthorizeLookupServer:
+    """
+    rlm_restのauthorizeに応答するHTTPサーバ（標準ライブラリのみ）
+
+    問い合わせはRadiusManager.get_user()で公開済みのインデックスを参照して
+    応答する（ファイルは読まない）。インデックスはファイルの署名（監視中は
+    ウォッチャー）で検証されるため、このプロセスのコミットに加えて
+    CLIでの削除・巻き戻し、他のレプリカ、手作業での編集も反映される。
+    NTハッシュを返すため、FreeRADIUSからのみ到達できるネットワークで公開すること。
+    """
+
+    def __init__(
+        self,
+        manager: Union[RadiusManager, ShardedRadiusManager],
+        host: str = "127.0.0.1",
+        port: int = 8088,
+    ):
+        """
+        初期化
+
+        Args:
+            manager: 対象のRadiusManagerまたはShardedRadiusManager
+            host: 待受アドレス
+            port: 待受ポート（0で空きポートを自動選択）
+        """
+        self._manager = manager
+        self._server = ThreadingHTTPServer((host, port), _LookupHandler)
+        self._server.daemon_threads = True
+        self._server.lookup = self.lookup
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> tuple:
+        """実際の待受アドレス (host, port)"""
+        return self._server.server_address
+
+    def lookup(self, username: str) -> Optional[Dict[str, Any]]:
+        """
+        rlm_restの応答形式で1ユーザー分の属性を返す
+
+        Args:
+            username: ユーザー名
+
+        Returns:
+            {"control:NT-Password": {...}, "reply:Reply-Message": {...}}
+            （存在しない場合はNone）
+        """
+        entry = self._manager.get_user(username)
+        if entry is None or not entry.nt_hash:
+            return None
+        return {
+            "control:NT-Password": {"op": ":=", "value": entry.nt_hash},
+            "reply:Reply-Message": {
+                "op": ":=",
+                "value": f"Welcome {username}",
+            },
+        }
+
+    def start(self) -> "AuthorizeLookupServer":
+        """待受スレッドを起動"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._server.serve_forever,
+                name="radius-rest",
+                daemon=True,
+            )
+            self._thread.start()
+            logger.info(
+                "[AuthorizeLookupServer] started | address=%s:%d",
+                self.address[0],
+                self.address[1],
+            )
+        return self
+
+    def stop(self) -> None:
+        """待受を停止"""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class _LookupHandler(BaseHTTPRequestHandler):
+    # rlm_restの接続プールで接続を再利用できるようにする
+    protocol_version = "HTTP/1.1"
+    # ヘッダと本文を別々に送るため、Nagleと遅延ACKで応答が数十ms遅れるのを防ぐ
+    disable_nagle_algorithm = True
+
+    def _send(
+        self, status: int, body: Optional[Dict[str, Any]] = None
+    ) -> None:
+        data = json.dumps(body).encode('utf-8') if body is not None else b""
+        self.send_response(status)
+        if data:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    def _username(self) -> Optional[str]:
+        parts = urlsplit(self.path)
+        if parts.path.startswith(AUTHORIZE_PATH + "/"):
+            return unquote(parts.path[len(AUTHORIZE_PATH) + 1:]) or None
+        if parts.path == AUTHORIZE_PATH:
+            values = parse_qs(parts.query).get("username")
+            if values:
+                return values[0]
+            # POST時はrlm_restのJSON本文（{"User-Name": {"value": [...]}}等）
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                try:
+                    value = json.loads(self.rfile.read(length))["User-Name"]
+                except (ValueError, KeyError, TypeError):
+                    return None
+                if isinstance(value, dict):
+                    value = value.get("value")
+                if isinstance(value, list):
+                    value = value[0] if value else None
+                return value if isinstance(value, str) else None
+        return None
+
+    def _handle(self) -> None:
+        username = self._username()
+        if username is None:
+            self._send(400, {"error": "username required"})
+            return
+        attributes = self.server.lookup(username)
+        if attributes is None:
+            # rlm_restは404をnotfoundとして扱う
+            self._send(404)
+            return
+        self._send(200, attributes)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # リクエストごとのアクセスログは出さない（NTハッシュの問い合わせが大量に来るため）
+        logger.debug("[AuthorizeLookupServer] " + format, *args)
@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+"""
+シャード化したauthorizeファイルの管理
+メインのauthorizeはDEFAULTエントリと$INCLUDEだけを持ち、
+ユーザーはユーザー名のハッシュで選んだシャードファイルに置く
+"""
+
+import logging
+import os
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from .entry import UserEntry
+from .metrics import Instrumentation
+from .radius import AuthorizeConflictError, RadiusManager, RadiusTransaction
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedRadiusManager:
+    """
+    シャード化したauthorizeファイルを RadiusManager と同じAPIで扱う
+
+    各シャードは独立したRadiusManager（ロック・ジャーナル・グループコミット）で
+    管理するため、変更は対象ユーザーのシャードだけを書き換え、
+    別シャードのユーザーの変更は並行して書き込まれる。
+    既存のメインファイルにユーザーがいれば、起動時に各シャードへ移す。
+    """
+
+    # メインファイルからの$INCLUDEの直前に置くコメント
+    INCLUDE_COMMENT = "# Sharded user entries (managed by RadiusManager)\n"
+
+    def __init__(
+        self,
+        authorize_file_path: str = "/radius/authorize",
+        shards: int = 16,
+        shard_dir: Optional[str] = None,
+        **options: Any,
+    ):
+        """
+        初期化
+
+        Args:
+            authorize_file_path: メインのauthorizeファイルのパス
+            shards: シャード数
+            shard_dir: シャードファイルを置くディレクトリ（未指定時は
+                <authorize>.d）。FreeRADIUSからも同じ相対位置に見えること
+            **options: 各シャードのRadiusManagerに渡す引数（state_dir等）
+        """
+        if shards < 1:
+            raise ValueError("shards must be >= 1")
+        self.authorize_file_path = Path(authorize_file_path)
+        self.shard_dir = (
+            Path(shard_dir) if shard_dir
+            else self.authorize_file_path.with_name(
+                self.authorize_file_path.name + ".d"
+            )
+        )
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_count = shards
+        width = max(2, len(str(shards - 1)))
+        self._shard_names = [f"shard-{i:0{width}d}" for i in range(shards)]
+        # 全シャードで操作ごとの計測値の集計先を共有する
+        self.metrics = options.setdefault('instrumentation', Instrumentation())
+        self._options = options
+        self._main = RadiusManager(str(self.authorize_file_path), **options)
+        self._shards = [
+            RadiusManager(str(self.shard_dir / name), **options)
+            for name in self._shard_names
+        ]
+        self._ensure_layout()
+        logger.debug(
+            "[ShardedRadiusManager] initialized | path=%s shard_dir=%s "
+            "shards=%d",
+            self.authorize_file_path,
+            self.shard_dir,
+            shards,
+        )
+
+    # ------------------------------------------------------------------
+    # シャードの選択とレイアウト
+    # ------------------------------------------------------------------
+    def _shard_index(self, username: str) -> int:
+        """ユーザー名からシャード番号を決める（プロセスをまたいで安定）"""
+        return zlib.crc32(username.encode('utf-8')) % self.shard_count
+
+    def shard_for(self, username: str) -> RadiusManager:
+        """
+        ユーザーが属するシャードのRadiusManagerを取得
+
+        Args:
+            username: ユーザー名
+
+        Returns:
+            RadiusManager
+        """
+        return self._shards[self._shard_index(username)]
+
+    def _include_target(self, name: str) -> str:
+        """メインファイルから見たシャードファイルのパス（$INCLUDE用）"""
+        return os.path.relpath(
+            self.shard_dir / name, self.authorize_file_path.parent
+        )
+
+    def _is_shard_include(self, stripped: str) -> bool:
+        parts = stripped.split()
+        if len(parts) != 2 or parts[0] != "$INCLUDE":
+            return False
+        prefix = self._include_target("")
+        return parts[1].startswith(prefix.rstrip(os.sep) + os.sep)
+
+    def _ensure_layout(self) -> None:
+        """
+        シャードファイルと$INCLUDEを用意し、所属の違うユーザーを正しいシャードへ移す
+
+        メインファイルのユーザーと、シャード数の変更で所属が変わったユーザーを移す。
+        移動先に既に同名ユーザーがいればスキップするため、中断後の再実行でも重複しない。
+        """
+        for shard in self._shards:
+            if not shard.authorize_file_path.exists():
+                shard.authorize_file_path.touch()
+
+        moved = self._move_misplaced(self._main, lambda username: False)
+        for index, shard in enumerate(self._shards):
+            moved += self._move_misplaced(
+                shard,
+                lambda username, index=index: (
+                    self._shard_index(username) == index
+                ),
+            )
+        # シャード数を減らした場合に残る旧シャード
+        for path in sorted(self.shard_dir.glob("shard-*")):
+            if path.name in self._shard_names or path.suffix:
+                continue
+            stale = RadiusManager(str(path), **self._options)
+            moved += self._move_misplaced(stale, lambda username: False)
+            stale.close()
+            path.unlink()
+        if moved:
+            logger.info(
+                "[ShardedRadiusManager] users moved to shards | moved=%d",
+                moved,
+            )
+
+    def _move_misplaced(
+        self, source: RadiusManager, keep: Callable[[str], bool]
+    ) -> int:
+        """
+        sourceのうちkeep(ユーザー名)がFalseのユーザーブロックを所属シャードへ移す
+
+        sourceがメインファイルの場合は、あわせて$INCLUDEを最新のシャード構成にそろえる。
+
+        Returns:
+            移したユーザー数
+        """
+        is_main = source is self._main
+        for attempt in range(3):
+            try:
+                return self._try_move_misplaced(source, keep, is_main)
+            except AuthorizeConflictError:
+                # 読込後に他プロセスが移動元を更新した。移動先は重複をスキップする
+                if attempt == 2:
+                    raise
+        return 0
+
+    def _try_move_misplaced(
+        self,
+        source: RadiusManager,
+        keep: Callable[[str], bool],
+        is_main: bool,
+    ) -> int:
+        """_move_misplaced の1回分（移動元の書込は読込時の版と一致する場合のみ）"""
+        lines, signature = source._read_authorize_snapshot()
+        blocks: Dict[int, List[Tuple[str, List[str]]]] = {}
+        for entry in source._iter_parse(lines):
+            if entry.username == "DEFAULT" or keep(entry.username):
+                continue
+            blocks.setdefault(
+                self._shard_index(entry.username), []
+            ).append((
+                entry.username,
+                lines[entry.line_start:entry.line_end + 1],
+            ))
+        moved: Set[str] = {
+            username for items in blocks.values()
+            for username, _ in items
+        }
+        if not moved and not (is_main and self._needs_includes(lines)):
+            return 0
+
+        # 先に移動先へ書き込んでから移動元から消す（中断しても失われない）
+        for index, items in blocks.items():
+            with self._shards[index].transaction() as tx:
+                tx.append_blocks(items)
+        if is_main:
+            new_lines = self._rebuild_main(lines, moved)
+        else:
+            new_lines, _ = source._remove_user_blocks(lines, moved)
+        source._write_authorize_file(new_lines, signature)
+        source._index = None
+        return len(moved)
+
+    def _needs_includes(self, lines: List[str]) -> bool:
+        """メインファイルの$INCLUDEが現在のシャード構成と一致しないか"""
+        expected = [
+            f"$INCLUDE {self._include_target(name)}"
+            for name in self._shard_names
+        ]
+        actual = [
+            raw.strip() for raw in lines
+            if self._is_shard_include(raw.strip())
+        ]
+        return actual != expected
+
+    def _rebuild_main(self, lines: List[str], moved: Set[str]) -> List[str]:
+        """
+        メインファイルから移動したユーザーと旧$INCLUDEを除き、$INCLUDEを差し込む
+
+        $INCLUDEは最初にユーザー（または旧$INCLUDE）があった位置に置き、
+        DEFAULTエントリとの前後関係を保つ。
+        """
+        kept: List[str] = []
+        pending: List[str] = []
+        include_at: Optional[int] = None
+        skipping = False
+
+        for raw in lines:
+            indented = raw.startswith('\t') or raw.startswith(' ')
+            if skipping and indented:
+                continue
+            skipping = False
+
+            stripped = raw.strip()
+            if stripped == self.INCLUDE_COMMENT.strip():
+                continue
+            if stripped == '' or stripped.startswith('#'):
+                pending.append(raw)
+                continue
+
+            is_include = self._is_shard_include(stripped)
+            if not indented and (
+                is_include or stripped.split(None, 1)[0] in moved
+            ):
+                # 移すユーザーの直前の履歴コメント/空行はブロックと一緒に除く
+                if is_include:
+                    kept.extend(pending)
+                pending.clear()
+                if include_at is None:
+                    include_at = len(kept)
+                skipping = not is_include
+                continue
+
+            kept.extend(pending)
+            pending.clear()
+            kept.append(raw)
+        kept.extend(pending)
+
+        if include_at is None:
+            include_at = len(kept)
+        block = [self.INCLUDE_COMMENT] + [
+            f"$INCLUDE {self._include_target(name)}\n"
+            for name in self._shard_names
+        ]
+        if include_at < len(kept) and kept[include_at].strip():
+            block.append("\n")
+        if include_at > 0:
+            if not kept[include_at - 1].endswith("\n"):
+                kept[include_at - 1] += "\n"
+            if kept[include_at - 1].strip():
+                block.insert(0, "\n")
+        kept[include_at:include_at] = block
+        return kept
+
+    # ------------------------------------------------------------------
+    # RadiusManager互換API
+    # ------------------------------------------------------------------
+    @property
+    def lock_stats(self) -> Dict[str, Dict[str, float]]:
+        """シャードごとのプロセス間ロックの待ち時間統計"""
+        return {
+            name: shard.lock_stats
+            for name, shard in zip(self._shard_names, self._shards)
+        }
+
+    @property
+    def write_stats(self) -> Dict[str, Dict[str, Any]]:
+        """シャードごとの書込レイテンシの統計"""
+        return {
+            name: shard.write_stats
+            for name, shard in zip(self._shard_names, self._shards)
+        }
+
+    def get_user(self, username: str) -> Optional[UserEntry]:
+        """
+        ユーザー情報を取得（所属シャードだけを参照）
+
+        Args:
+            username: ユーザー名
+
+        Returns:
+            UserEntry（存在しない場合はNone）
+        """
+        return self.shard_for(username).get_user(username)
+
+    def get_user_metadata(self, username: str) -> Optional[Dict[str, str]]:
+        """ユーザーの作成・更新日時を取得"""
+        return self.shard_for(username).get_user_metadata(username)
+
+    def list_users(self) -> List[UserEntry]:
+        """
+        全ユーザー一覧を取得（メインファイルのDEFAULT等に続けてシャード順）
+
+        行番号は各エントリが属するファイル内のもの。
+
+        Returns:
+            UserEntryのリスト
+        """
+        entries = self._main.list_users()
+        for shard in self._shards:
+            entries.extend(shard.list_users())
+        return entries
+
+    def iter_entries(self) -> Iterator[UserEntry]:
+        """全ファイルのエントリをストリーミングで順に返す"""
+        yield from self._main.iter_entries()
+        for shard in self._shards:
+            yield from shard.iter_entries()
+
+    @contextmanager
+    def transaction(
+        self, key: Optional[str] = None
+    ) -> Iterator[RadiusTransaction]:
+        """
+        keyのユーザーが属するシャードのトランザクション
+
+        シャードをまたぐトランザクションはないため、keyは省略できない。
+
+        Args:
+            key: 操作対象のユーザー名
+
+        Raises:
+            ValueError: keyを指定しなかった場合
+        """
+        if key is None:
+            raise ValueError(
+                "ShardedRadiusManager.transaction() requires the username "
+                "(key) of the shard to operate on"
+            )
+        with self.shard_for(key).transaction() as tx:
+            yield tx
+
+    def submit(
+        self, op: Callable[[RadiusTransaction], Any], key: str
+    ) -> Any:
+        """keyのユーザーが属するシャードのグループコミットに操作を積む"""
+        return self.shard_for(key).submit(op)
+
+    def execute(self, op: Callable[[RadiusTransaction], Any], key: str) -> Any:
+        """
+        keyのユーザーが属するシャードのグループコミットで操作を実行
+
+        Args:
+            op: RadiusTransactionを受け取り結果を返す関数
+                （key以外のユーザーを操作してはならない）
+            key: 操作対象のユーザー名
+
+        Returns:
+            opの戻り値
+        """
+        return self.shard_for(key).execute(op)
+
+    def add_user(
+        self, username: str, password: str = None, nt_hash: str = None
+    ) -> Tuple[str, str]:
+        """ユーザーを追加（RadiusManager.add_user と同じ）"""
+        return self.shard_for(username).add_user(username, password, nt_hash)
+
+    def update_user_password(
+        self, username: str, new_password: str = None
+    ) -> Tuple[str, str]:
+        """ユーザーパスワードを更新（RadiusManager.update_user_password と同じ）"""
+        return self.shard_for(username).update_user_password(
+            username, new_password
+        )
+
+    def delete_user(self, username: str) -> bool:
+        """ユーザーを削除（RadiusManager.delete_user と同じ）"""
+        return self.shard_for(username).delete_user(username)
+
+    def _group(self, usernames: Iterable[str]) -> Dict[int, List[Any]]:
+        groups: Dict[int, List[Any]] = {}
+        for item in usernames:
+            username = item if isinstance(item, str) else item[0]
+            groups.setdefault(
+                self._shard_index(username.strip()), []
+            ).append(item)
+        return groups
+
+    def add_users(
+        self,
+        users: Iterable[Union[str, Tuple[str, Optional[str]]]],
+        on_added: Optional[Callable[[str, str, str], None]] = None,
+    ) -> Dict[str, List[str]]:
+        """
+        複数ユーザーを一括追加（シャードごとに読込1回・書込1回）
+
+        Args:
+            users: ユーザー名、または (ユーザー名, 平文パスワード) の反復可能オブジェクト
+            on_added: 追加ごとに (ユーザー名, パスワード, NTハッシュ) で呼ばれるコールバック
+
+        Returns:
+            {'added': 追加したユーザー名, 'skipped': スキップしたユーザー名} の辞書
+        """
+        result: Dict[str, List[str]] = {'added': [], 'skipped': []}
+        for index, items in self._group(users).items():
+            partial = self._shards[index].add_users(items, on_added)
+            result['added'].extend(partial['added'])
+            result['skipped'].extend(partial['skipped'])
+        return result
+
+    def delete_users(self, usernames: Iterable[str]) -> Dict[str, bool]:
+        """
+        複数ユーザーを一括削除（シャードごとに書込1回）
+
+        Args:
+            usernames: ユーザー名の反復可能オブジェクト
+
+        Returns:
+            ユーザー名→削除成功時True（存在しない場合False）の辞書
+        """
+        result: Dict[str, bool] = {}
+        for index, items in self._group(usernames).items():
+            result.update(self._shards[index].delete_users(items))
+        return result
+
+    def add_commit_listener(self, listener: Callable[[int], None]) -> None:
+        """全シャードのコミット後に呼ばれるコールバックを登録"""
+        for shard in self._shards:
+            shard.add_commit_listener(listener)
+
+    def watch(
+        self, poll_interval: float = 5.0, use_inotify: bool = True
+    ) -> None:
+        """全シャードの外部変更の監視を開始（RadiusManager.watch() と同じ）"""
+        for shard in self._shards:
+            shard.watch(poll_interval, use_inotify)
+
+    def add_mirror(
+        self, mirror: Callable[[Dict[str, Optional[str]]], None]
+    ) -> None:
+        """全シャードのコミットで呼ばれるミラーを登録"""
+        for shard in self._shards:
+            shard.add_mirror(mirror)
+
+    def sanitize_file(self) -> bool:
+        """全シャードをサニタイズ（いずれかを書き換えた場合True）"""
+        changed = False
+        for shard in self._shards:
+            changed = shard.sanitize_file() or changed
+        return changed
+
+    def compact(self) -> Dict[str, Any]:
+        """
+        全シャードをコンパクション
+
+        Returns:
+            RadiusManager.compact() の各値をシャード全体で合計した辞書
+        """
+        total: Dict[str, Any] = {}
+        for shard in self._shards:
+            for key, value in shard.compact().items():
+                total[key] = total.get(key, 0) + value
+        return total
+
+    def snapshots(self, key: str) -> List[Dict[str, Any]]:
+        """
+        keyのユーザーが属するシャードの世代スナップショットの一覧
+
+        スナップショットはシャードごとに独立して保持する。
+
+        Args:
+            key: ユーザー名
+
+        Returns:
+            RadiusManager.snapshots() と同じ新しい順のリスト
+        """
+        return self.shard_for(key).snapshots()
+
+    def rollback(self, generation: int, key: str) -> Dict[str, Any]:
+        """
+        keyのユーザーが属するシャードを指定世代に巻き戻す
+
+        巻き戻すのはそのシャードだけで、他のシャードのユーザーは変わらない。
+        世代番号はシャードごとに別のため、snapshots(key) で確認すること。
+
+        Args:
+            generation: snapshots(key) の世代番号
+            key: ユーザー名
+
+        Returns:
+            RadiusManager.rollback() と同じ辞書
+
+        Raises:
+            RuntimeError: スナップショットが無効な場合
+            ValueError: 世代が存在しない場合
+        """
+        return self.shard_for(key).rollback(generation)
+
+    def checkpoint(self) -> None:
+        """全ファイルのチェックポイントを取る"""
+        self._main.checkpoint()
+        for shard in self._shards:
+            shard.checkpoint()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """全シャードのライタースレッドを停止"""
+        self._main.close(timeout)
+        for shard in self._shards:
+            shard.close(timeout)
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+authorizeファイルの世代スナップショット
+置き換えられた版をハードリンク（または圧縮コピー）で保持し、リネームで巻き戻す
+"""
+
+import errno
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from .filelock import FileLock
+from .metadata import TIMESTAMP_FORMAT
+
+logger = logging.getLogger(__name__)
+
+# ハードリンクできずコピーに切り替えるエラー（別ファイルシステム等）
+_LINK_UNSUPPORTED = frozenset(
+    code for code in (
+        errno.EXDEV, errno.EPERM, errno.EMLINK,
+        getattr(errno, 'ENOTSUP', None), getattr(errno, 'EOPNOTSUPP', None),
+    )
+    if code is not None
+)
+# 書込途中で停止したプロセスが残した一時ファイルを消すまでの秒数
+_STALE_STAGING_SECONDS = 3600
+
+
+class SnapshotStore:
+    """
+    authorizeファイルの直近の世代を内容のSHA-256で保持するストア
+
+    置換で外れる旧ファイルはハードリンクを張るだけで保存する（コピーしない）。
+    同じ内容の世代は1つのオブジェクトを共有する。世代数（keep）と
+    オブジェクトの合計バイト数（max_bytes）の上限を超えたら古い世代から捨てる。
+    compress=True の場合はgzipで圧縮して保存する（巻き戻し時に展開が必要）。
+
+    ディレクトリ構成::
+
+        <directory>/manifest.json   世代の一覧（番号・ハッシュ・サイズ・日時・理由）
+        <directory>/objects/<sha256>[.gz]
+        <directory>/staging/        置換前に退避したファイル（登録まで）
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        keep: int = 10,
+        max_bytes: int = 64 << 20,
+        compress: bool = False,
+        sync: bool = True,
+        lock_timeout: Optional[float] = 10.0,
+    ):
+        """
+        初期化
+
+        Args:
+            directory: スナップショットの保存先（存在しなければ作成）
+            keep: 保持する世代数の上限
+            max_bytes: 保持するオブジェクトの合計バイト数の上限
+            compress: gzipで圧縮して保存するか（Falseならハードリンク）
+            sync: マニフェスト・圧縮オブジェクトの書込ごとにfsyncするか
+            lock_timeout: マニフェストのロックの取得待ち上限秒
+        """
+        self.directory = Path(directory)
+        self.keep = keep
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.sync = sync
+        self._objects = self.directory / "objects"
+        self._staging = self.directory / "staging"
+        self._objects.mkdir(parents=True, exist_ok=True)
+        self._staging.mkdir(parents=True, exist_ok=True)
+        # マニフェストとオブジェクトの更新を複数プロセス間で直列化する
+        self._lock = FileLock(
+            self.directory / "manifest.lock", timeout=lock_timeout
+        )
+        self._counter = itertools.count()
+
+    def stage(
+        self, path: Union[str, Path], copy: bool = False
+    ) -> Optional[Path]:
+        """
+        置換・上書きされる直前のファイルを退避（プロセス間ロック内で呼ぶ）
+
+        通常はハードリンクを張るだけなのでファイルサイズによらず一定時間で済む。
+        ハードリンクできない場合と、copy=True（同じinodeを上書きする場合）は
+        内容をコピーする。
+
+        Args:
+            path: 退避するファイル
+            copy: ハードリンクせずにコピーするか
+
+        Returns:
+            退避したファイルのパス（対象が存在しない場合はNone）
+        """
+        staged = self._staging / (
+            f"{os.getpid()}.{threading.get_ident()}.{next(self._counter)}"
+        )
+        try:
+            if not copy:
+                try:
+                    os.link(path, staged)
+                    return staged
+                except OSError as e:
+                    if e.errno not in _LINK_UNSUPPORTED:
+                        raise
+            shutil.copyfile(path, staged)
+            return staged
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def discard(staged: Optional[Path]) -> None:
+        """置換しなかった場合に退避したファイルを削除"""
+        if staged is not None:
+            staged.unlink(missing_ok=True)
+
+    def record(
+        self, staged: Optional[Path], reason: str
+    ) -> Optional[int]:
+        """
+        退避したファイルを世代として登録し、上限を超えた古い世代を捨てる
+
+        ハッシュの計算はロックの外で行う。
+
+        Args:
+            staged: stage()の戻り値
+            reason: 置き換えた理由（rewrite / direct / rollback 等）
+
+        Returns:
+            登録した世代番号（stagedがNoneの場合はNone）
+        """
+        if staged is None:
+            return None
+        try:
+            digest, size = self._digest(staged)
+            with self._lock:
+                stored = self._store_object(staged, digest)
+                manifest = self._load()
+                generation = manifest['next']
+                manifest['next'] = generation + 1
+                manifest['generations'].append({
+                    'generation': generation,
+                    'digest': digest,
+                    'size': size,
+                    'stored': stored,
+                    'created': datetime.now().strftime(TIMESTAMP_FORMAT),
+                    'reason': reason,
+                })
+                dropped = self._enforce(manifest)
+                self._save(manifest)
+        finally:
+            staged.unlink(missing_ok=True)
+        logger.info(
+            "[SnapshotStore] recorded | generation=%d digest=%s size=%d "
+            "stored=%d reason=%s dropped=%d",
+            generation,
+            digest[:12],
+            size,
+            stored,
+            reason,
+            dropped,
+        )
+        return generation
+
+    def generations(self) -> List[Dict[str, Any]]:
+        """
+        保持している世代の一覧
+
+        Returns:
+            新しい順の {'generation', 'digest', 'size', 'stored', 'created',
+            'reason'} のリスト
+        """
+        with self._lock:
+            manifest = self._load()
+        return [dict(entry) for entry in reversed(manifest['generations'])]
+
+    def prepare(
+        self, generation: int, target: Union[str, Path]
+    ) -> Tuple[Path, Dict[str, Any]]:
+        """
+        指定世代の内容をtargetと同じディレクトリの一時ファイルとして用意する
+
+        ハードリンクで保存した世代はリンクを張るだけで用意できるため、
+        巻き戻しは一時ファイルのリネーム1回で済む。
+
+        Args:
+            generation: 世代番号
+            target: 置き換える対象のファイル
+
+        Returns:
+            (一時ファイルのパス, 世代の情報)
+
+        Raises:
+            ValueError: 世代が存在しない、またはオブジェクトが壊れている場合
+        """
+        target = Path(target)
+        temp = target.with_name(f".{target.name}.rollback")
+        with self._lock:
+            manifest = self._load()
+            entry = next(
+                (e for e in manifest['generations']
+                 if e['generation'] == generation),
+                None,
+            )
+            if entry is None:
+                raise ValueError(f"unknown snapshot generation: {generation}")
+            obj = self._find_object(entry['digest'])
+            if obj is None:
+                raise ValueError(
+                    f"snapshot object missing: generation={generation}"
+                )
+            temp.unlink(missing_ok=True)
+            if obj.suffix == ".gz":
+                with gzip.open(obj, 'rb') as src, open(temp, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1 << 16)
+                    dst.flush()
+                    if self.sync:
+                        os.fsync(dst.fileno())
+            else:
+                try:
+                    os.link(obj, temp)
+                except OSError as e:
+                    if e.errno not in _LINK_UNSUPPORTED:
+                        raise
+                    shutil.copyfile(obj, temp)
+        if os.stat(temp).st_size != entry['size']:
+            temp.unlink(missing_ok=True)
+            raise ValueError(
+                f"snapshot size mismatch: generation={generation}"
+            )
+        return temp, dict(entry)
+
+    def unshare(self, path: Union[str, Path]) -> int:
+        """
+        pathとinodeを共有しているオブジェクトを複製に置き換える
+
+        ハードリンクで巻き戻した直後のauthorizeはオブジェクトと同じinodeのため、
+        その場で上書きする前に呼んでオブジェクトが書き換わらないようにする。
+
+        Args:
+            path: これから上書きするファイル
+
+        Returns:
+            複製に置き換えたオブジェクトの数
+        """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return 0
+        if st.st_nlink <= 1:
+            return 0
+        replaced = 0
+        with self._lock:
+            for obj in self._objects.iterdir():
+                try:
+                    ost = obj.stat()
+                except FileNotFoundError:
+                    continue
+                if (ost.st_dev, ost.st_ino) != (st.st_dev, st.st_ino):
+                    continue
+                temp = self._staging / (
+                    f"{os.getpid()}.{threading.get_ident()}."
+                    f"{next(self._counter)}"
+                )
+                with open(obj, 'rb') as src, open(temp, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1 << 16)
+                    dst.flush()
+                    if self.sync:
+                        os.fsync(dst.fileno())
+                os.replace(temp, obj)
+                replaced += 1
+        if replaced:
+            logger.info(
+                "[SnapshotStore] unshared objects before overwrite | "
+                "path=%s objects=%d",
+                path,
+                replaced,
+            )
+        return replaced
+
+    @staticmethod
+    def _digest(path: Path) -> Tuple[str, int]:
+        """ファイルのSHA-256とサイズ"""
+        sha = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as rf:
+            for chunk in iter(lambda: rf.read(1 << 16), b""):
+                sha.update(chunk)
+                size += len(chunk)
+        return sha.hexdigest(), size
+
+    def _find_object(self, digest: str) -> Optional[Path]:
+        for name in (digest, digest + ".gz"):
+            path = self._objects / name
+            if path.exists():
+                return path
+        return None
+
+    def _store_object(self, staged: Path, digest: str) -> int:
+        """
+        退避したファイルをオブジェクトとして保存（同じ内容があれば共有）
+
+        Returns:
+            オブジェクトのバイト数
+        """
+        existing = self._find_object(digest)
+        if existing is not None:
+            return existing.stat().st_size
+        if not self.compress:
+            target = self._objects / digest
+            os.replace(staged, target)
+            return target.stat().st_size
+        target = self._objects / (digest + ".gz")
+        temp = staged.with_name(staged.name + ".gz")
+        with open(staged, 'rb') as src, open(temp, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as dst:
+                shutil.copyfileobj(src, dst, 1 << 16)
+            raw.flush()
+            if self.sync:
+                os.fsync(raw.fileno())
+        os.replace(temp, target)
+        return target.stat().st_size
+
+    def _enforce(self, manifest: Dict[str, Any]) -> int:
+        """
+        世代数・合計バイト数の上限を超えた古い世代と、参照されないオブジェクトを削除
+
+        Returns:
+            捨てた世代数
+        """
+        generations = manifest['generations']
+        dropped = 0
+        while generations and (
+            len(generations) > self.keep
+            or self._stored_bytes(generations) > self.max_bytes
+        ):
+            generations.pop(0)
+            dropped += 1
+        if dropped and not generations:
+            logger.warning(
+                "[SnapshotStore] snapshot exceeds max_bytes; not retained | "
+                "max_bytes=%d",
+                self.max_bytes,
+            )
+        referenced = {entry['digest'] for entry in generations}
+        for obj in self._objects.iterdir():
+            if obj.name.split(".", 1)[0] not in referenced:
+                obj.unlink(missing_ok=True)
+        # 退避後に停止したプロセスの一時ファイル（リンク作成でctimeが更新される）
+        deadline = time.time() - _STALE_STAGING_SECONDS
+        for leftover in self._staging.iterdir():
+            try:
+                if leftover.stat().st_ctime < deadline:
+                    leftover.unlink()
+            except FileNotFoundError:
+                pass
+        return dropped
+
+    @staticmethod
+    def _stored_bytes(generations: List[Dict[str, Any]]) -> int:
+        """世代が参照するオブジェクトの合計バイト数（共有分は1回だけ数える）"""
+        return sum({
+            entry['digest']: entry['stored'] for entry in generations
+        }.values())
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(
+                self.directory / self.MANIFEST, 'r', encoding='utf-8'
+            ) as rf:
+                manifest = json.load(rf)
+            if not isinstance(manifest.get('generations'), list) or \
+                    not isinstance(manifest.get('next'), int):
+                raise ValueError("malformed manifest")
+        except FileNotFoundError:
+            manifest = {'next': 1, 'generations': []}
+        except (ValueError, AttributeError) as e:
+            # 壊れたマニフェストは作り直す（オブジェクトは次の整理で消える）
+            logger.warning(
+                "[SnapshotStore] manifest unreadable; starting over | "
+                "error=%s",
+                e,
+            )
+            manifest = {'next': 1, 'generations': []}
+        return manifest
+
+    def _save(self, manifest: Dict[str, Any]) -> None:
+        """マニフェストをアトミックに書き直す"""
+        path = self.directory / self.MANIFEST
+        temp = path.with_suffix('.tmp')
+        with open(temp, 'w', encoding='utf-8') as wf:
+            json.dump(manifest, wf, ensure_ascii=False, indent=1)
+            wf.flush()
+            if self.sync:
+                os.fsync(wf.fileno())
+        temp.replace(path)
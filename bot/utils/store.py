@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+"""
+ユーザーストアの抽象化
+authorizeファイル・メモリ・SQLiteのいずれでも同じAPIでユーザーを管理する
+"""
+
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from .entry import UserEntry
+from .password import PasswordManager
+from .radius import RadiusManager
+from .sharded import ShardedRadiusManager
+
+logger = logging.getLogger(__name__)
+
+# 選択できるバックエンド名
+BACKENDS = ("file", "memory", "sqlite")
+
+# RadiusManagerの永続性レベルに対応するPRAGMA synchronousの値
+SQLITE_SYNCHRONOUS = {"none": "OFF", "file": "NORMAL", "full": "FULL"}
+
+
+class UserExistsError(ValueError):
+    """追加しようとしたユーザーが既に存在する"""
+
+
+class UserNotFoundError(ValueError):
+    """更新しようとしたユーザーが存在しない"""
+
+
+def _reply_message(username: str) -> str:
+    # authorizeファイルに書くReply-Messageと同じ既定値
+    return f"Welcome {username}"
+
+
+def _make_entry(username: str, nt_hash: str, reply_message: str) -> UserEntry:
+    """
+    ファイル以外のバックエンド用のUserEntry（行番号・バイト位置は-1）
+    """
+    return UserEntry(
+        username,
+        -1,
+        -1,
+        (('NT-Password', nt_hash), ('Reply-Message', reply_message)),
+    )
+
+
+class UserStore(ABC):
+    """
+    ユーザーストアの共通インターフェース
+
+    add_user / update_user_password のパスワード生成はこのクラスで行い、
+    各バックエンドは _insert / _replace で1ユーザー分の書込だけを実装する。
+    """
+
+    # バックエンド名（BACKENDSのいずれか）
+    backend = ""
+
+    @abstractmethod
+    def get_user(self, username: str) -> Optional[UserEntry]:
+        """
+        ユーザー情報を取得
+
+        Args:
+            username: ユーザー名
+
+        Returns:
+            UserEntry（存在しない場合はNone）
+        """
+
+    @abstractmethod
+    def list_users(self) -> List[UserEntry]:
+        """
+        全ユーザーのリストを取得
+
+        Returns:
+            UserEntryのリスト
+        """
+
+    @abstractmethod
+    def delete_user(self, username: str) -> bool:
+        """
+        ユーザーを削除
+
+        Args:
+            username: ユーザー名
+
+        Returns:
+            削除成功時True、ユーザーが存在しない場合False
+        """
+
+    @abstractmethod
+    def _insert(self, username: str, nt_hash: str) -> bool:
+        """新規ユーザーを書き込む（既に存在する場合は何もせずFalse）"""
+
+    @abstractmethod
+    def _replace(self, username: str, nt_hash: str) -> bool:
+        """既存ユーザーのNTハッシュを差し替える（存在しない場合はFalse）"""
+
+    def add_user(
+        self, username: str, password: str = None, nt_hash: str = None
+    ) -> Tuple[str, str]:
+        """
+        ユーザーを追加
+
+        Args:
+            username: ユーザー名
+            password: 平文パスワード（指定時はNTハッシュ生成）
+            nt_hash: NTハッシュ（直接指定）
+
+        Returns:
+            (生成されたパスワード, NTハッシュ) のタプル
+        """
+        if password is None:
+            password, nt_hash = PasswordManager.generate_user_credentials()
+        elif nt_hash is None:
+            nt_hash = PasswordManager.generate_nt_hash(password)
+
+        if not self._insert(username, nt_hash):
+            raise UserExistsError(f"User '{username}' already exists")
+        logger.info(
+            "[%s] user added | user=%s nt_hash_sample=%s",
+            type(self).__name__,
+            username,
+            (nt_hash[:6] + "…") if nt_hash else "***",
+        )
+        return password, nt_hash
+
+    def update_user_password(
+        self, username: str, new_password: str = None
+    ) -> Tuple[str, str]:
+        """
+        ユーザーパスワードを更新
+
+        Args:
+            username: ユーザー名
+            new_password: 新しいパスワード（未指定時は自動生成）
+
+        Returns:
+            (新しいパスワード, NTハッシュ) のタプル
+        """
+        if new_password is None:
+            new_password, new_nt_hash = (
+                PasswordManager.generate_user_credentials()
+            )
+        else:
+            new_nt_hash = PasswordManager.generate_nt_hash(new_password)
+
+        if not self._replace(username, new_nt_hash):
+            raise UserNotFoundError(f"User '{username}' not found")
+        logger.info(
+            "[%s] password updated | user=%s",
+            type(self).__name__,
+            username,
+        )
+        return new_password, new_nt_hash
+
+    def close(self) -> None:
+        """保持している資源を解放"""
+
+
+class FileUserStore(UserStore):
+    """
+    authorizeファイル（RadiusManager / ShardedRadiusManager）をそのまま使うストア
+
+    ロック・ジャーナル・グループコミットはマネージャ側の実装を使う。
+    パスワードのハッシュ計算はロックの外で済ませてから書込を投入する。
+    """
+
+    backend = "file"
+
+    def __init__(
+        self, manager: Union[RadiusManager, ShardedRadiusManager]
+    ):
+        """
+        初期化
+
+        Args:
+            manager: 対象のRadiusManagerまたはShardedRadiusManager
+        """
+        self.manager = manager
+
+    def get_user(self, username: str) -> Optional[UserEntry]:
+        return self.manager.get_user(username)
+
+    def list_users(self) -> List[UserEntry]:
+        return self.manager.list_users()
+
+    def delete_user(self, username: str) -> bool:
+        return self.manager.delete_user(username)
+
+    def _insert(self, username: str, nt_hash: str) -> bool:
+        def _add(tx) -> bool:
+            if tx.get_user(username) is not None:
+                return False
+            tx.add_user(username, "", nt_hash)
+            return True
+
+        # マネージャのadd_userと同じ操作名で計測する
+        with self.manager.metrics.operation("add_user"):
+            return self.manager.execute(_add, key=username)
+
+    def _replace(self, username: str, nt_hash: str) -> bool:
+        with self.manager.metrics.operation("update_user_password"):
+            return self.manager.execute(
+                lambda tx: tx.set_nt_hash(username, nt_hash), key=username
+            )
+
+    def close(self) -> None:
+        self.manager.close()
+
+
+class MemoryUserStore(UserStore):
+    """
+    プロセス内の辞書だけに保持するストア（永続化しない）
+
+    テストやベンチマークの基準値として使う。
+    """
+
+    backend = "memory"
+
+    def __init__(self):
+        self._users: Dict[str, UserEntry] = {}
+        self._guard = threading.Lock()
+
+    def get_user(self, username: str) -> Optional[UserEntry]:
+        with self._guard:
+            return self._users.get(username)
+
+    def list_users(self) -> List[UserEntry]:
+        with self._guard:
+            return list(self._users.values())
+
+    def delete_user(self, username: str) -> bool:
+        with self._guard:
+            return self._users.pop(username, None) is not None
+
+    def _insert(self, username: str, nt_hash: str) -> bool:
+        with self._guard:
+            if username in self._users:
+                return False
+            self._users[username] = _make_entry(
+                username, nt_hash, _reply_message(username)
+            )
+            return True
+
+    def _replace(self, username: str, nt_hash: str) -> bool:
+        with self._guard:
+            entry = self._users.get(username)
+            if entry is None:
+                return False
+            self._users[username] = entry.with_attribute(
+                'NT-Password', nt_hash
+            )
+            return True
+
+
+class SQLiteUserStore(UserStore):
+    """
+    SQLiteデータベースに保持するストア
+
+    WALモードで開き、変更は1ユーザー1行の単独トランザクションで書き込むため、
+    書込の所要時間はユーザー数に依存しない。users表の変更はトリガーで
+    changes表に連番付きで記録され、AuthorizeExporterが前回の書き出し以降の
+    変更だけをauthorizeファイルへ反映する。
+    接続は1本をスレッド間で共有し、ロックで直列化する。
+    """
+
+    backend = "sqlite"
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS users ("
+        "username TEXT PRIMARY KEY, "
+        "nt_hash TEXT NOT NULL, "
+        "reply_message TEXT NOT NULL)",
+        # 変更されたユーザー名の記録（書き出し済みの分は削除する）
+        "CREATE TABLE IF NOT EXISTS changes ("
+        "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "username TEXT NOT NULL)",
+        # 書き出し先ごとの反映済みの連番
+        "CREATE TABLE IF NOT EXISTS exports ("
+        "target TEXT PRIMARY KEY, "
+        "seq INTEGER NOT NULL)",
+        "CREATE TRIGGER IF NOT EXISTS users_insert AFTER INSERT ON users "
+        "BEGIN INSERT INTO changes (username) VALUES (NEW.username); END",
+        "CREATE TRIGGER IF NOT EXISTS users_update AFTER UPDATE ON users "
+        "BEGIN INSERT INTO changes (username) VALUES (NEW.username); END",
+        "CREATE TRIGGER IF NOT EXISTS users_delete AFTER DELETE ON users "
+        "BEGIN INSERT INTO changes (username) VALUES (OLD.username); END",
+    )
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        timeout: float = 30.0,
+        durability: str = "file",
+    ):
+        """
+        初期化
+
+        Args:
+            path: データベースファイルのパス（存在しなければ作成）
+            timeout: 他プロセスの書込ロックを待つ秒数
+            durability: 書込の永続性（"none" / "file" / "full"）。
+                fileはWALへの追記のみ、fullはコミットごとにfsyncする
+        """
+        if durability not in SQLITE_SYNCHRONOUS:
+            raise ValueError(f"unknown durability: {durability}")
+        self.path = Path(path)
+        self.durability = durability
+        self._guard = threading.Lock()
+        self._commit_listeners: List[Callable[[int], None]] = []
+        self._conn = sqlite3.connect(
+            str(self.path), timeout=timeout, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"PRAGMA synchronous={SQLITE_SYNCHRONOUS[durability]}"
+        )
+        with self._conn:
+            for statement in self.SCHEMA:
+                self._conn.execute(statement)
+        logger.info(
+            "[SQLiteUserStore] initialized | path=%s durability=%s",
+            self.path,
+            durability,
+        )
+
+    def add_commit_listener(self, listener: Callable[[int], None]) -> None:
+        """
+        変更のコミット後に呼ばれるリスナーを登録
+
+        Args:
+            listener: コミットした変更操作数を受け取る関数
+        """
+        self._commit_listeners.append(listener)
+
+    def _notify_commit(self, changed: bool) -> None:
+        if not changed:
+            return
+        for listener in self._commit_listeners:
+            try:
+                listener(1)
+            except Exception as e:
+                logger.warning(
+                    "[SQLiteUserStore] commit listener failed | error=%s", e
+                )
+
+    def get_user(self, username: str) -> Optional[UserEntry]:
+        with self._guard:
+            row = self._conn.execute(
+                "SELECT username, nt_hash, reply_message FROM users "
+                "WHERE username = ?",
+                (username,),
+            ).fetchone()
+        return _make_entry(*row) if row else None
+
+    def list_users(self) -> List[UserEntry]:
+        with self._guard:
+            rows = self._conn.execute(
+                "SELECT username, nt_hash, reply_message FROM users "
+                "ORDER BY rowid"
+            ).fetchall()
+        return [_make_entry(*row) for row in rows]
+
+    def delete_user(self, username: str) -> bool:
+        with self._guard, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM users WHERE username = ?", (username,)
+            )
+        self._notify_commit(cursor.rowcount > 0)
+        return cursor.rowcount > 0
+
+    def _insert(self, username: str, nt_hash: str) -> bool:
+        with self._guard, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO users "
+                "(username, nt_hash, reply_message) VALUES (?, ?, ?)",
+                (username, nt_hash, _reply_message(username)),
+            )
+        self._notify_commit(cursor.rowcount > 0)
+        return cursor.rowcount > 0
+
+    def _replace(self, username: str, nt_hash: str) -> bool:
+        with self._guard, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE users SET nt_hash = ? WHERE username = ?",
+                (nt_hash, username),
+            )
+        self._notify_commit(cursor.rowcount > 0)
+        return cursor.rowcount > 0
+
+    def import_entries(self, entries: Iterable[UserEntry]) -> int:
+        """
+        既存のauthorizeのエントリを一括登録（既に存在するユーザーはスキップ）
+
+        Args:
+            entries: UserEntryの反復可能オブジェクト
+
+        Returns:
+            登録した件数
+        """
+        rows = [
+            (
+                entry.username,
+                entry.nt_hash,
+                entry.get('Reply-Message', _reply_message(entry.username)),
+            )
+            for entry in entries
+            if entry.nt_hash
+        ]
+        count_sql = "SELECT COUNT(*) FROM users"
+        with self._guard, self._conn:
+            before = self._conn.execute(count_sql).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO users "
+                "(username, nt_hash, reply_message) VALUES (?, ?, ?)",
+                rows,
+            )
+            imported = self._conn.execute(count_sql).fetchone()[0] - before
+        self._notify_commit(imported > 0)
+        return imported
+
+    def _change_seq(self) -> int:
+        # 削除済みの行も含めた最後の連番（AUTOINCREMENTの採番状態）
+        row = self._conn.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'changes'"
+        ).fetchone()
+        return row[0] if row else 0
+
+    def change_seq(self) -> int:
+        """最後に記録された変更の連番（変更がなければ0）"""
+        with self._guard:
+            return self._change_seq()
+
+    def exported_seq(self, target: str) -> Optional[int]:
+        """
+        書き出し先に反映済みの連番
+
+        Args:
+            target: 書き出し先の識別子（authorizeファイルのパス等）
+
+        Returns:
+            連番（一度も書き出していない場合はNone）
+        """
+        with self._guard:
+            row = self._conn.execute(
+                "SELECT seq FROM exports WHERE target = ?", (target,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def read_changes(
+        self, since: Optional[int]
+    ) -> Tuple[int, Dict[str, Optional[str]]]:
+        """
+        指定の連番以降に変更されたユーザーの現在の状態を1つのスナップショットで読む
+
+        Args:
+            since: 反映済みの連番（Noneの場合は全ユーザー）
+
+        Returns:
+            (現在の連番, ユーザー名→NTハッシュ（削除済みはNone）の辞書)
+        """
+        with self._guard:
+            self._conn.execute("BEGIN")
+            try:
+                seq = self._change_seq()
+                if since is None:
+                    rows = self._conn.execute(
+                        "SELECT username, nt_hash FROM users ORDER BY rowid"
+                    ).fetchall()
+                else:
+                    rows = self._conn.execute(
+                        "SELECT c.username, u.nt_hash FROM changes c "
+                        "LEFT JOIN users u ON u.username = c.username "
+                        "WHERE c.seq > ? AND c.seq <= ? "
+                        "GROUP BY c.username ORDER BY MIN(c.seq)",
+                        (since, seq),
+                    ).fetchall()
+            finally:
+                self._conn.execute("COMMIT")
+        return seq, dict(rows)
+
+    def mark_exported(self, target: str, seq: int) -> None:
+        """
+        書き出し先に連番までを反映したことを記録し、不要になった変更記録を削除
+
+        Args:
+            target: 書き出し先の識別子
+            seq: read_changes()が返した連番
+        """
+        with self._guard, self._conn:
+            self._conn.execute(
+                "INSERT INTO exports (target, seq) VALUES (?, ?) "
+                "ON CONFLICT(target) DO UPDATE SET "
+                "seq = MAX(seq, excluded.seq)",
+                (target, seq),
+            )
+            self._conn.execute(
+                "DELETE FROM changes WHERE seq <= "
+                "(SELECT MIN(seq) FROM exports)"
+            )
+
+    def close(self) -> None:
+        with self._guard:
+            self._conn.close()
+
+
+def open_store(
+    backend: str, path: Optional[str] = None, **options: Any
+) -> UserStore:
+    """
+    バックエンド名からユーザーストアを作成
+
+    Args:
+        backend: "file" / "memory" / "sqlite"
+        path: fileはauthorizeファイル、sqliteはデータベースファイルのパス
+        **options: fileではRadiusManagerへの引数（shards>0でシャード化）、
+            sqliteではdurabilityのみ使う
+
+    Returns:
+        UserStore
+    """
+    if backend == "memory":
+        return MemoryUserStore()
+    if path is None:
+        raise ValueError(f"path is required for backend '{backend}'")
+    if backend == "sqlite":
+        return SQLiteUserStore(
+            path, durability=options.get('durability', 'file')
+        )
+    if backend == "file":
+        shards = options.pop('shards', 0)
+        if shards > 0:
+            return FileUserStore(
+                ShardedRadiusManager(path, shards=shards, **options)
+            )
+        return FileUserStore(RadiusManager(path, **options))
+    raise ValueError(f"unknown backend: {backend}")
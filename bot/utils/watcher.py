@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+authorizeファイルの外部変更の監視
+inotify（Linux）で変更を検知し、使えない環境ではstatのポーリングで代替する
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_FILE_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+_DIR_MASK = IN_CREATE | IN_MOVED_TO | IN_DELETE
+_EVENT = struct.Struct("iIII")
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _inotify_init1 = _libc.inotify_init1
+    _inotify_add_watch = _libc.inotify_add_watch
+    _inotify_add_watch.argtypes = (
+        ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32,
+    )
+    _HAS_INOTIFY = True
+except (OSError, AttributeError, TypeError):  # Linux以外など
+    _HAS_INOTIFY = False
+
+
+class AuthorizeWatcher:
+    """
+    authorizeファイルの変更を検知してコールバックを呼ぶバックグラウンドスレッド
+
+    ファイル自体（書換・属性変更・削除）と親ディレクトリ（リネームでの置換・作成）を
+    inotifyで監視する。inotifyはホスト側からのリネーム等を取りこぼすことがあるため、
+    poll_interval秒ごとにも必ずコールバックを呼ぶ（変更の有無は呼び出し側が
+    ファイル署名で判定する）。inotifyが使えない場合はポーリングのみで動作する。
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        on_change: Callable[[], None],
+        poll_interval: float = 5.0,
+        use_inotify: bool = True,
+    ):
+        """
+        初期化
+
+        Args:
+            path: 監視するファイルのパス
+            on_change: 変更の可能性があるときに呼ぶ関数（監視スレッド上で呼ばれる）
+            poll_interval: ポーリングの間隔（秒）
+            use_inotify: inotifyを使うか（Falseまたは使えない場合はポーリングのみ）
+        """
+        self.path = Path(path)
+        self._on_change = on_change
+        self.poll_interval = poll_interval
+        self._fd: Optional[int] = None
+        self._file_wd = -1
+        self._stop_r, self._stop_w = os.pipe()
+        self._thread: Optional[threading.Thread] = None
+        if use_inotify and _HAS_INOTIFY:
+            self._fd = self._init_inotify()
+
+    @property
+    def mode(self) -> str:
+        """監視方式（"inotify" / "poll"）"""
+        return "inotify" if self._fd is not None else "poll"
+
+    @property
+    def alive(self) -> bool:
+        """監視スレッドが動作中か"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def _init_inotify(self) -> Optional[int]:
+        fd = _inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            logger.warning(
+                "[AuthorizeWatcher] inotify unavailable, fallback to polling "
+                "| errno=%s",
+                errno.errorcode.get(ctypes.get_errno()),
+            )
+            return None
+        if _inotify_add_watch(
+            fd, os.fsencode(self.path.parent), _DIR_MASK
+        ) < 0:
+            logger.warning(
+                "[AuthorizeWatcher] cannot watch directory, fallback to "
+                "polling | path=%s errno=%s",
+                self.path.parent,
+                errno.errorcode.get(ctypes.get_errno()),
+            )
+            os.close(fd)
+            return None
+        self._fd = fd
+        self._watch_file()
+        return fd
+
+    def _watch_file(self) -> None:
+        # 置換されたファイルは新しいinodeになるため、検知のたびに張り直す
+        self._file_wd = _inotify_add_watch(
+            self._fd, os.fsencode(self.path), _FILE_MASK
+        )
+
+    def _drain(self) -> bool:
+        """溜まったイベントを読み、監視対象に関係するものがあればTrue"""
+        relevant = False
+        rearm = False
+        name = os.fsencode(self.path.name)
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                event_name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if wd == self._file_wd:
+                    relevant = True
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                        rearm = True
+                elif event_name == name:
+                    relevant = True
+                    rearm = True
+        if rearm:
+            self._watch_file()
+        return relevant
+
+    def start(self) -> "AuthorizeWatcher":
+        """監視スレッドを起動"""
+        if not self.alive:
+            self._thread = threading.Thread(
+                target=self._run,
+                name="radius-watcher",
+                daemon=True,
+            )
+            self._thread.start()
+            logger.info(
+                "[AuthorizeWatcher] started | path=%s mode=%s "
+                "poll_interval=%.1fs",
+                self.path,
+                self.mode,
+                self.poll_interval,
+            )
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """監視スレッドを停止"""
+        if not self.alive:
+            return
+        os.write(self._stop_w, b"x")
+        self._thread.join(timeout)
+
+    def _notify(self) -> None:
+        try:
+            self._on_change()
+        except Exception as e:
+            logger.warning(
+                "[AuthorizeWatcher] change handler failed | error=%s", e
+            )
+
+    def _run(self) -> None:
+        watched = [self._stop_r]
+        if self._fd is not None:
+            watched.append(self._fd)
+        try:
+            while True:
+                readable, _, _ = select.select(
+                    watched, [], [], self.poll_interval
+                )
+                if self._stop_r in readable:
+                    return
+                if not readable or self._drain():
+                    self._notify()
+        finally:
+            for fd in (self._fd, self._stop_r, self._stop_w):
+                if fd is not None:
+                    os.close(fd)
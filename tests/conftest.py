@@ -0,0 +1,110 @@
+"""
+テスト共通のフィクスチャ
+
+テスト対象はbot/utils（Botと同じく bot/ をカレントにした import utils.xxx）。
+NTハッシュの生成にはMD4が要るため、テストでは平文パスワードと
+NTハッシュの両方を渡してハッシュ計算を通らないようにする。
+"""
+
+import hashlib
+import shutil
+import subprocess
+import sys
+import textwrap
+import time
+from pathlib import Path
+from typing import Callable, Sequence
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+BOT_DIR = ROOT / "bot"
+SAMPLE = ROOT / "radius" / "authorize.sample"
+
+sys.path.insert(0, str(BOT_DIR))
+
+
+def nt_hash(seed: int) -> str:
+    """テスト用の32桁のNTハッシュ（seedごとに全桁が異なりうる値）"""
+    return hashlib.md5(str(seed).encode('ascii')).hexdigest().upper()
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 5.0) -> bool:
+    """監視スレッド等による非同期の反映をconditionが真になるまで待つ"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture
+def authorize(tmp_path: Path) -> Path:
+    """DEFAULTエントリだけを持つauthorizeファイル（サンプルの複製）"""
+    path = tmp_path / "authorize"
+    shutil.copyfile(SAMPLE, path)
+    return path
+
+
+@pytest.fixture
+def state_dir(tmp_path: Path) -> Path:
+    """ロックファイル・ジャーナル等の置き場所"""
+    path = tmp_path / "state"
+    path.mkdir()
+    return path
+
+
+def start_child(code: str, args: Sequence[str] = ()) -> subprocess.Popen:
+    """
+    コードを別プロセスで起動（bot/ をカレントにしたPython）
+
+    プロセス間ロックやクラッシュ後の復旧を試すためのもの。
+    """
+    return subprocess.Popen(
+        [sys.executable, "-c", textwrap.dedent(code), *map(str, args)],
+        cwd=BOT_DIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+
+def wait_child(
+    proc: subprocess.Popen, check: bool = True
+) -> subprocess.CompletedProcess:
+    """start_childで起動したプロセスの終了を待つ（checkなら終了コード0を確認）"""
+    stdout, stderr = proc.communicate(timeout=120)
+    if check and proc.returncode != 0:
+        raise AssertionError(
+            f"child exited with {proc.returncode}\n{stderr}"
+        )
+    return subprocess.CompletedProcess(
+        proc.args, proc.returncode, stdout, stderr
+    )
+
+
+@pytest.fixture
+def run_child() -> Callable[..., subprocess.CompletedProcess]:
+    """コードを別プロセスで実行して終了を待つ関数（os._exit等での終了も許す）"""
+    def _run(
+        code: str, args: Sequence[str] = (), check: bool = True
+    ) -> subprocess.CompletedProcess:
+        return wait_child(start_child(code, args), check)
+
+    return _run
+
+
+@pytest.fixture
+def run_cli(run_child) -> Callable[..., subprocess.CompletedProcess]:
+    """別プロセスで python -m utils.radius を実行する関数（別のレプリカ・管理者役）"""
+    def _run(*args: object, check: bool = True) -> subprocess.CompletedProcess:
+        return run_child(
+            "import sys\n"
+            "from utils.radius import main\n"
+            "sys.exit(main(sys.argv[1:]))\n",
+            [str(arg) for arg in args],
+            check=check,
+        )
+
+    return _run
@@ -0,0 +1,78 @@
+"""コンパクションで履歴コメントの日時をメタデータへ畳み込む"""
+
+import json
+from pathlib import Path
+
+from conftest import nt_hash
+from utils.radius import RadiusManager
+
+
+def _block(username: str, seed: int, *history: str) -> str:
+    return "".join(f"# {line}\n" for line in history) + (
+        f'{username}\tNT-Password := "{nt_hash(seed)}"\n'
+        f'\tReply-Message := "Welcome {username}"\n\n'
+    )
+
+
+def test_compact_folds_history_into_metadata(
+    authorize: Path, state_dir: Path
+):
+    with open(authorize, "a", encoding="utf-8") as wf:
+        wf.write("\n")
+        wf.write(_block(
+            "alice", 1,
+            "User added: 2024-03-01 10:00:00",
+            "Password updated: 2024-04-01 10:00:00",
+        ))
+        # ユーザーに紐づかない孤立行と、更新日時が複数あるユーザー
+        wf.write("\tReply-Message := \"orphan\"\n\n")
+        wf.write(_block(
+            "bob", 2,
+            "User added: 2024-05-01 10:00:00",
+            "Password updated: 2024-05-02 10:00:00",
+            "Password updated: 2024-06-01 10:00:00",
+        ))
+    # 既存のメタデータ: aliceはより古い作成日時、carolは削除済みのユーザー
+    meta = state_dir / "authorize.meta"
+    meta.write_text("".join(json.dumps(e) + "\n" for e in [
+        {"user": "alice", "created": "2024-01-01 00:00:00"},
+        {"user": "alice", "updated": "2024-02-01 00:00:00"},
+        {"user": "carol", "created": "2024-01-01 00:00:00"},
+    ]))
+
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    try:
+        stats = manager.compact()
+        assert stats['history_users'] == 2
+        assert stats['bytes_saved'] > 0
+        assert stats['lines_after'] < stats['lines_before']
+
+        assert manager.get_user_metadata("alice") == {
+            "created": "2024-01-01 00:00:00",
+            "updated": "2024-04-01 10:00:00",
+        }
+        assert manager.get_user_metadata("bob") == {
+            "created": "2024-05-01 10:00:00",
+            "updated": "2024-06-01 10:00:00",
+        }
+        assert manager.get_user_metadata("carol") is None
+        # 書き直したメタデータはユーザーごとに1行
+        assert len(meta.read_text().splitlines()) == 2
+
+        text = authorize.read_text()
+        assert "User added" not in text and "Password updated" not in text
+        assert "orphan" not in text
+        assert {
+            e.username: e.nt_hash for e in manager.list_users() if e.nt_hash
+        } == {"alice": nt_hash(1), "bob": nt_hash(2)}
+        assert sum(
+            1 for e in manager.list_users() if e.username == "DEFAULT"
+        ) > 0
+
+        # 2回目は何も変わらない
+        again = manager.compact()
+        assert again['bytes_saved'] == 0 and again['history_users'] == 0
+        assert manager.get_user_metadata("bob")["updated"] == \
+            "2024-06-01 10:00:00"
+    finally:
+        manager.close()
@@ -0,0 +1,63 @@
+"""複数プロセスから同じauthorizeを同時に更新した場合の整合性"""
+
+from pathlib import Path
+
+import pytest
+
+from conftest import nt_hash, start_child, wait_child
+from utils.radius import RadiusManager
+
+WRITERS = 4
+USERS_PER_WRITER = 30
+
+# 各プロセスがユーザーを1件ずつ追加し（追記）、一部を削除する（全体の書換）
+WRITER = """
+import hashlib
+import sys
+from utils.radius import RadiusManager
+
+path, state_dir, concurrency, writer, count = sys.argv[1:6]
+manager = RadiusManager(path, state_dir=state_dir, concurrency=concurrency)
+for i in range(int(count)):
+    name = f"w{writer}-u{i:03d}"
+    seed = str(int(writer) * 1000 + i).encode("ascii")
+    manager.add_user(name, "pw", hashlib.md5(seed).hexdigest().upper())
+    if i % 3 == 2:
+        manager.delete_user(f"w{writer}-u{i - 1:03d}")
+manager.close()
+"""
+
+
+def _expected() -> dict:
+    users = {}
+    for writer in range(WRITERS):
+        for i in range(USERS_PER_WRITER):
+            if i % 3 == 1:
+                continue
+            users[f"w{writer}-u{i:03d}"] = nt_hash(writer * 1000 + i)
+    return users
+
+
+@pytest.mark.parametrize("concurrency", ["lock", "optimistic"])
+def test_concurrent_writers_lose_no_update(
+    authorize: Path, state_dir: Path, concurrency: str
+):
+    procs = [
+        start_child(WRITER, [
+            authorize, state_dir, concurrency, writer, USERS_PER_WRITER,
+        ])
+        for writer in range(WRITERS)
+    ]
+    for proc in procs:
+        wait_child(proc)
+
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    try:
+        entries = [e for e in manager.list_users() if e.nt_hash]
+        names = [e.username for e in entries]
+        assert len(names) == len(set(names))
+        assert {e.username: e.nt_hash for e in entries} == _expected()
+        # DEFAULTエントリは残る
+        assert any(e.username == "DEFAULT" for e in manager.list_users())
+    finally:
+        manager.close()
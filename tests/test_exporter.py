@@ -0,0 +1,84 @@
+"""SQLiteユーザーストアからauthorizeへの差分の書き出し"""
+
+from pathlib import Path
+
+from conftest import nt_hash
+from utils.exporter import AuthorizeExporter
+from utils.radius import RadiusManager
+from utils.store import SQLiteUserStore
+
+
+def _users(manager: RadiusManager) -> dict:
+    return {e.username: e.nt_hash for e in manager.list_users() if e.nt_hash}
+
+
+def test_export_writes_only_changed_users(
+    authorize: Path, state_dir: Path, tmp_path: Path
+):
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    manager.add_user("alice", "pw", nt_hash(1))
+    manager.add_user("bob", "pw", nt_hash(2))
+    store = SQLiteUserStore(tmp_path / "users.db")
+    try:
+        # 初回はauthorizeの既存ユーザーを取り込み、全件を突き合わせる
+        exporter = AuthorizeExporter(store, manager)
+        assert {e.username for e in store.list_users()} == {"alice", "bob"}
+        first = exporter.export()
+        assert (first['added'], first['updated'], first['deleted']) == \
+            (0, 0, 0)
+        assert exporter.export() is None
+
+        # 以後の書き出しは変更のあったユーザーだけを見るため、
+        # ストア外でauthorizeを直接変えたユーザーには触れない
+        manager.execute(lambda tx: tx.set_nt_hash("bob", nt_hash(20)))
+
+        store.add_user("carol", "pw", nt_hash(3))
+        store.delete_user("alice")
+        store.add_user("alice", "pw", nt_hash(10))
+        stats = exporter.export()
+        assert (stats['added'], stats['updated'], stats['deleted']) == \
+            (1, 1, 0)
+        assert _users(manager) == {
+            "alice": nt_hash(10), "bob": nt_hash(20), "carol": nt_hash(3),
+        }
+
+        # 別プロセス（管理スクリプト等）が同じデータベースを更新した場合
+        other = SQLiteUserStore(tmp_path / "users.db")
+        try:
+            other.delete_user("carol")
+        finally:
+            other.close()
+        stats = exporter.export()
+        assert (stats['added'], stats['updated'], stats['deleted']) == \
+            (0, 0, 1)
+        assert "carol" not in _users(manager)
+        assert exporter.export() is None
+        assert store.exported_seq(exporter.target) == store.change_seq()
+    finally:
+        store.close()
+        manager.close()
+
+
+def test_export_resumes_after_restart(
+    authorize: Path, state_dir: Path, tmp_path: Path
+):
+    db = tmp_path / "users.db"
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    store = SQLiteUserStore(db)
+    AuthorizeExporter(store, manager).export()
+    # 書き出す前に停止した変更
+    store.add_user("dave", "pw", nt_hash(4))
+    store.close()
+    manager.close()
+
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    store = SQLiteUserStore(db)
+    try:
+        exporter = AuthorizeExporter(store, manager)
+        stats = exporter.export()
+        assert (stats['added'], stats['updated'], stats['deleted']) == \
+            (1, 0, 0)
+        assert _users(manager) == {"dave": nt_hash(4)}
+    finally:
+        store.close()
+        manager.close()
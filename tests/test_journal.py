@@ -0,0 +1,119 @@
+"""変更ジャーナルの再適用（書込前の停止と、停止後の手作業での編集）"""
+
+from pathlib import Path
+
+import pytest
+
+from conftest import nt_hash
+from utils.radius import RadiusManager
+
+# ジャーナルへの記録の直後（authorizeへの書込前）に停止する
+CRASH_AFTER_JOURNAL = """
+import os
+import sys
+from utils.radius import RadiusManager
+
+path, state_dir, op, new_hash = sys.argv[1:5]
+manager = RadiusManager(path, state_dir=state_dir)
+journal_begin = RadiusManager._journal_begin
+
+def crash_after_journal(self, ops):
+    journal_begin(self, ops)
+    os._exit(9)
+
+RadiusManager._journal_begin = crash_after_journal
+if op == "add":
+    manager.add_user("carol", "pw", new_hash)
+else:
+    manager.delete_user("alice")
+"""
+
+# close()せずに（チェックポイントを取らずに）停止する
+KILL_WITHOUT_CLOSE = """
+import os
+import sys
+from utils.radius import RadiusManager
+
+path, state_dir, alice_hash, bob_hash = sys.argv[1:5]
+manager = RadiusManager(path, state_dir=state_dir)
+manager.add_user("alice", "pw", alice_hash)
+manager.add_user("bob", "pw", bob_hash)
+manager.delete_user("bob")
+manager.add_user("bob", "pw", bob_hash)
+os._exit(0)
+"""
+
+
+def _users(manager: RadiusManager) -> dict:
+    return {e.username: e.nt_hash for e in manager.list_users() if e.nt_hash}
+
+
+@pytest.mark.parametrize("op", ["add", "delete"])
+def test_journaled_commit_is_replayed(
+    authorize: Path, state_dir: Path, run_child, op: str
+):
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    manager.add_user("alice", "pw", nt_hash(1))
+    manager.close()
+    before = authorize.read_bytes()
+
+    result = run_child(
+        CRASH_AFTER_JOURNAL, [authorize, state_dir, op, nt_hash(3)],
+        check=False,
+    )
+    assert result.returncode == 9, result.stderr
+    assert authorize.read_bytes() == before
+
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    try:
+        if op == "add":
+            assert _users(manager) == {
+                "alice": nt_hash(1), "carol": nt_hash(3),
+            }
+        else:
+            assert _users(manager) == {}
+        # 再適用後はチェックポイントでジャーナルが空になる
+        assert (state_dir / "authorize.journal").stat().st_size == 0
+    finally:
+        manager.close()
+
+
+def test_restart_without_close_replays_nothing_twice(
+    authorize: Path, state_dir: Path, run_child
+):
+    run_child(KILL_WITHOUT_CLOSE, [authorize, state_dir, nt_hash(1),
+                                   nt_hash(2)])
+    assert (state_dir / "authorize.journal").stat().st_size > 0
+
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    try:
+        names = [e.username for e in manager.list_users() if e.nt_hash]
+        assert names == ["alice", "bob"]
+    finally:
+        manager.close()
+
+
+def test_hand_edit_after_kill_survives_restart(
+    authorize: Path, state_dir: Path, run_child
+):
+    run_child(KILL_WITHOUT_CLOSE, [authorize, state_dir, nt_hash(1),
+                                   nt_hash(2)])
+    assert (state_dir / "authorize.journal").stat().st_size > 0
+
+    # 停止後、Botの再起動前に管理者が手作業で編集する
+    text = authorize.read_text()
+    text = text.replace(nt_hash(1), nt_hash(10))
+    text += (
+        f'\ndave\tNT-Password := "{nt_hash(4)}"\n'
+        '\tReply-Message := "Welcome dave"\n'
+    )
+    authorize.write_text(text)
+
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    try:
+        assert _users(manager) == {
+            "alice": nt_hash(10), "bob": nt_hash(2), "dave": nt_hash(4),
+        }
+        assert authorize.read_text() == text
+    finally:
+        manager.close()
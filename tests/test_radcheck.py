@@ -0,0 +1,61 @@
+"""authorizeの外部での削除をradcheckへ反映する"""
+
+from pathlib import Path
+
+import pytest
+
+from conftest import nt_hash, wait_for
+from utils.radcheck import RadcheckWriter
+from utils.radius import RadiusManager
+
+@pytest.fixture
+def bot(authorize: Path, state_dir: Path, tmp_path: Path):
+    """Botと同じく監視とradcheckへの反映を有効にしたマネージャ"""
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    manager.add_user("alice", "pw", nt_hash(1))
+    manager.add_user("bob", "pw", nt_hash(2))
+    writer = RadcheckWriter(tmp_path / "radcheck.db").attach(manager)
+    manager.watch(poll_interval=0.05, use_inotify=False)
+    yield manager, writer
+    manager.close()
+    writer.close()
+
+
+def test_attach_syncs_current_users(bot):
+    manager, writer = bot
+    check, reply = writer.lookup("bob")
+    # (id, username, attribute, value, op)
+    assert [row[2:] for row in check] == [("NT-Password", nt_hash(2), ":=")]
+    assert [row[2:] for row in reply] == [
+        ("Reply-Message", "Welcome bob", ":="),
+    ]
+
+
+def test_cli_delete_is_mirrored(
+    bot, authorize: Path, state_dir: Path, run_cli, monkeypatch
+):
+    manager, writer = bot
+    # radcheckを知らない別のレプリカ・管理スクリプトとして削除する
+    monkeypatch.delenv("RADIUS_RADCHECK_DB", raising=False)
+    run_cli(
+        "--authorize", authorize, "--state-dir", state_dir, "delete", "bob"
+    )
+    assert wait_for(lambda: writer.lookup("bob") == ([], []))
+    assert manager.get_user("bob") is None
+    assert writer.lookup("alice")[0]
+
+
+def test_hand_edit_delete_is_mirrored(bot, authorize: Path):
+    manager, writer = bot
+    # bobのユーザー行と続くインデント行を手作業で消す
+    lines = authorize.read_text().splitlines(keepends=True)
+    start = next(i for i, raw in enumerate(lines) if raw.startswith("bob\t"))
+    end = start + 1
+    while end < len(lines) and lines[end].startswith("\t"):
+        end += 1
+    del lines[start:end]
+    authorize.write_text("".join(lines))
+
+    assert wait_for(lambda: writer.lookup("bob") == ([], []))
+    assert manager.get_user("bob") is None
+    assert writer.lookup("alice")[0]
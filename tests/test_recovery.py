@@ -0,0 +1,104 @@
+"""インプレース更新・追記の途中で停止した場合の意図ファイルからの復旧"""
+
+from pathlib import Path
+
+from conftest import nt_hash
+from utils.radius import RadiusManager
+
+# 既存ユーザーのNTハッシュのpwriteを途中まで書いて停止する
+TORN_PWRITE = """
+import os
+import sys
+from utils.radius import RadiusManager
+
+path, state_dir, new_hash = sys.argv[1:4]
+manager = RadiusManager(path, state_dir=state_dir)
+
+real_pwrite = os.pwrite
+
+def torn_pwrite(fd, data, offset):
+    real_pwrite(fd, data[:len(data) // 2], offset)
+    os._exit(9)
+
+os.pwrite = torn_pwrite
+manager.execute(lambda tx: tx.set_nt_hash("alice", new_hash))
+"""
+
+# 新規ユーザーのブロックの追記を途中まで書いて停止する
+TORN_APPEND = """
+import os
+import sys
+from utils.radius import RadiusManager
+
+path, state_dir, new_hash = sys.argv[1:4]
+manager = RadiusManager(path, state_dir=state_dir)
+
+def torn_append(self, data):
+    fd = os.open(self.authorize_file_path, os.O_WRONLY | os.O_APPEND)
+    os.write(fd, data[:len(data) // 2])
+    os._exit(9)
+
+RadiusManager._append_bytes = torn_append
+manager.add_user("carol", "pw", new_hash)
+"""
+
+
+def _seed(authorize: Path, state_dir: Path) -> None:
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    manager.add_user("alice", "pw", nt_hash(1))
+    manager.add_user("bob", "pw", nt_hash(2))
+    manager.close()
+
+
+def test_torn_pwrite_is_completed_from_intent(
+    authorize: Path, state_dir: Path, run_child
+):
+    _seed(authorize, state_dir)
+    result = run_child(
+        TORN_PWRITE, [authorize, state_dir, nt_hash(3)], check=False
+    )
+    assert result.returncode == 9, result.stderr
+
+    # 新旧が混ざったハッシュが書かれ、意図ファイルが残っている
+    text = authorize.read_text()
+    assert nt_hash(1) not in text and nt_hash(3) not in text
+    intent = state_dir / "authorize.inplace"
+    assert intent.exists()
+
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    try:
+        assert manager.get_user("alice").nt_hash == nt_hash(3)
+        assert manager.get_user("bob").nt_hash == nt_hash(2)
+        assert not intent.exists()
+    finally:
+        manager.close()
+
+
+def test_torn_append_is_rewritten_from_intent(
+    authorize: Path, state_dir: Path, run_child
+):
+    _seed(authorize, state_dir)
+    before = authorize.read_bytes()
+    result = run_child(
+        TORN_APPEND, [authorize, state_dir, nt_hash(3)], check=False
+    )
+    assert result.returncode == 9, result.stderr
+
+    # 途中までのブロックが末尾に残り、意図ファイルが残っている
+    torn = authorize.read_bytes()
+    assert torn.startswith(before) and len(torn) > len(before)
+    assert nt_hash(3).encode('ascii') not in torn
+    intent = state_dir / "authorize.inplace"
+    assert intent.exists()
+
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    try:
+        assert manager.get_user("carol").nt_hash == nt_hash(3)
+        assert [e.username for e in manager.list_users() if e.nt_hash] == [
+            "alice", "bob", "carol",
+        ]
+        text = authorize.read_text()
+        assert text.count(nt_hash(3)) == 1 and text.endswith("\n")
+        assert not intent.exists()
+    finally:
+        manager.close()
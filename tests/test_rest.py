@@ -0,0 +1,57 @@
+"""rlm_rest用の問い合わせエンドポイントと、authorizeの外部での削除"""
+
+import http.client
+import json
+from pathlib import Path
+
+import pytest
+
+from conftest import nt_hash, wait_for
+from utils.radius import RadiusManager
+from utils.rest import AuthorizeLookupServer
+
+
+@pytest.fixture
+def server(authorize: Path, state_dir: Path):
+    """Botと同じく監視を有効にしたマネージャで起動したエンドポイント"""
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    manager.add_user("alice", "pw", nt_hash(1))
+    manager.add_user("bob", "pw", nt_hash(2))
+    manager.watch(poll_interval=0.05, use_inotify=False)
+    server = AuthorizeLookupServer(manager, port=0).start()
+    yield server
+    server.stop()
+    manager.close()
+
+
+def _get(server: AuthorizeLookupServer, username: str):
+    conn = http.client.HTTPConnection(*server.address, timeout=5)
+    try:
+        conn.request("GET", f"/authorize/{username}")
+        response = conn.getresponse()
+        body = response.read()
+        return response.status, json.loads(body) if body else None
+    finally:
+        conn.close()
+
+
+def test_lookup_returns_rlm_rest_attributes(server):
+    status, body = _get(server, "bob")
+    assert status == 200
+    assert body == {
+        "control:NT-Password": {"op": ":=", "value": nt_hash(2)},
+        "reply:Reply-Message": {"op": ":=", "value": "Welcome bob"},
+    }
+    assert _get(server, "nobody") == (404, None)
+
+
+def test_cli_delete_is_visible(
+    server, authorize: Path, state_dir: Path, run_cli, monkeypatch
+):
+    assert _get(server, "bob")[0] == 200
+    monkeypatch.delenv("RADIUS_RADCHECK_DB", raising=False)
+    run_cli(
+        "--authorize", authorize, "--state-dir", state_dir, "delete", "bob"
+    )
+    assert wait_for(lambda: _get(server, "bob")[0] == 404)
+    assert _get(server, "alice")[0] == 200
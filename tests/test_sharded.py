@@ -0,0 +1,114 @@
+"""シャード化したauthorizeへの移行と、シャード数の変更"""
+
+from pathlib import Path
+
+import pytest
+
+from conftest import nt_hash
+from utils.radius import RadiusManager
+from utils.sharded import ShardedRadiusManager
+
+USERS = {f"user{i:02d}": nt_hash(i) for i in range(40)}
+
+
+def _seed(authorize: Path, state_dir: Path) -> None:
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    for name, value in USERS.items():
+        manager.add_user(name, "pw", value)
+    manager.close()
+
+
+def _open(
+    authorize: Path, state_dir: Path, shards: int
+) -> ShardedRadiusManager:
+    return ShardedRadiusManager(
+        str(authorize), shards=shards, state_dir=str(state_dir)
+    )
+
+
+def _assert_layout(manager: ShardedRadiusManager, authorize: Path) -> None:
+    """全ユーザーが所属シャードにだけあり、メインはDEFAULTと$INCLUDEのみ"""
+    users = {e.username: e.nt_hash for e in manager.list_users() if e.nt_hash}
+    assert users == USERS
+    for name in USERS:
+        assert manager.shard_for(name).get_user(name).nt_hash == USERS[name]
+    main = authorize.read_text()
+    assert not any(name in main for name in USERS)
+    includes = [
+        line for line in main.splitlines() if line.startswith("$INCLUDE")
+    ]
+    assert includes == [
+        f"$INCLUDE authorize.d/shard-{i:02d}"
+        for i in range(manager.shard_count)
+    ]
+    files = sorted(p.name for p in manager.shard_dir.glob("shard-*"))
+    assert files == [
+        f"shard-{i:02d}" for i in range(manager.shard_count)
+    ]
+
+
+def test_existing_users_move_to_shards(authorize: Path, state_dir: Path):
+    _seed(authorize, state_dir)
+    manager = _open(authorize, state_dir, 4)
+    try:
+        _assert_layout(manager, authorize)
+        # DEFAULTエントリはメインファイルに残る
+        assert "DEFAULT Framed-Protocol" in authorize.read_text()
+    finally:
+        manager.close()
+
+
+@pytest.mark.parametrize("resharded", [3, 6])
+def test_resharding_moves_users(
+    authorize: Path, state_dir: Path, resharded: int
+):
+    _seed(authorize, state_dir)
+    _open(authorize, state_dir, 4).close()
+
+    manager = _open(authorize, state_dir, resharded)
+    try:
+        _assert_layout(manager, authorize)
+        manager.add_user("late", "pw", nt_hash(100))
+        assert manager.delete_user("user00")
+        assert manager.get_user("late").nt_hash == nt_hash(100)
+        assert manager.get_user("user00") is None
+    finally:
+        manager.close()
+
+
+def test_transaction_requires_key(authorize: Path, state_dir: Path):
+    manager = _open(authorize, state_dir, 2)
+    try:
+        with pytest.raises(ValueError):
+            with manager.transaction():
+                pass
+        with manager.transaction("alice") as tx:
+            tx.add_user("alice", "pw", nt_hash(1))
+        assert manager.get_user("alice").nt_hash == nt_hash(1)
+    finally:
+        manager.close()
+
+
+def test_rollback_only_touches_the_users_shard(
+    authorize: Path, state_dir: Path
+):
+    manager = _open(authorize, state_dir, 4)
+    try:
+        for name, value in USERS.items():
+            manager.add_user(name, "pw", value)
+        target = "user01"
+        other = next(
+            name for name in USERS
+            if manager.shard_for(name) is not manager.shard_for(target)
+        )
+        # 削除は全体の書換のため、削除前の版がスナップショットに残る
+        manager.delete_user(target)
+        manager.delete_user(other)
+        generation = manager.snapshots(target)[0]['generation']
+
+        result = manager.rollback(generation, target)
+        assert result['changed'] == 1
+        assert manager.get_user(target).nt_hash == USERS[target]
+        assert manager.get_user(other) is None
+    finally:
+        manager.close()
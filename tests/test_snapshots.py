@@ -0,0 +1,107 @@
+"""世代スナップショットと巻き戻し"""
+
+import errno
+import hashlib
+import json
+from pathlib import Path
+
+import pytest
+
+from conftest import nt_hash
+from utils.radius import RadiusManager
+
+
+def _users(manager: RadiusManager) -> dict:
+    return {e.username: e.nt_hash for e in manager.list_users() if e.nt_hash}
+
+
+def _assert_objects_match_manifest(state_dir: Path) -> None:
+    """各世代のオブジェクトの内容がマニフェストのSHA-256・サイズと一致する"""
+    directory = state_dir / "authorize.snapshots"
+    manifest = json.loads((directory / "manifest.json").read_text())
+    assert manifest['generations']
+    for entry in manifest['generations']:
+        data = (directory / "objects" / entry['digest']).read_bytes()
+        assert hashlib.sha256(data).hexdigest() == entry['digest']
+        assert len(data) == entry['size']
+
+
+@pytest.fixture
+def manager(authorize: Path, state_dir: Path):
+    manager = RadiusManager(str(authorize), state_dir=str(state_dir))
+    manager.add_user("alice", "pw", nt_hash(1))
+    manager.add_user("bob", "pw", nt_hash(2))
+    # 削除は全体の書換のため、置き換えた版が世代として残る
+    manager.delete_user("bob")
+    manager.delete_user("alice")
+    yield manager
+    manager.close()
+
+
+def test_rollback_restores_generation(manager: RadiusManager, state_dir):
+    generations = manager.snapshots()
+    assert [g['reason'] for g in generations] == ["rewrite", "rewrite"]
+    oldest = generations[-1]['generation']
+
+    result = manager.rollback(oldest)
+    assert result == {
+        'generation': oldest,
+        'users_before': 0,
+        'users_after': 2,
+        'changed': 2,
+    }
+    assert _users(manager) == {"alice": nt_hash(1), "bob": nt_hash(2)}
+    # 巻き戻す前の内容も新しい世代として残る
+    assert manager.snapshots()[0]['reason'] == "rollback"
+    _assert_objects_match_manifest(state_dir)
+
+    with pytest.raises(ValueError):
+        manager.rollback(999)
+
+
+def test_rollback_direct_write_keeps_snapshot_objects(
+    manager: RadiusManager,
+    authorize: Path,
+    state_dir: Path,
+    monkeypatch,
+    caplog,
+):
+    generations = manager.snapshots()
+    # 1回目はリネームで巻き戻すため、authorizeはオブジェクトとinodeを共有する
+    manager.rollback(generations[-1]['generation'])
+    assert authorize.stat().st_nlink > 1
+
+    # authorizeを単独でバインドマウントしている場合のようにリネームを失敗させ、
+    # その場での上書き（直接書込）に切り替えさせる
+    replace = Path.replace
+
+    def busy_replace(self, target):
+        if Path(target) == authorize:
+            raise OSError(errno.EBUSY, "Device or resource busy")
+        return replace(self, target)
+
+    monkeypatch.setattr(Path, "replace", busy_replace)
+    result = manager.rollback(generations[0]['generation'])
+    monkeypatch.undo()
+    assert "Falling back to direct write" in caplog.text
+
+    assert result['users_after'] == 1
+    assert _users(manager) == {"alice": nt_hash(1)}
+    # 上書きしたinodeを共有していた世代のオブジェクトも壊れていない
+    _assert_objects_match_manifest(state_dir)
+    manager.rollback(generations[-1]['generation'])
+    assert _users(manager) == {"alice": nt_hash(1), "bob": nt_hash(2)}
+
+
+def test_snapshots_disabled(authorize: Path, state_dir: Path):
+    manager = RadiusManager(
+        str(authorize), state_dir=str(state_dir), snapshots=0
+    )
+    try:
+        manager.add_user("alice", "pw", nt_hash(1))
+        manager.delete_user("alice")
+        assert manager.snapshots() == []
+        with pytest.raises(RuntimeError):
+            manager.rollback(1)
+    finally:
+        manager.close()